@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import queue
+import threading
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Exists but belongs to someone else
+    return True
+
+
+class ActivityLog:
+    """Buffered activity pipeline that writes JSONL segments in the background.
+
+    Request threads only call log(), which is a non-blocking put into a bounded
+    buffer. A flusher thread drains the buffer in batches (when batch_size
+    events are pending or flush_interval seconds have passed) and appends them
+    to the current segment file. Segments rotate every segment_max_events
+    events and only the newest keep_segments per writing process are kept on
+    disk (several gunicorn workers share the folder). An optional
+    enrich(event) hook runs on the flusher thread just before an event is
+    written, for slow lookups that must stay off the request path.
+    """
+
+    def __init__(self, segment_dir, prefix='activity', max_buffer=5000, batch_size=200,
+                 flush_interval=5, segment_max_events=1000, keep_segments=5, sync_lock=None,
+                 enrich=None):
+        self.segment_dir = str(segment_dir)
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_max_events = segment_max_events
+        self.keep_segments = keep_segments
+        # Lock shared with the HF CommitScheduler so a sync never sees a torn batch
+        self.sync_lock = sync_lock
+        self.enrich = enrich
+        self._buffer = queue.Queue(maxsize=max_buffer)
+        self._write_lock = threading.Lock()
+        self._segment = None
+        self._segment_events = 0
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+    # --- Request path ---
+
+    def log(self, event):
+        """Queues an event without blocking. Returns False if it was dropped."""
+        try:
+            self._buffer.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # --- Flusher ---
+
+    def start(self):
+        """Starts the background flusher thread."""
+        if self._thread: return
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def flush(self):
+        """Writes everything currently buffered. Safe to call at shutdown."""
+        batch = []
+        while True:
+            try: batch.append(self._buffer.get_nowait())
+            except queue.Empty: break
+        if batch: self._write_batch(batch)
+
+    def _flush_loop(self):
+        while True:
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0: break
+                try: batch.append(self._buffer.get(timeout=remaining))
+                except queue.Empty: break
+            if not batch: continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"LOGGING ERROR: Failed to flush {len(batch)} events: {e}")
+
+    def _write_batch(self, batch):
+        if self.enrich:
+            for event in batch:
+                try: self.enrich(event)
+                except Exception as e: print(f"LOGGING ERROR: Enrichment failed: {e}")
+        self._write_batch_raw(batch)
+
+    def _write_batch_raw(self, batch):
+        lines = ''.join(json.dumps(event) + '\n' for event in batch)
+        with self._write_lock:
+            if self.sync_lock:
+                with self.sync_lock:
+                    self._append_locked(lines, len(batch))
+            else:
+                self._append_locked(lines, len(batch))
+            self.written += len(batch)
+            self.batches += 1
+
+    def _append_locked(self, lines, count):
+        if self._segment is None or self._segment_events >= self.segment_max_events:
+            self._rotate_locked()
+        self._segment.write(lines)
+        self._segment.flush()
+        self._segment_events += count
+
+    def _rotate_locked(self):
+        if self._segment is not None:
+            self._segment.close()
+        # The pid keeps segments of several worker processes apart
+        path = os.path.join(self.segment_dir, f"{self.prefix}-{int(time.time() * 1000)}-{os.getpid()}.jsonl")
+        self._segment = open(path, 'a')
+        self._segment_events = 0
+        self._prune(path)
+
+    def _prune(self, current):
+        """Drops old segments without ever touching a live worker's files.
+
+        Every process trims its own segments to keep_segments. Segments of
+        workers that have exited (and pre-pid ones) are trimmed by whoever
+        rotates next, to keep_segments of them in total.
+        """
+        pid = os.getpid()
+        own, orphaned = [], []
+        for path in self.segments():
+            owner = self._segment_pid(path)
+            if owner == pid: own.append(path)
+            elif owner is None or not _pid_alive(owner): orphaned.append(path)
+        for old in own[:-self.keep_segments] + orphaned[:-self.keep_segments]:
+            if old == current: continue
+            try: os.remove(old)
+            except OSError: pass
+
+    def _segment_pid(self, path):
+        """Writer pid from '<prefix>-<ms>-<pid>.jsonl'; None for older '<prefix>-<ms>.jsonl' names."""
+        parts = os.path.basename(path)[len(self.prefix) + 1:-len('.jsonl')].split('-')
+        return int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else None
+
+    # --- Readers ---
+
+    def segments(self):
+        """Segment paths, oldest first."""
+        names = [n for n in os.listdir(self.segment_dir)
+                 if n.startswith(self.prefix + '-') and n.endswith('.jsonl')]
+        return [os.path.join(self.segment_dir, n) for n in sorted(names)]
+
+    def recent(self, limit=1000):
+        """Returns up to `limit` of the newest flushed events, oldest first."""
+        events = []
+        for path in reversed(self.segments()):
+            chunk = []
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try: chunk.append(json.loads(line))
+                        except ValueError: continue
+            except OSError:
+                continue
+            events = chunk + events
+            if len(events) >= limit: break
+        return events[-limit:]
+
+    def import_legacy(self, path):
+        """Converts an old activity.json array into the first segment, once."""
+        if self.segments() or not os.path.exists(path): return 0
+        try:
+            with open(path, 'r') as f:
+                logs = json.load(f)
+        except Exception as e:
+            print(f"LOGGING ERROR: Could not import legacy {path}: {e}")
+            return 0
+        if logs: self._write_batch_raw(logs)
+        return len(logs)
+
+    def stats(self):
+        return {
+            'buffered': self._buffer.qsize(),
+            'dropped': self.dropped,
+            'written': self.written,
+            'batches': self.batches,
+            'segments': len(self.segments())
+        }
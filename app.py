@@ -2,28 +2,49 @@ import os
 import re
 import time
 import threading
-import yt_dlp
-import requests
 import uuid
 import json
 import firebase_admin
 from firebase_admin import credentials, auth
 import urllib.parse
-from huggingface_hub import CommitScheduler, hf_hub_download
+import requests
+from huggingface_hub import CommitScheduler, HfApi, hf_hub_download
 import shutil
+import atexit
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_from_directory, make_response
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, make_response, Response, stream_with_context
+from werkzeug.http import parse_range_header, is_resource_modified
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from job_store import JobStore, SharedJobStore
+from activity_log import ActivityLog
+from geoip import GeoIPResolver, UNKNOWN_LOCATION
+from download_counter import DownloadCounter
+from media_keys import canonical_media_id
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from preview_cache import PreviewCache
+from job_queue import DownloadScheduler, QueueFull
+from extraction_engine import ExtractionEngine, ExtractionRequest, ExtractionError
+from http_clients import HttpClients, Upstream, SizedBody
+from provider_race import ProviderRacer
+from tier_router import TierRouter, TierUnavailable, is_tier_failure
+from stream_cache import StreamCache
+from thumb_cache import ThumbnailCache, SharedThumbnailCache, normalize_url
+from thumb_derivatives import DerivativeMaker, derivative_spec, derivative_key
+from faststart import FastStartProcessor
+from storage_manager import StorageManager, SharedStorageManager
+from credit_store import CreditStore, SharedCreditStore
+from shared_state import SharedDB, claim_primary
+from cluster import Cluster, parse_nodes
+from tracing import Tracer
 
 app = Flask(__name__)
 
 @app.route('/debug/version')
 def debug_version():
     return jsonify({"version": "v32-persistence-pull-v2", "time": time.time()})
-# Global lock for user_credits to prevent race conditions
-data_lock = threading.Lock()
 # Simplified CORS for debugging - allows all origins and headers temporarily
 CORS(app, resources={r"/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization", "X-App-Secret"]}})
 
@@ -76,10 +97,85 @@ def verify_request():
     print(f"CRITICAL: verify_request FAILED - Referer: {referer}, Origin: {origin}, All Headers: {dict(request.headers)}")
     return False
 
+# Outbound HTTP: one pooled keep-alive session per upstream, with its own timeouts/retries
+http = HttpClients([
+    Upstream('y2mate', read_timeout=10),
+    Upstream('cobalt', read_timeout=10),
+    Upstream('geo', connect_timeout=2, read_timeout=5),
+    Upstream('github', connect_timeout=5, read_timeout=120, pool_size=4, retries=0),
+    Upstream('cdn_image', connect_timeout=5, read_timeout=60, pool_size=32),
+    Upstream('cdn_video', connect_timeout=5, read_timeout=120, pool_size=32),
+    # Peer replicas; the read timeout outlasts long-polls and SSE keepalive gaps
+    Upstream('cluster', connect_timeout=2, read_timeout=60, pool_size=32, retries=0)
+])
+
+def fetch_peer_health(base_url):
+    resp = http.get('cluster', f"{base_url}/cluster/health", timeout=(2, 5))
+    return resp.status_code, resp.json()
+
+# Multi-node routing: job IDs and filenames carry the node that owns them (see cluster.py)
+NODE_ID = os.environ.get('NODE_ID', 'local')
+CLUSTER_FORWARDED = 'X-Cluster-Forwarded'
+# Signs the forwarded marker; every node needs the same value
+CLUSTER_SECRET = os.environ.get('CLUSTER_SECRET')
+cluster = Cluster(NODE_ID, parse_nodes(os.environ.get('CLUSTER_NODES')), fetch_health=fetch_peer_health,
+                  secret=CLUSTER_SECRET)
+if cluster.enabled and not CLUSTER_SECRET:
+    print("CLUSTER WARNING: CLUSTER_SECRET is not set; forwarded requests can't be verified and are re-routed like client requests")
+cluster.start()
+# Headers that describe one hop and must not be relayed
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authorization', 'proxy-authenticate', 'host'}
+
+def owning_peer(key, headers):
+    """Peer that owns a job ID/filename, unless a peer already forwarded this request once."""
+    owner = cluster.owner(key)
+    # Only checked when there is somewhere to forward to; a client-set header never passes
+    if owner and cluster.is_forwarded(headers.get(CLUSTER_FORWARDED)): return None
+    return owner
+
+def forward_to_node(node):
+    """Relays the current request to a peer node and streams its response back."""
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    headers[CLUSTER_FORWARDED] = cluster.forwarded_marker()
+    headers['X-Forwarded-For'] = get_client_ip()
+    body = None
+    if request.method in ('POST', 'PUT'):
+        body = request.stream if request.content_length is None else SizedBody(request.stream, request.content_length)
+    try:
+        resp = http.request('cluster', request.method, cluster.url_of(node) + request.full_path,
+                            headers=headers, data=body, stream=True, allow_redirects=False)
+    except requests.RequestException as e:
+        print(f"CLUSTER ERROR: Forward to {node} failed: {e}")
+        return jsonify({'success': False, 'status': 'node_unavailable', 'node': node,
+                        'message': 'The server holding this job is unreachable, retry shortly.'}), 503
+    cluster.count_forwarded()
+
+    def generate():
+        try:
+            # Raw bytes: Content-Encoding and Content-Length stay valid as relayed
+            for chunk in resp.raw.stream(64 * 1024, decode_content=False):
+                yield chunk
+        finally:
+            resp.close()
+
+    relayed = [(k, v) for k, v in resp.headers.items()
+               if k.lower() not in HOP_HEADERS and not k.lower().startswith('access-control-')]
+    return Response(stream_with_context(generate()), status=resp.status_code, headers=relayed)
+
+def hand_off_download():
+    """A draining node passes new downloads to a healthy peer; None means handle it here."""
+    if not cluster.draining or cluster.is_forwarded(request.headers.get(CLUSTER_FORWARDED)): return None
+    peer = cluster.pick_peer()
+    if peer is None: return None
+    cluster.count_handed_off()
+    return forward_to_node(peer)
+
 # Persistent Storage Configuration (JSON files)
 # We use a /data folder if it exists (HF Persistent Storage), otherwise we use root
 DATA_DIR = Path("data") if os.path.exists("data") else Path(".")
 ACTIVITY_FILE = DATA_DIR / 'activity.json'
+ACTIVITY_DIR = DATA_DIR / 'activity_logs' # JSONL segments written by ActivityLog
 STATS_FILE = DATA_DIR / 'stats.json'
 JOBS_FILE = DATA_DIR
 # Configuration
@@ -94,15 +190,23 @@ POT_FILE = os.path.join(DOWNLOAD_FOLDER, 'youtube_pot.txt')
 # ensure the data directory exists
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Multi-worker mode (gunicorn -w N): credits, jobs and rate limits live in one SQLite file
+SHARED_STATE_DB = os.environ.get('SHARED_STATE_DB')
+shared_db = SharedDB(SHARED_STATE_DB) if SHARED_STATE_DB else None
+# Singleton chores (HF sync, job snapshot, legacy imports) belong to a single worker
+is_primary = claim_primary(SHARED_STATE_DB + '.primary') if shared_db else True
+
 # Hugging Face Hub Persistence (Commit logs to a Dataset every 5 mins)
 scheduler = None
 hf_token = os.environ.get('HF_TOKEN')
 dataset_id = os.environ.get('DATASET_ID', 'Argha-7/insta-downloader-logs')
 
-if hf_token:
+if hf_token and not is_primary:
+    print("HF Hub sync runs in the primary worker.")
+elif hf_token:
     try:
         # Pull latest data from Hub before starting scheduler
-        for filename in ['activity.json', 'stats.json', 'jobs.json']:
+        for filename in ['activity.json', 'stats.json', 'jobs.json', 'jobs.journal.jsonl']:
             try:
                 # We expect files to be in the 'logs/' prefix in the repo based on path_in_repo="logs"
                 downloaded_path = hf_hub_download(
@@ -116,6 +220,23 @@ if hf_token:
             except Exception as e:
                 print(f"Note: Could not pull {filename} from HF Hub (might be a new setup): {e}")
 
+        # Pull the newest activity segments so the dashboard survives restarts
+        try:
+            remote_files = HfApi(token=hf_token).list_repo_files(repo_id=dataset_id, repo_type="dataset")
+            segments = sorted(f for f in remote_files if f.startswith("logs/activity_logs/") and f.endswith(".jsonl"))
+            ACTIVITY_DIR.mkdir(parents=True, exist_ok=True)
+            for remote_name in segments[-5:]:
+                downloaded_path = hf_hub_download(
+                    repo_id=dataset_id,
+                    filename=remote_name,
+                    repo_type="dataset",
+                    token=hf_token
+                )
+                shutil.copy(downloaded_path, ACTIVITY_DIR / os.path.basename(remote_name))
+            print(f"Successfully pulled {len(segments[-5:])} activity segments from HF Hub.")
+        except Exception as e:
+            print(f"Note: Could not pull activity segments from HF Hub: {e}")
+
         # Pull credentials if available
         for extra in ['youtube_cookies.txt', 'youtube_pot.txt']:
             try:
@@ -162,12 +283,14 @@ limiter = Limiter(
     get_client_ip,
     app=app,
     default_limits=["2000 per day", "500 per hour"],
-    storage_uri="memory://",
+    # Counters must be shared once several workers serve requests (RATELIMIT_STORAGE_URI may point at Redis)
+    storage_uri=os.environ.get('RATELIMIT_STORAGE_URI') or (
+        f"sqlite://{os.path.abspath(SHARED_STATE_DB)}" if shared_db else "memory://"
+    ),
 )
 
-# Usage tracking (Credits & Cash System)
-# Format: {ip: {'credits': 50, 'balance': 0.0, 'referral_id': '...', 'last_activity': timestamp}}
-user_credits = {}
+# Usage tracking (Credits & Cash System); users idle for a day are forgotten
+credit_store = SharedCreditStore(shared_db, ttl=86400) if shared_db else CreditStore(ttl=86400)
 DEFAULT_CREDITS = 100
 DOWNLOAD_COST = 10
 SHARE_REWARD = 20
@@ -178,121 +301,121 @@ REFERRAL_CASH_REWARD = 2.00  # ₹2.00 per new referral
 STATS_FILE = 'stats.json'
 START_EPOCH = 1740787200  # March 1, 2026
 
+STATS_CACHE_SECONDS = int(os.environ.get('STATS_CACHE_SECONDS', 60)) # Matches the Blogger widget poll interval
+
+# Counted in memory, written to stats.json in the background and at exit
+download_counter = DownloadCounter(
+    STATS_FILE,
+    flush_every=int(os.environ.get('STATS_FLUSH_INTERVAL', 30)),
+    sync_lock=scheduler.lock if scheduler else None,
+    shared=bool(shared_db)
+)
+download_counter.load()
+download_counter.start()
+atexit.register(download_counter.flush)
+
 def load_stats():
     # Base calculation
     seconds_since_start = time.time() - START_EPOCH
     base_count = 1540 + int(seconds_since_start / 1800)
-    
-    current_inc = 0
-    if os.path.exists(STATS_FILE):
-        try:
-            with open(STATS_FILE, 'r') as f:
-                data = json.load(f)
-                current_inc = data.get("increment", 0)
-        except: pass
-    
-    return {"total_downloads": base_count + current_inc}
-
-def save_stats(increment):
-    if scheduler:
-        with scheduler.lock:
-            with open(STATS_FILE, 'w') as f:
-                json.dump({"increment": increment}, f)
-    else:
-        with open(STATS_FILE, 'w') as f:
-            json.dump({"increment": increment}, f)
+    return {"total_downloads": base_count + download_counter.value}
 
 def increment_downloads():
-    current_inc = 0
-    if os.path.exists(STATS_FILE):
-        try:
-            with open(STATS_FILE, 'r') as f:
-                data = json.load(f)
-                current_inc = data.get("increment", 0)
-        except: pass
-    
-    save_stats(current_inc + 1)
+    download_counter.increment()
     return load_stats()["total_downloads"]
 
 ACTIVITY_FILE = 'activity.json'
-geo_cache = {}
+GEOIP_DB_FILE = os.environ.get('GEOIP_DB', str(DATA_DIR / 'geoip.csv'))
+GEOIP_ONLINE = os.environ.get('GEOIP_ONLINE', '1') == '1' # Enrich unknown IPs via ip-api.com in the background
 
-def get_location(ip):
-    """Fetches location data for an IP with simple in-memory caching."""
-    if ip in geo_cache:
-        return geo_cache[ip]
-    
-    # Skip geolocation for local IPs
-    if ip == "127.0.0.1" or ip.startswith("192.168."):
-        return "Local/Internal"
-        
+def fetch_location_online(ip):
+    """Fetches location data for an IP from ip-api.com (slow, never on the request path)."""
     try:
         # Using ip-api.com (Free, no key required)
-        response = requests.get(f"http://ip-api.com/json/{ip}", timeout=5)
+        response = http.get('geo', f"http://ip-api.com/json/{ip}")
         if response.status_code == 200:
             data = response.json()
             if data.get('status') == 'success':
-                location = f"{data.get('city', 'Unknown')}, {data.get('regionName', 'Unknown')}, {data.get('country', 'Unknown')}"
-                geo_cache[ip] = location
-                return location
+                return f"{data.get('city', 'Unknown')}, {data.get('regionName', 'Unknown')}, {data.get('country', 'Unknown')}"
     except Exception as e:
         print(f"GEO ERROR: {e}")
+    return None
+
+geo_resolver = GeoIPResolver(
+    GEOIP_DB_FILE,
+    cache_size=int(os.environ.get('GEOIP_CACHE_SIZE', 10000)),
+    online_lookup=fetch_location_online if GEOIP_ONLINE else None
+)
+geo_resolver.load_async()
+
+def get_location(ip):
+    """Resolves an IP from the local GeoIP index (microseconds, bounded LRU)."""
+    return geo_resolver.lookup(ip)
+
+def enrich_location(event):
+    """Flusher hook: fills in locations the local index couldn't answer.
+
+    Never waits on ip-api.com: an IP missing from the index is logged as
+    unknown and looked up in the background for its next event.
+    """
+    if event.get('location') in (None, UNKNOWN_LOCATION) and event.get('ip'):
+        event['location'] = geo_resolver.lookup(event['ip'], allow_online=True)
+
+# Events are queued in memory and flushed to JSONL segments by a background thread
+activity_log = ActivityLog(
+    ACTIVITY_DIR,
+    max_buffer=int(os.environ.get('ACTIVITY_BUFFER', 5000)),
+    keep_segments=5,
+    sync_lock=scheduler.lock if scheduler else None,
+    enrich=enrich_location
+)
+imported = activity_log.import_legacy(ACTIVITY_FILE) if is_primary else 0
+if imported: print(f"Imported {imported} legacy events from {ACTIVITY_FILE}")
+activity_log.start()
+atexit.register(activity_log.flush)
+
+def activity_event(activity_type, details, headers, remote_addr, fb_user=None):
+    """One activity record built from request headers (the ASGI front has no Flask request)."""
+    forwarded = headers.get('X-Forwarded-For')
+    ip = forwarded.split(',')[0].strip() if forwarded else (remote_addr or "127.0.0.1")
+    user_email = "Guest"
+    user_name = "Anonymous"
+    
+    # Extract guest info from headers if available
+    guest_name = headers.get('X-Guest-Name')
+    guest_email = headers.get('X-Guest-Email')
     
-    return "Unknown Location"
+    # Extract authenticated user info if available
+    if fb_user:
+        user_email = fb_user.get('email', 'Guest')
+        user_name = fb_user.get('name', 'Anonymous')
+    elif guest_email:
+        user_email = guest_email
+        user_name = guest_name or "Guest"
+        
+    # Extract discovery source (how they found the site)
+    discovery_source = headers.get('X-Discovery-Source', 'Unknown')
+    if discovery_source == 'Unknown' and headers.get('Referer'):
+        discovery_source = f"Referrer: {headers.get('Referer')}"
+        
+    return {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'type': activity_type,
+        'ip': ip,
+        'user_email': user_email,
+        'user_name': user_name,
+        'user_agent': headers.get('User-Agent'),
+        'location': get_location(ip),
+        'discovery_source': discovery_source,
+        'details': details
+    }
 
 def log_activity(activity_type, details):
-    """Logs user activity to a persistent file with geolocation."""
+    """Queues a user activity event (with geolocation) for the background flusher."""
     try:
-        ip = get_client_ip()
-        user_email = "Guest"
-        user_name = "Anonymous"
-        
-        # Extract guest info from headers if available
-        guest_name = request.headers.get('X-Guest-Name')
-        guest_email = request.headers.get('X-Guest-Email')
-        
-        # Extract authenticated user info if available
-        if hasattr(request, 'fb_user'):
-            user_email = request.fb_user.get('email', 'Guest')
-            user_name = request.fb_user.get('name', 'Anonymous')
-        elif guest_email:
-            user_email = guest_email
-            user_name = guest_name or "Guest"
-            
-        # Extract discovery source (how they found the site)
-        discovery_source = request.headers.get('X-Discovery-Source', 'Unknown')
-        if discovery_source == 'Unknown' and request.referrer:
-            discovery_source = f"Referrer: {request.referrer}"
-            
-        activity = {
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'type': activity_type,
-            'ip': ip,
-            'user_email': user_email,
-            'user_name': user_name,
-            'location': get_location(ip),
-            'discovery_source': discovery_source,
-            'details': details
-        }
-        
-        # Local file logging with scheduler lock
-        logs = []
-        if os.path.exists(ACTIVITY_FILE):
-            try:
-                with open(ACTIVITY_FILE, 'r') as f:
-                    logs = json.load(f)
-            except: logs = []
-        
-        logs.append(activity)
-        if len(logs) > 1000: logs = logs[-1000:]
-            
-        if scheduler:
-            with scheduler.lock:
-                with open(ACTIVITY_FILE, 'w') as f:
-                    json.dump(logs, f, indent=4)
-        else:
-            with open(ACTIVITY_FILE, 'w') as f:
-                json.dump(logs, f, indent=4)
+        activity_log.log(activity_event(
+            activity_type, details, request.headers, request.remote_addr, getattr(request, 'fb_user', None)
+        ))
     except Exception as e:
         print(f"LOGGING ERROR: {e}")
 
@@ -300,8 +423,6 @@ def serialize_firestore_data(data):
     """(Kept for compatibility, though Firestore is removed)"""
     return data
 
-def generate_ref_id():
-    return str(uuid.uuid4())[:8]
 def get_user_data(ip, gift=None, device_id=None):
     """Helper to get or initialize user data with multi-layer ID tracking."""
     # Priority: Firebase UID > Device ID > IP Address
@@ -310,105 +431,134 @@ def get_user_data(ip, gift=None, device_id=None):
         user_key = request.fb_user['uid']
     elif device_id:
         user_key = f"did_{device_id}"
-    
-    with data_lock:
-        # Aggressive Logging
-        print(f"CRITICAL DEBUG: get_user_data(key={user_key}, ip={ip}, device_id={device_id}, gift={gift})")
 
-        if user_key not in user_credits:
-            initial_credits = 1000 if gift == 'bonus100' else DEFAULT_CREDITS
-            
-            # Check if the request contains a referral ID
-            ref_id = None
-            if request.is_json:
-                try: ref_id = request.json.get('ref')
-                except: pass
-            if not ref_id: ref_id = request.args.get('ref')
-            
-            user_credits[user_key] = {
-                'credits': initial_credits, 
-                'balance': 0.0,
-                'referral_id': generate_ref_id(),
-                'last_activity': time.time(),
-                'is_auth': True if hasattr(request, 'fb_user') else False
-            }
-            print(f"CRITICAL DEBUG: NEW USER {user_key} initialized with {initial_credits}")
-
-            # Reward the referrer if valid
-            if ref_id:
-                for other_key, data in user_credits.items():
-                    if data['referral_id'] == ref_id and other_key != user_key:
-                        data['balance'] += REFERRAL_CASH_REWARD
-                        print(f"REFERRAL REWARD: {other_key} earned ₹{REFERRAL_CASH_REWARD}")
-                        break
-        
-        # Aggressive Reset Logic: If credits are 0 or None, and it's not a known exhausted user
-        # We'll allow them some slack if they are new or just reset
-        target = 1000 if gift == 'bonus100' else DEFAULT_CREDITS
-        current_credits = user_credits[user_key].get('credits', 0)
-        
-        if current_credits < 10 or gift == 'bonus100':
-            # Only reset if they aren't actually using it (to prevent infinite downloads)
-            # But for the 0 problem, we force it once
-            user_credits[user_key]['credits'] = target
-            print(f"CRITICAL DEBUG: REFRESHED {user_key} credits: {current_credits} -> {target}")
-
-        user_credits[user_key]['last_activity'] = time.time()
-        
-        # Periodic Cleanup: Remove entries older than 24h
-        if len(user_credits) > 500:
-            now = time.time()
-            to_delete = [k for k, v in user_credits.items() if now - v.get('last_activity', 0) > 86400]
-            for k in to_delete:
-                del user_credits[k]
-                print(f"DEBUG: AUTO-CLEANUP removed {k}")
-
-        return user_credits[user_key]
+    initial_credits = 1000 if gift == 'bonus100' else DEFAULT_CREDITS
+    user_data, created = credit_store.get_or_create(user_key, initial_credits, is_auth=hasattr(request, 'fb_user'))
+    if created:
+        # Check if the request contains a referral ID
+        ref_id = None
+        if request.is_json:
+            try: ref_id = request.json.get('ref')
+            except: pass
+        if not ref_id: ref_id = request.args.get('ref')
+        # Reward the referrer if valid
+        referrer = credit_store.reward_referrer(ref_id, REFERRAL_CASH_REWARD, exclude=user_key) if ref_id else None
+        log_activity('user_created', {'user_key': user_key, 'credits': initial_credits,
+                                      'referrer': referrer, 'referral_reward': REFERRAL_CASH_REWARD if referrer else 0})
+
+    # Aggressive Reset Logic: If credits are 0 or None, and it's not a known exhausted user
+    # We'll allow them some slack if they are new or just reset
+    credit_store.refill(user_data, 10, initial_credits, force=gift == 'bonus100')
+    return user_data
 JOBS_FILE = 'jobs.json'
-
-def load_jobs():
-    # Only use for local fallback
-    if os.path.exists(JOBS_FILE):
-        try:
-            with open(JOBS_FILE, 'r') as f:
-                return json.load(f)
-        except: return {}
-    return {}
+JOBS_JOURNAL_FILE = 'jobs.journal.jsonl'
+JOB_TTL = int(os.environ.get('JOB_TTL', 86400)) # Jobs stay pollable for 24h
+
+if shared_db:
+    # Any worker can answer /status; only the primary writes jobs.json for the HF sync
+    job_store = SharedJobStore(
+        shared_db,
+        ttl=JOB_TTL,
+        snapshot_path=JOBS_FILE if is_primary else None,
+        journal_path=JOBS_JOURNAL_FILE,
+        sync_lock=scheduler.lock if scheduler else None
+    )
+else:
+    # Jobs live in memory; jobs.json is only a periodic snapshot of the journal
+    job_store = JobStore(
+        JOBS_FILE,
+        JOBS_JOURNAL_FILE,
+        ttl=JOB_TTL,
+        sync_lock=scheduler.lock if scheduler else None
+    )
+job_store.recover()
+job_store.start()
+
+# Per-stage latency spans: histograms for /api/admin/metrics, per-job timelines for admins on /status
+tracer = Tracer(max_spans=int(os.environ.get('TRACE_MAX_SPANS', 64)))
 
 def save_job(job_id, data):
-    with data_lock:
-        jobs = load_jobs()
-        if job_id in jobs: jobs[job_id].update(data)
-        else: jobs[job_id] = data
-        if len(jobs) > 100:
-            sorted_jobs = sorted(jobs.items(), key=lambda x: x[1].get('timestamp', 0), reverse=True)
-            jobs = dict(sorted_jobs[:100])
-        
-        if scheduler:
-            with scheduler.lock:
-                with open(JOBS_FILE, 'w') as f:
-                    json.dump(jobs, f, indent=4)
-        else:
-            with open(JOBS_FILE, 'w') as f:
-                json.dump(jobs, f, indent=4)
+    with tracer.span('save_job'):
+        job_store.put(job_id, data)
+
+def save_jobs(updates):
+    with tracer.span('save_job', jobs=len(updates)):
+        job_store.put_many(updates)
 
 def get_job(job_id):
-    jobs = load_jobs()
-    return jobs.get(job_id)
-
-# Cleanup task to delete files older than 20 minutes
-def cleanup_files():
-    while True:
-        now = time.time()
-        for f in os.listdir(DOWNLOAD_FOLDER):
-            file_path = os.path.join(DOWNLOAD_FOLDER, f)
-            if os.stat(file_path).st_mtime < now - 1200: # 20 minutes
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    print(f"Deleted old file: {f}")
-        time.sleep(300)
-
-threading.Thread(target=cleanup_files, daemon=True).start()
+    job = job_store.get(job_id)
+    # Coalesced downloads point at the job that is actually doing the work
+    if job and job.get('alias_of'):
+        return job_store.get(job['alias_of']) or job
+    return job
+
+# Download folder quota/age enforcement (cookie and POT files live there too and are never touched)
+storage_options = dict(
+    max_bytes=int(os.environ.get('STORAGE_MAX_BYTES', 5 * 1024 ** 3)),
+    max_age=int(os.environ.get('FILE_MAX_AGE', 1200)),
+    protected=(os.path.basename(COOKIES_FILE), os.path.basename(POT_FILE))
+)
+if shared_db:
+    # One index, quota and set of pins for every worker; only the primary runs the age sweep
+    storage = SharedStorageManager(DOWNLOAD_FOLDER, shared_db, sweep=is_primary, **storage_options)
+else:
+    storage = StorageManager(DOWNLOAD_FOLDER, **storage_options)
+
+# One extraction per media in flight; late arrivals share the leader's outcome
+download_flights = SingleFlight('download')
+preview_flights = SingleFlight('preview')
+
+def flight_key(url):
+    """Coalescing key: canonical media ID, or the query-less URL for unknown sites."""
+    return canonical_media_id(url) or url.split('?')[0].rstrip('/')
+
+# /preview payloads, kept until shortly before their signed CDN links expire
+preview_cache = PreviewCache(
+    max_entries=int(os.environ.get('PREVIEW_CACHE_SIZE', 2000)),
+    default_ttl=int(os.environ.get('PREVIEW_CACHE_TTL', 3600)),
+    safety_margin=int(os.environ.get('PREVIEW_CACHE_MARGIN', 600))
+)
+
+# Read-while-write cache shared by /dl-proxy downloads of the same CDN URL
+def worker_cache_dir(base):
+    """Per-worker subfolder in multi-worker mode (a cache wipes its folder on start); drops dead workers' folders."""
+    if not shared_db: return base
+    os.makedirs(base, exist_ok=True)
+    for name in os.listdir(base):
+        if not name.startswith('worker-'): continue
+        try:
+            os.kill(int(name[7:]), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+        except (ValueError, OSError):
+            pass
+    return os.path.join(base, f"worker-{os.getpid()}")
+
+stream_cache = StreamCache(
+    worker_cache_dir(os.environ.get('STREAM_CACHE_DIR', os.path.join(os.getcwd(), 'stream_cache'))),
+    max_bytes=int(os.environ.get('STREAM_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+)
+
+# Disk-backed LRU for /proxy-img thumbnails, keyed by normalized URL (one index for all workers)
+THUMB_CACHE_DIR = os.environ.get('THUMB_CACHE_DIR', os.path.join(os.getcwd(), 'thumb_cache'))
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+if shared_db:
+    thumb_cache = SharedThumbnailCache(THUMB_CACHE_DIR, shared_db, max_bytes=THUMB_CACHE_MAX_BYTES)
+else:
+    thumb_cache = ThumbnailCache(THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES)
+
+# Resized WebP/JPEG thumbnails (?w=&fmt=), rendered off the request path
+thumb_derivatives = DerivativeMaker(thumb_cache, workers=int(os.environ.get('THUMB_WORKERS', 2)))
+
+# Finished local downloads keyed by media ID (TTL stays below the storage max age)
+result_cache = ResultCache(
+    DOWNLOAD_FOLDER,
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 900)),
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 ** 3)),
+    on_evict=storage.demote
+)
+storage.on_remove = result_cache.discard_file
+storage.start()
 
 @app.route('/manifest.json')
 def serve_manifest():
@@ -434,9 +584,8 @@ def share_target():
     import re
     urls = re.findall(r'(https?://\S+)', url)
     if urls:
-        target_url = urls[0]
-        # Redirect to app page with the URL pre-filled
-        return render_template('app_pwa.html', prefill_url=target_url)
+        # Render the app with every shared link pre-filled (several go out as one batch)
+        return render_template('app_pwa.html', prefill_url=urls[0], prefill_urls=list(dict.fromkeys(urls)))
     
     return "Invalid link. Please try again.", 400
 
@@ -460,6 +609,9 @@ def trigger_github_action(video_url, job_id, workflow="insta_download.yml"):
     if space_id:
         host = space_id.replace('/', '-').lower()
         callback_url = f"https://{host}.hf.space/github-callback?job_id={job_id}"
+    elif cluster.enabled:
+        # Peers forward the callback to us anyway; go straight to our own address
+        callback_url = f"{cluster.url_of(NODE_ID)}/github-callback?job_id={job_id}"
     else:
         # Fallback for local testing (won't work for callback but for trigger)
         callback_url = f"{request.url_root.rstrip('/')}/github-callback?job_id={job_id}"
@@ -473,7 +625,7 @@ def trigger_github_action(video_url, job_id, workflow="insta_download.yml"):
     }
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
+        response = http.post('github', url, headers=headers, json=payload)
         if response.status_code == 204:
             print(f"DEBUG: GitHub Action triggered successfully: {workflow}")
             return True
@@ -498,63 +650,189 @@ def download_video(url, workflow_to_use=None, existing_job_id=None):
     """Main download logic with local-first, then GitHub failover."""
     platform = get_platform(url)
     
-def extract_professional(url):
-    """Attempts to extract video links using professional backend APIs."""
-    print(f"DEBUG: Attempting professional extraction for {url}")
-    
-    # 1. Try y2mate.tools API (Reliable mirror)
+def provider_json(name, r, cancel):
+    """JSON body of a streamed provider response, or None when it has nothing for the URL.
+
+    If the race was decided while we waited for the headers, the connection is
+    closed with the body unread. 5xx answers raise so they count against the provider.
+    """
+    with r:
+        if cancel.is_set(): return None
+        if r.status_code >= 500: raise TierUnavailable(f"{name} answered {r.status_code}")
+        if r.status_code != 200: return None
+        return r.json()
+
+def pro_y2mate(url, cancel):
+    """y2mate.tools API (Reliable mirror)."""
     try:
         api_url = f"https:/""/api2.y2mate.tools/api/v1/info?url={url}"
-        r = requests.get(api_url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-        if r.status_code == 200:
-            data = r.json()
-            if data.get('status') == 'success':
-                video_data = data.get('data', {})
-                # Find best MP4 link
-                formats = video_data.get('formats', [])
-                best_url = ""
-                for f in formats:
-                    if f.get('type') == 'mp4' and f.get('quality') in ['720p', '1080p']:
-                        best_url = f.get('url')
-                        break
-                if not best_url and formats:
-                    best_url = formats[0].get('url')
-                
-                if best_url:
-                    print("SUCCESS: Professional extraction via y2mate.tools")
-                    return {
-                        'title': video_data.get('title', 'YouTube Video'),
-                        'thumbnail': video_data.get('thumbnail', ''),
-                        'hd_url': best_url,
-                        'sd_url': best_url,
-                        'uploader': 'Pro API'
-                    }
+        r = http.get('y2mate', api_url, headers={'User-Agent': 'Mozilla/5.0'}, stream=True)
+        data = provider_json('y2mate', r, cancel)
+        if data and data.get('status') == 'success':
+            video_data = data.get('data', {})
+            # Find best MP4 link
+            formats = video_data.get('formats', [])
+            best_url = ""
+            for f in formats:
+                if f.get('type') == 'mp4' and f.get('quality') in ['720p', '1080p']:
+                    best_url = f.get('url')
+                    break
+            if not best_url and formats:
+                best_url = formats[0].get('url')
+            
+            if best_url:
+                print("SUCCESS: Professional extraction via y2mate.tools")
+                return {
+                    'title': video_data.get('title', 'YouTube Video'),
+                    'thumbnail': video_data.get('thumbnail', ''),
+                    'hd_url': best_url,
+                    'sd_url': best_url,
+                    'uploader': 'Pro API'
+                }
+    except (requests.RequestException, TierUnavailable) as e:
+        # Transport errors and 5xx count against the provider; the racer sees them raised
+        if cancel.is_set(): return None
+        print(f"Pro API y2mate Failed: {e}")
+        raise
     except Exception as e:
-        print(f"Pro API 1 Failed: {e}")
+        print(f"Pro API y2mate Failed: {e}")
+    return None
 
-    # 2. Try Cobalt API (High Quality Backup)
+def pro_cobalt(url, cancel):
+    """Cobalt API (High Quality Backup)."""
     try:
         api_url = "https:/""/api.cobalt.tools/api/json"
         data = {"url": url, "videoQuality": "720"}
-        r = requests.post(api_url, json=data, timeout=10, headers={'Accept': 'application/json'})
-        if r.status_code == 200:
-            res = r.json()
-            if res.get('status') == 'stream' or res.get('url'):
-                print("SUCCESS: Professional extraction via Cobalt")
-                return {
-                    'title': 'YouTube Video',
-                    'thumbnail': '',
-                    'hd_url': res.get('url'),
-                    'sd_url': res.get('url'),
-                    'uploader': 'Cobalt API'
-                }
+        r = http.post('cobalt', api_url, json=data, headers={'Accept': 'application/json'}, stream=True)
+        res = provider_json('cobalt', r, cancel)
+        if res and (res.get('status') == 'stream' or res.get('url')):
+            print("SUCCESS: Professional extraction via Cobalt")
+            return {
+                'title': 'YouTube Video',
+                'thumbnail': '',
+                'hd_url': res.get('url'),
+                'sd_url': res.get('url'),
+                'uploader': 'Cobalt API'
+            }
+    except (requests.RequestException, TierUnavailable) as e:
+        if cancel.is_set(): return None
+        print(f"Pro API cobalt Failed: {e}")
+        raise
     except Exception as e:
-        print(f"Pro API 2 Failed: {e}")
+        print(f"Pro API cobalt Failed: {e}")
+    return None
+
+# Professional providers race each other: fastest-known first, the next one is
+# hedged in after the leader's observed p90 latency. New providers only need
+# a fn(url, cancel) -> result | None (raising on transport errors and 5xx) and a
+# register() call; `cancel` is set once the race is decided.
+PRO_RACE_TIMEOUT = int(os.environ.get('PRO_RACE_TIMEOUT', 15))
+professional_racer = ProviderRacer()
+professional_racer.register('y2mate', pro_y2mate)
+professional_racer.register('cobalt', pro_cobalt)
+
+def extract_professional(url):
+    """Attempts to extract video links using professional backend APIs."""
+    print(f"DEBUG: Attempting professional extraction for {url}")
+    with tracer.span('extract_professional') as span:
+        provider, result = professional_racer.race(url, timeout=PRO_RACE_TIMEOUT)
+        span.update({'provider': provider, 'ok': bool(result)})
+    if provider:
+        print(f"DEBUG: Professional race won by {provider}")
+    return result
+
+# Adaptive routing over the download tiers (professional API -> local yt-dlp -> GitHub)
+tier_router = TierRouter(
+    # Priors only decide the order until real samples exist; they match the old fixed chain
+    prior_latency={'professional': 3, 'local': 15, 'github': 120},
+    failure_threshold=float(os.environ.get('ROUTER_FAILURE_THRESHOLD', 0.6)),
+    open_seconds=int(os.environ.get('ROUTER_OPEN_SECONDS', 60)),
+    probe_ratio=float(os.environ.get('ROUTER_PROBE_RATIO', 0.1))
+)
+
+# Optional moov-to-front remux of finished downloads so /files playback starts immediately
+FASTSTART_ENABLED = os.environ.get('FASTSTART', '1') == '1'
+faststart = FastStartProcessor(workers=int(os.environ.get('FASTSTART_WORKERS', 1)))
 
+def faststart_file(path):
+    """Remuxes a finished file on the fast-start pool and waits for it; returns the ms taken or None.
+
+    Jobs turn ready only after this, so the first client never streams the
+    original layout or has the file replaced under its Range requests.
+    """
+    if not FASTSTART_ENABLED: return None
+    name = os.path.basename(path)
+    # Don't let the quota delete the file under ffmpeg
+    storage.pin(name, ttl=faststart.timeout)
+    try:
+        future = faststart.submit(path)
+        if not future: return None
+        with tracer.span('faststart'):
+            elapsed_ms = future.result()
+    finally:
+        storage.unpin(name)
+    if elapsed_ms is not None: storage.register(path) # Size changed
+    return elapsed_ms
+
+def tier_professional(url, platform, job_id, workflow):
+    """Y2Mate/Cobalt race (YouTube only)."""
+    pro_info = extract_professional(url)
+    if pro_info:
+        increment_downloads()
+        return "SUCCESS", pro_info
     return None
 
+def tier_local(url, platform, job_id, workflow):
+    """Local download (yt-dlp + Cookies + POT) in the extraction process pool."""
+    outtmpl = os.path.join(DOWNLOAD_FOLDER, cluster.tag(f'%(id)s_{int(time.time())}.%(ext)s'))
+    # Pool wait plus the whole yt-dlp run; the worker reports its own stages inside it
+    with tracer.span('extraction'):
+        info = extraction_engine.extract(ExtractionRequest(url, platform, download=True, outtmpl=outtmpl))
+    for stage, started, seconds in info.pop('spans', ()):
+        tracer.record(stage, seconds, started=started)
+    filename = info['filename']
+    if not os.path.exists(filename):
+        raise ExtractionError('MissingFile', f"yt-dlp reported {os.path.basename(filename)} but it was not written")
+    increment_downloads()
+    storage.register(filename)
+    faststart_ms = faststart_file(filename)
+    if faststart_ms is not None and job_id: save_job(job_id, {'faststart_ms': faststart_ms})
+
+    # Quality URLs
+    hd_url = ""
+    mp4_formats = [f for f in info.get('formats', []) if f.get('ext') == 'mp4' and f.get('vcodec') != 'none']
+    if mp4_formats:
+        mp4_formats.sort(key=lambda x: x.get('height', 0), reverse=True)
+        hd_url = mp4_formats[0].get('url', '')
+
+    result = {
+        'filename': os.path.basename(filename),
+        'title': info.get('title', 'Video'),
+        'thumbnail': info.get('thumbnail', ''),
+        'uploader': info.get('uploader'),
+        'hd_url': hd_url or info.get('url'),
+        'sd_url': hd_url or info.get('url')
+    }
+    result_cache.put(canonical_media_id(url), result)
+    return "SUCCESS", result
+
+def tier_github(url, platform, job_id, workflow):
+    """GitHub Actions failover; the file arrives later via /github-callback."""
+    job_id = job_id or new_job_id()
+    save_job(job_id, {'status': 'pending', 'url': url, 'timestamp': time.time(),
+                      'platform': platform, 'github_triggered_at': time.time()})
+    with tracer.span('trigger_github_action', workflow=workflow) as span:
+        span['ok'] = trigger_github_action(url, job_id, workflow=workflow)
+    if span['ok']:
+        increment_downloads()
+        return "PENDING_GITHUB", job_id
+    # The dispatch never looks at the post, so a failed one is always the tier's fault
+    raise TierUnavailable(f"GitHub workflow {workflow} could not be triggered")
+
+DOWNLOAD_TIERS = {'professional': tier_professional, 'local': tier_local, 'github': tier_github}
+
 def download_video(url, platform='instagram', existing_job_id=None, workflow_to_use=None):
-    """Internal download logic with professional API and local fallbacks."""
+    """Internal download logic: tries the download tiers in the order the router picks."""
     
     # Select default workflow
     if workflow_to_use is None:
@@ -563,117 +841,137 @@ def download_video(url, platform='instagram', existing_job_id=None, workflow_to_
     # URL Normalization
     if platform == 'instagram' and '?' in url: url = url.split('?')[0]
 
-    # 1. Try Professional API for YouTube (The "Y2Mate" method)
-    if platform == 'youtube':
-        pro_info = extract_professional(url)
-        if pro_info:
-            increment_downloads()
-            return "SUCCESS", pro_info
-
-    # 2. Try Local Download (yt-dlp + Cookies + POT)
-    ydl_opts = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best' if platform == 'youtube' else 'b[ext=mp4]/b',
-        'outtmpl': os.path.join(DOWNLOAD_FOLDER, f'%(id)s_{int(time.time())}.%(ext)s'),
-        'quiet': True,
-        'no_playlist': True,
-        'nocheckcertificate': True,
-        'geo_bypass': True
-    }
-    
-    if platform == 'youtube':
-        ydl_opts['extractor_args'] = {
-            'youtube': {
-                'player_client': ['android', 'ios', 'mweb'], 
-                'skip': ['web', 'web_creator']
-            }
+    chain = ['professional', 'local', 'github'] if platform == 'youtube' else ['local', 'github']
+    err_str = "All download methods failed"
+    for tier in tier_router.plan(platform, chain):
+        started = time.time()
+        ok = None # Tier answered but had nothing for this post
+        try:
+            outcome = DOWNLOAD_TIERS[tier](url, platform, existing_job_id, workflow_to_use)
+            if outcome is not None: ok = True
+        except Exception as e:
+            outcome = None
+            err_str = str(e)
+            # Only transport errors, 5xx and timeouts trip the breaker, not private/deleted posts
+            if is_tier_failure(e): ok = False
+            print(f"{tier.upper()} DOWNLOAD FAILED: {err_str}")
+        # A GitHub trigger only starts the job; its latency sample comes from the callback
+        latency = None if outcome and outcome[0] == "PENDING_GITHUB" else time.time() - started
+        tier_router.record(platform, tier, ok, latency)
+        if outcome is not None:
+            return outcome
+
+    return "FAILED", f"Error: {err_str[:100]}"
+
+def ready_job_fields(result):
+    """Job record fields for a finished download result."""
+    return {
+        'status': 'ready', 
+        'filename': result.get('filename'),
+        'title': result.get('title', 'Instagram Video'),
+        'thumbnail': result.get('thumbnail', ''),
+        'uploader': result.get('uploader'),
+        'hashtags': result.get('hashtags'),
+        'video_url': result.get('hd_url') or result.get('sd_url'),
+        'qualities': {
+            '1080p': result.get('hd_url'),
+            '720p': result.get('sd_url'),
+            'thumb': result.get('thumbnail')
         }
-        ydl_opts['user_agent'] = 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Mobile Safari/537.36'
-        if os.path.exists(COOKIES_FILE): ydl_opts['cookiefile'] = str(COOKIES_FILE)
-        # Inject PO Token if available
-        if os.path.exists(POT_FILE):
-            with open(POT_FILE, 'r') as f: pot = f.read().strip()
-            if pot:
-                ydl_opts['extractor_args']['youtube']['po_token'] = [pot]
-                print("USING PO TOKEN FOR LOCAL DOWNLOAD")
+    }
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            if os.path.exists(filename):
-                increment_downloads()
-                
-                # Quality URLs
-                hd_url = ""
-                mp4_formats = [f for f in info.get('formats', []) if f.get('ext') == 'mp4' and f.get('vcodec') != 'none']
-                if mp4_formats:
-                    mp4_formats.sort(key=lambda x: x.get('height', 0), reverse=True)
-                    hd_url = mp4_formats[0].get('url', '')
-
-                return "SUCCESS", {
-                    'filename': os.path.basename(filename),
-                    'title': info.get('title', 'Video'),
-                    'thumbnail': info.get('thumbnail', ''),
-                    'uploader': info.get('uploader'),
-                    'hd_url': hd_url or info.get('url'),
-                    'sd_url': hd_url or info.get('url')
-                }
-    except Exception as e:
-        err_str = str(e)
-        print(f"LOCAL DOWNLOAD FAILED: {err_str}")
-        
-        # 3. Trigger GitHub Actions Failover
-        job_id = existing_job_id or str(uuid.uuid4())
-        save_job(job_id, {'status': 'pending', 'url': url, 'timestamp': time.time()})
-        
-        if trigger_github_action(url, job_id, workflow=workflow_to_use):
-            increment_downloads()
-            return "PENDING_GITHUB", job_id
-        
-        return "FAILED", f"Error: {err_str[:100]}"
+def reward_download(user_key):
+    """Record rewards for successful download completion."""
+    credit_store.add_balance(user_key, DOWNLOAD_CASH_REWARD)
 
-def process_video_task(url, job_id, user_key, workflow_to_use):
+def process_video_task(url, job_id, user_key, workflow_to_use, platform='instagram'):
     """Background task to process video and update job_status."""
-    try:
-        # Pass workflow_to_use and job_id to maintain consistency
-        status, result = download_video(url, workflow_to_use=workflow_to_use, existing_job_id=job_id)
-        if status == "SUCCESS":
-            save_job(job_id, {
-                'status': 'ready', 
-                'filename': result.get('filename'),
-                'title': result.get('title', 'Instagram Video'),
-                'thumbnail': result.get('thumbnail', ''),
-                'uploader': result.get('uploader'),
-                'hashtags': result.get('hashtags'),
-                'video_url': result.get('hd_url') or result.get('sd_url'),
-                'qualities': {
-                    '1080p': result.get('hd_url'),
-                    '720p': result.get('sd_url'),
-                    'thumb': result.get('thumbnail')
-                }
-            })
-            # Record rewards for successful download completion
-            with data_lock:
-                if user_key in user_credits:
-                    user_credits[user_key]['balance'] += DOWNLOAD_CASH_REWARD
-        elif status == "PENDING_GITHUB":
-            # download_video already handled the pending status via save_job
-            pass 
-        else:
-            save_job(job_id, {'status': 'failed', 'message': result})
-    except Exception as e:
-        print(f"ASYNC TASK ERROR: {e}")
-        save_job(job_id, {'status': 'failed', 'message': str(e)})
+    # Timeline offsets count from when the job was created, so the queue wait shows up too
+    with tracer.trace(origin=(job_store.get(job_id) or {}).get('timestamp')) as trace:
+        tracer.record('queue_wait', time.time() - trace.origin, started=trace.origin)
+        save_job(job_id, {'status': 'processing', 'started_at': time.time()})
+        final = {}
+        try:
+            # Pass workflow_to_use and job_id to maintain consistency.
+            # Identical in-flight downloads attach to the first one instead of starting their own.
+            with tracer.span('download') as span:
+                (status, result), shared = download_flights.do(
+                    flight_key(url), download_video, url, platform=platform, workflow_to_use=workflow_to_use, existing_job_id=job_id
+                )
+                span.update({'coalesced': shared, 'ok': status != "FAILED"})
+            if status == "PENDING_GITHUB" and result != job_id:
+                # The leader failed over to GitHub under its own job; follow that job
+                final = {'status': 'pending', 'alias_of': result}
+            elif status == "SUCCESS":
+                final = ready_job_fields(result)
+                reward_download(user_key)
+            elif status == "PENDING_GITHUB":
+                # download_video already handled the pending status via save_job
+                pass 
+            else:
+                final = {'status': 'failed', 'message': result}
+        except Exception as e:
+            print(f"ASYNC TASK ERROR: {e}")
+            final = {'status': 'failed', 'message': str(e)}
+    # The timeline rides along with the final status in one write
+    save_job(job_id, {**final, 'timeline': trace.timeline()})
+
+# yt-dlp runs in a pool of pre-started processes so extraction scales across cores
+PREVIEW_TIMEOUT = int(os.environ.get('PREVIEW_TIMEOUT', 60))
+extraction_engine = ExtractionEngine(
+    {'cookies_file': COOKIES_FILE, 'pot_file': POT_FILE},
+    processes=int(os.environ['EXTRACT_PROCESSES']) if os.environ.get('EXTRACT_PROCESSES') else (
+        # Workers split the cores instead of each starting one process per core
+        max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1))) if shared_db else None
+    ),
+    max_tasks=int(os.environ.get('EXTRACT_MAX_TASKS', 50)),
+    timeout=int(os.environ.get('EXTRACT_TIMEOUT', 600)),
+    preview_processes=int(os.environ.get('EXTRACT_PREVIEW_PROCESSES', 1))
+)
+# Pre-start the pool so the first requests don't pay for the interpreter spawns
+extraction_engine.start()
+atexit.register(extraction_engine.shutdown)
+
+# Fixed worker pools with a bounded queue per platform (replaces thread-per-request)
+download_scheduler = DownloadScheduler(
+    {
+        'instagram': int(os.environ.get('WORKERS_INSTAGRAM', 4)),
+        'youtube': int(os.environ.get('WORKERS_YOUTUBE', 2))
+    },
+    max_depth=int(os.environ.get('QUEUE_MAX_DEPTH', 50))
+)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 10))
+STATUS_BATCH_MAX = 50
+
+def charge_credits(user_data, amount):
+    """Atomic check-and-deduct so concurrent requests can't overspend."""
+    return credit_store.charge(user_data, amount)
+
+def refund_credits(user_data, amount):
+    credit_store.add(user_data, credits=amount)
+
+def new_job_id():
+    return cluster.tag(str(uuid.uuid4()))
+
+def pick_workflow(platform):
+    """GitHub workflow for a download (App vs Website)."""
+    is_app = request.path == '/share_target' or (request.referrer and '/app' in request.referrer)
+    if platform == 'youtube': return "yt_download.yml"
+    if is_app: return "app_download.yml"
+    return "insta_download.yml"
+
 @app.route('/download', methods=['POST'])
 @limiter.limit("15 per minute")
 def handle_download():
     if not verify_request():
         return jsonify({'success': False, 'message': 'Unauthorized Access'}), 403
+    handed_off = hand_off_download()
+    if handed_off is not None: return handed_off
     
     data = request.json or {}
     url = data.get('url')
@@ -685,32 +983,54 @@ def handle_download():
     
     user_data = get_user_data(ip, device_id=data.get('device_id'))
     
-    if user_data['credits'] < DOWNLOAD_COST:
-        return jsonify({'success': False, 'message': f'Low Credits. Share to earn more!'}), 403
-
     # Deduct credits early to prevent abuse
-    user_data['credits'] -= DOWNLOAD_COST
+    if not charge_credits(user_data, DOWNLOAD_COST):
+        return jsonify({'success': False, 'message': f'Low Credits. Share to earn more!'}), 403
     
     # Generate Job ID and start background thread
-    job_id = str(uuid.uuid4())
+    job_id = new_job_id()
+
+    # Same reel downloaded recently: hand back the file we already have
+    media_id = canonical_media_id(url)
+    cached = result_cache.get(media_id) if media_id else None
+    if cached:
+        job = ready_job_fields(cached)
+        save_job(job_id, {**job, 'timestamp': time.time(), 'url': url, 'cache_hit': True})
+        increment_downloads()
+        reward_download(user_key)
+        log_activity('download_cache_hit', {
+            'url': url,
+            'device_id': data.get('device_id'),
+            'platform': get_platform(url),
+            'media_id': media_id
+        })
+        return jsonify({
+            **job,
+            'success': True,
+            'job_id': job_id,
+            'credits': user_data.credits,
+            'balance': round(user_data.balance, 2)
+        })
+
     save_job(job_id, {'status': 'pending', 'timestamp': time.time(), 'url': url})
     
-    # Determine which workflow to use (App vs Website)
     platform = get_platform(url)
-    is_app = request.path == '/share_target' or (request.referrer and '/app' in request.referrer)
+    workflow_to_use = pick_workflow(platform)
     
-    if platform == 'youtube':
-        workflow_to_use = "yt_download.yml"
-    elif is_app:
-        workflow_to_use = "app_download.yml"
-    else:
-        workflow_to_use = "insta_download.yml"
-    
-    thread = threading.Thread(target=process_video_task, args=(url, job_id, user_key, workflow_to_use))
-    thread.daemon = True
-    thread.start()
+    try:
+        position, estimated_start = download_scheduler.submit(
+            platform, job_id, process_video_task, url, job_id, user_key, workflow_to_use, platform
+        )
+    except QueueFull as e:
+        # Refund and ask the client to come back later
+        refund_credits(user_data, DOWNLOAD_COST)
+        save_job(job_id, {'status': 'failed', 'message': 'Server busy, please retry shortly.'})
+        log_activity('download_rejected', {'url': url, 'platform': platform, 'retry_after': e.retry_after})
+        response = jsonify({'success': False, 'message': 'Server busy, please retry shortly.', 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    save_job(job_id, {'queue_position': position, 'estimated_start': estimated_start})
 
-    platform = get_platform(url)
     log_activity('download_request', {
         'url': url, 
         'device_id': data.get('device_id'),
@@ -721,14 +1041,112 @@ def handle_download():
         'success': True, 
         'status': 'pending', 
         'job_id': job_id,
-        'credits': user_data['credits'],
-        'balance': round(user_data['balance'], 2)
+        'queue_position': position,
+        'estimated_start': estimated_start,
+        'credits': user_data.credits,
+        'balance': round(user_data.balance, 2)
+    })
+
+@app.route('/download/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+def handle_download_batch():
+    """Several URLs in one round trip: deduped, charged at once, enqueued as one batch."""
+    if not verify_request():
+        return jsonify({'success': False, 'message': 'Unauthorized Access'}), 403
+    handed_off = hand_off_download()
+    if handed_off is not None: return handed_off
+
+    data = request.json or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list):
+        return jsonify({'success': False, 'message': 'No URLs provided'}), 400
+
+    # Same reel pasted twice (or with different tracking params) is one job
+    unique = {}
+    for url in urls:
+        if isinstance(url, str) and url.strip():
+            unique.setdefault(flight_key(url.strip()), url.strip())
+    if not unique:
+        return jsonify({'success': False, 'message': 'No URL provided'}), 400
+    if len(unique) > BATCH_MAX_URLS:
+        return jsonify({'success': False, 'message': f'At most {BATCH_MAX_URLS} links per batch.'}), 400
+
+    ip = get_client_ip()
+    user_key = ip
+    if hasattr(request, 'fb_user'): user_key = request.fb_user['uid']
+    user_data = get_user_data(ip, device_id=data.get('device_id'))
+
+    # All or nothing: a batch never runs half-paid
+    cost = DOWNLOAD_COST * len(unique)
+    if not charge_credits(user_data, cost):
+        return jsonify({'success': False, 'message': f'Low Credits. Share to earn more!'}), 403
+
+    batch_id = str(uuid.uuid4())
+    now = time.time()
+    jobs = []
+    records = {}
+    lanes = {}
+    for url in unique.values():
+        job_id = new_job_id()
+        platform = get_platform(url)
+        media_id = canonical_media_id(url)
+        cached = result_cache.get(media_id) if media_id else None
+        if cached:
+            job = ready_job_fields(cached)
+            records[job_id] = {**job, 'timestamp': now, 'url': url, 'batch_id': batch_id, 'cache_hit': True}
+            jobs.append({**job, 'job_id': job_id, 'url': url})
+            increment_downloads()
+            reward_download(user_key)
+            continue
+        records[job_id] = {'status': 'pending', 'timestamp': now, 'url': url, 'batch_id': batch_id}
+        entry = {'job_id': job_id, 'url': url, 'status': 'pending'}
+        jobs.append(entry)
+        lanes.setdefault(platform, []).append(
+            (entry, (job_id, process_video_task, (url, job_id, user_key, pick_workflow(platform), platform)))
+        )
+    # Records exist before any worker can pick a task up
+    save_jobs(records)
+
+    updates = {}
+    rejected = 0
+    for platform, queued in lanes.items():
+        placed = download_scheduler.submit_many(platform, [task for _, task in queued])
+        for (entry, _), slot in zip(queued, placed):
+            if slot is None:
+                entry.update({'status': 'failed', 'message': 'Server busy, please retry shortly.',
+                              'retry_after': download_scheduler.retry_after(platform)})
+                updates[entry['job_id']] = {'status': 'failed', 'message': entry['message']}
+                rejected += 1
+            else:
+                entry['queue_position'], entry['estimated_start'] = slot
+                updates[entry['job_id']] = {'queue_position': slot[0], 'estimated_start': slot[1]}
+    save_jobs(updates)
+    if rejected: refund_credits(user_data, DOWNLOAD_COST * rejected)
+
+    log_activity('download_batch', {
+        'urls': len(urls),
+        'unique': len(unique),
+        'rejected': rejected,
+        'device_id': data.get('device_id')
+    })
+
+    return jsonify({
+        'success': rejected < len(jobs),
+        'batch_id': batch_id,
+        'jobs': jobs,
+        'duplicates': len(urls) - len(unique),
+        'credits': user_data.credits,
+        'balance': round(user_data.balance, 2)
     })
 
 @app.route('/stats', methods=['GET'])
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    return jsonify(load_stats())
+    """Served from memory; ETag + Cache-Control let browsers/CDNs absorb the polling."""
+    response = jsonify(load_stats())
+    response.headers['Cache-Control'] = f'public, max-age={STATS_CACHE_SECONDS}, stale-while-revalidate={STATS_CACHE_SECONDS}'
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/check-limit', methods=['POST'])
 def check_limit():
@@ -742,9 +1160,9 @@ def check_limit():
     ip = get_client_ip()
     user_data = get_user_data(ip, gift=gift, device_id=device_id)
     return jsonify({
-        'credits': user_data['credits'],
-        'balance': round(user_data['balance'], 2),
-        'referral_id': user_data['referral_id'],
+        'credits': user_data.credits,
+        'balance': round(user_data.balance, 2),
+        'referral_id': user_data.referral_id,
         'cost': DOWNLOAD_COST,
         'reward': SHARE_REWARD
     })
@@ -782,6 +1200,66 @@ def is_admin():
     secret = request.headers.get('X-App-Secret')
     return secret == 'insta_pro_ai_secure_99'
 
+# Extra stats() callables registered by optional front ends (e.g. the ASGI proxy)
+metrics_providers = {}
+
+@app.route('/api/admin/metrics')
+def admin_metrics():
+    """Internal counters for the storage and logging pipelines."""
+    if not is_admin(): return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({
+        **{name: provider() for name, provider in metrics_providers.items()},
+        'process': {'pid': os.getpid(), 'primary': is_primary, 'shared_state': SHARED_STATE_DB},
+        'latency': tracer.stats(),
+        'cluster': cluster.stats(),
+        'jobs': job_store.stats(),
+        'credits': credit_store.stats(),
+        'activity': activity_log.stats(),
+        'geoip': geo_resolver.stats(),
+        'result_cache': result_cache.stats(),
+        'preview_cache': preview_cache.stats(),
+        'stream_cache': stream_cache.stats(),
+        'thumb_cache': thumb_cache.stats(),
+        'thumb_derivatives': thumb_derivatives.stats(),
+        'faststart': faststart.stats(),
+        'storage': storage.stats(),
+        'download_queue': download_scheduler.stats(),
+        'extraction_engine': extraction_engine.stats(),
+        'http': http.stats(),
+        'pro_providers': professional_racer.stats(),
+        'routing': tier_router.table(),
+        'singleflight': {
+            'download': download_flights.stats(),
+            'preview': preview_flights.stats()
+        }
+    })
+
+@app.route('/cluster/health')
+@limiter.exempt
+def cluster_health():
+    """Peer heartbeat / load balancer check; 503 while draining so new traffic goes elsewhere."""
+    body = {'node': NODE_ID, 'draining': cluster.draining, 'jobs': len(job_store)}
+    return jsonify(body), 503 if cluster.draining else 200
+
+@app.route('/api/admin/cluster')
+def admin_cluster():
+    """Membership as this node sees it."""
+    if not is_admin(): return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(cluster.stats())
+
+@app.route('/api/admin/drain', methods=['POST'])
+def admin_drain():
+    """{"draining": true} stops this node from taking new downloads; false puts it back in rotation."""
+    if not is_admin(): return jsonify({'error': 'Unauthorized'}), 401
+    cluster.set_draining((request.json or {}).get('draining', True))
+    return jsonify(cluster.stats())
+
+@app.route('/api/admin/routing')
+def admin_routing():
+    """Current download tier order and circuit breaker state per platform."""
+    if not is_admin(): return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(tier_router.table())
+
 def sync_to_hf(local_path, remote_filename):
     if scheduler and hf_token:
         try:
@@ -829,7 +1307,7 @@ def handle_withdraw():
     user_data = get_user_data(ip)
     upi_id = request.json.get('upi_id')
     
-    if user_data['balance'] < 10:
+    if user_data.balance < 10:
         return jsonify({'success': False, 'message': 'Minimum withdrawal is ₹10.00'}), 400
         
     # Persistent Tracking Logic
@@ -837,8 +1315,8 @@ def handle_withdraw():
         'id': str(uuid.uuid4()),
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
         'ip': ip,
-        'user_key': user_data.get('referral_id', 'unknown'),
-        'amount': round(user_data['balance'], 2),
+        'user_key': user_data.referral_id,
+        'amount': round(user_data.balance, 2),
         'upi_id': upi_id
     }
     
@@ -853,7 +1331,7 @@ def handle_withdraw():
         with open('withdrawals.json', 'w') as f:
             json.dump(withdrawals, f, indent=4)
             
-        print(f"WITHDRAW LOGGED: User {ip} requested ₹{user_data['balance']} to {upi_id}")
+        print(f"WITHDRAW LOGGED: User {ip} requested ₹{user_data.balance} to {upi_id}")
     except Exception as e:
         print(f"TRACKING ERROR: {e}")
 
@@ -869,62 +1347,355 @@ def reward_share():
     device_id = data.get('device_id')
     ip = get_client_ip()
     user_data = get_user_data(ip, device_id=device_id)
-    user_data['credits'] += SHARE_REWARD
+    credit_store.add(user_data, credits=SHARE_REWARD)
     return jsonify({
         'success': True,
         'message': f'Gift Received! +{SHARE_REWARD} credits added.',
-        'credits': user_data['credits']
+        'credits': user_data.credits
     })
 
+CDN_IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+}
+
+def send_cached_thumbnail(meta, max_age=86400):
+    """Serves a thumbnail from disk, answering client conditionals with 304.
+
+    Returns None (and drops the entry) if the body was evicted since the lookup.
+    """
+    try:
+        response = send_file(meta['path'], mimetype=meta['content_type'], etag=False, conditional=False, max_age=max_age)
+    except FileNotFoundError:
+        thumb_cache.forget(meta['key'])
+        return None
+    response.headers['ETag'] = meta['etag']
+    if meta.get('last_modified'): response.headers['Last-Modified'] = meta['last_modified']
+    return response.make_conditional(request)
+
+def stream_thumbnail(key, resp, max_age=86400, on_commit=None):
+    """Streams an upstream 200 to the client while writing it into the thumbnail cache.
+
+    on_commit(meta) runs once the complete body has been stored.
+    """
+    writer = thumb_cache.write(key, resp.headers)
+    headers = {
+        'Content-Type': resp.headers.get('Content-Type', 'image/jpeg'),
+        'Cache-Control': f'public, max-age={max_age}'
+    }
+    for h in ('ETag', 'Last-Modified', 'Content-Length'):
+        if resp.headers.get(h): headers[h] = resp.headers[h]
+
+    if request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since'):
+        # Client already has this version: fill the cache, then answer 304
+        if not is_resource_modified(request.environ, etag=resp.headers.get('ETag'),
+                                    last_modified=resp.headers.get('Last-Modified')):
+            try:
+                for chunk in resp.iter_content(chunk_size=64 * 1024): writer.write(chunk)
+                writer.close(True)
+            except Exception:
+                writer.close(False)
+            finally:
+                resp.close()
+            if writer.committed and on_commit: on_commit(writer.meta)
+            return Response(status=304, headers={h: v for h, v in headers.items() if h != 'Content-Length'})
+
+    def generate():
+        complete = False
+        try:
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    writer.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            writer.close(complete)
+            resp.close()
+            if writer.committed and on_commit: on_commit(writer.meta)
+
+    return Response(stream_with_context(generate()), status=200, headers=headers)
+
 @app.route('/proxy-img')
 def proxy_image():
-    """Proxies images to bypass CORS."""
+    """Proxies images to bypass CORS, from the local thumbnail cache when possible.
+
+    With ?w= and/or ?fmt= a downscaled derivative is served once it has been
+    rendered; until then the original goes out with a short max-age.
+    """
     url = request.args.get('url')
     if not url: return "No URL", 400
-    try:
-        resp = requests.get(url, stream=True, timeout=60, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-        })
-        # Only return content and content-type to be safe
-        headers = {
-            'Content-Type': resp.headers.get('Content-Type', 'image/jpeg'),
-            'Cache-Control': 'public, max-age=86400'
-        }
-        return (resp.content, resp.status_code, headers.items())
-    except Exception as e:
-        return str(e), 500
+    key = normalize_url(url)
+
+    # Time to the response headers; the body streams after the span closes
+    with tracer.span('proxy_img'):
+        spec = derivative_spec(request.args.get('w'), request.args.get('fmt'))
+        max_age, on_commit = 86400, None
+        if spec and thumb_derivatives.available:
+            dkey = derivative_key(key, spec)
+            dmeta, _ = thumb_cache.get(dkey)
+            response = dmeta and send_cached_thumbnail(dmeta)
+            if response: return response
+            max_age = 60 # Let the browser come back for the small version
+            on_commit = lambda meta: thumb_derivatives.request(meta, dkey, spec)
+
+        meta, stale = thumb_cache.get(key)
+        try:
+            if meta and stale:
+                conditional = {}
+                if meta.get('etag'): conditional['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'): conditional['If-Modified-Since'] = meta['last_modified']
+                resp = http.get('cdn_image', url, stream=True, headers={**CDN_IMAGE_HEADERS, **conditional})
+                if resp.status_code == 200:
+                    return stream_thumbnail(key, resp, max_age, on_commit)
+                resp.close()
+                # 304 confirms our copy; on upstream errors keep serving it as well
+                if resp.status_code == 304: thumb_cache.touch(key)
+            if meta:
+                if on_commit: on_commit(meta)
+                response = send_cached_thumbnail(meta, max_age)
+                if response: return response
+                meta = None # Evicted under us: fetch it again
+
+            resp = http.get('cdn_image', url, stream=True, headers=CDN_IMAGE_HEADERS)
+            if resp.status_code == 200:
+                return stream_thumbnail(key, resp, max_age, on_commit)
+            # Only return content and content-type to be safe
+            headers = {'Content-Type': resp.headers.get('Content-Type', 'image/jpeg')}
+            return (resp.content, resp.status_code, headers.items())
+        except Exception as e:
+            response = meta and send_cached_thumbnail(meta, max_age)
+            if response: return response
+            return str(e), 500
+
+def emulate_range(chunks, start, length):
+    """Skips `start` bytes of a full-body stream and yields the next `length` bytes."""
+    for chunk in chunks:
+        if start >= len(chunk):
+            start -= len(chunk)
+            continue
+        chunk = chunk[start:start + length]
+        start = 0
+        length -= len(chunk)
+        yield chunk
+        if length <= 0: break
+
+CDN_VIDEO_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+    'Accept': '*/*',
+}
+
+def dl_proxy_headers(name, upstream_headers):
+    headers = {
+        'Content-Disposition': f'attachment; filename="{name}"',
+        'X-Content-Type-Options': 'nosniff',
+        'Cache-Control': 'no-cache',
+        'Accept-Ranges': 'bytes'
+    }
+    for h in ('ETag', 'Last-Modified'):
+        if upstream_headers.get(h): headers[h] = upstream_headers[h]
+    return headers
+
+def plan_upstream_range(status, upstream_headers, byte_range, if_range):
+    """Client-facing (status, headers, span) for a /dl-proxy upstream response.
+
+    span is (start, length) when a Range has to be emulated on a full 200
+    body, otherwise None. A 416 comes back with its Content-Range and no body.
+    """
+    headers = {}
+    total = upstream_headers.get('Content-Length')
+    if status == 206:
+        headers['Content-Range'] = upstream_headers.get('Content-Range', '')
+        if total: headers['Content-Length'] = total
+    elif status == 416:
+        return 416, {'Content-Range': upstream_headers.get('Content-Range', '')}, None
+    elif status == 200 and byte_range and total and not if_range:
+        # Upstream ignored the Range header: emulate it on the full body.
+        # With If-Range, a 200 means the validator no longer matches, so the full body is correct.
+        total = int(total)
+        span = byte_range.range_for_length(total)
+        if span is None:
+            return 416, {'Content-Range': f'bytes */{total}'}, None
+        headers['Content-Range'] = byte_range.to_content_range_header(total)
+        headers['Content-Length'] = str(span[1] - span[0])
+        return 206, headers, (span[0], span[1] - span[0])
+    elif total and status == 200:
+        headers['Content-Length'] = total
+    return status, headers, None
+
+def plan_cached_range(entry, byte_range, if_range):
+    """(status, headers, start, end) for serving a stream cache entry; end None means to EOF."""
+    meta = entry.headers
+    if byte_range and if_range and if_range not in (meta.get('ETag'), meta.get('Last-Modified')):
+        byte_range = None # Client's copy is a different version: send it all
+    status, start, end, headers = 200, 0, None, {}
+    if byte_range:
+        span = byte_range.range_for_length(entry.total)
+        if span is None:
+            return 416, {'Content-Range': f'bytes */{entry.total}'}, 0, 0
+        status, (start, end) = 206, span
+        headers['Content-Range'] = byte_range.to_content_range_header(entry.total)
+    if entry.total is not None:
+        headers['Content-Length'] = str((end if end is not None else entry.total) - start)
+    return status, headers, start, end
+
+def stream_upstream(url, name, byte_range, resp=None):
+    """Streams the CDN response straight through, forwarding/emulating Range."""
+    if resp is None:
+        upstream_headers = dict(CDN_VIDEO_HEADERS)
+        if byte_range:
+            upstream_headers['Range'] = byte_range.to_header()
+            if request.headers.get('If-Range'): upstream_headers['If-Range'] = request.headers['If-Range']
+        resp = http.get('cdn_video', url, stream=True, headers=upstream_headers)
+
+    status, range_headers, span = plan_upstream_range(resp.status_code, resp.headers, byte_range, request.headers.get('If-Range'))
+    if status == 416:
+        resp.close()
+        return Response(status=416, headers=range_headers)
+    headers = {**dl_proxy_headers(name, resp.headers), **range_headers}
+    chunks = resp.iter_content(chunk_size=1024*64) # Use larger chunks for faster streaming
+    if span: chunks = emulate_range(chunks, *span)
+
+    def generate():
+        try:
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+        finally:
+            resp.close()
+
+    return Response(stream_with_context(generate()), 
+                    status=status,
+                    content_type=resp.headers.get('Content-Type', 'video/mp4'),
+                    headers=headers)
+
+def stream_cached(entry, name, byte_range, count_saved):
+    """Serves a (possibly still growing) stream cache entry, with Range support."""
+    status, range_headers, start, end = plan_cached_range(entry, byte_range, request.headers.get('If-Range'))
+    if status == 416:
+        stream_cache.release(entry)
+        return Response(status=416, headers=range_headers)
+    headers = {**dl_proxy_headers(name, entry.headers), **range_headers}
+
+    def generate():
+        try:
+            yield from stream_cache.read(entry, start, end, count_saved=count_saved)
+        finally:
+            stream_cache.release(entry)
 
-from flask import Response, stream_with_context
+    return Response(stream_with_context(generate()), status=status,
+                    content_type=entry.headers.get('Content-Type', 'video/mp4'), headers=headers)
 
 @app.route('/dl-proxy')
 def dl_proxy():
-    """Proxies a direct URL and forces download with attachment headers (Streaming)."""
+    """Proxies a direct URL and forces download with attachment headers (Streaming, resumable).
+
+    Full downloads go through the read-while-write stream cache, so concurrent
+    and repeat downloads of one CDN URL share a single upstream transfer.
+    """
     url = request.args.get('url')
     name = request.args.get('name', 'video.mp4')
     if not url: return "No URL", 400
+
+    # Only single ranges are supported; multipart/byteranges is ignored (full 200 is valid)
+    byte_range = parse_range_header(request.headers.get('Range'))
+    if byte_range and len(byte_range.ranges) != 1: byte_range = None
     try:
-        resp = requests.get(url, stream=True, timeout=120, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-            'Accept': '*/*',
-        })
+        # Time to the response headers; the body streams after the span closes
+        with tracer.span('dl_proxy', ranged=bool(byte_range)):
+            if byte_range:
+                # Resumes/seeks are served from the cache when it knows the length, never start a fill
+                entry = stream_cache.peek(url)
+                if entry and entry.total is not None:
+                    response = stream_cached(entry, name, byte_range, count_saved=True)
+                else:
+                    if entry: stream_cache.release(entry)
+                    response = stream_upstream(url, name, byte_range)
+            else:
+                entry, filler = stream_cache.acquire(url)
+                if filler:
+                    try:
+                        resp = http.get('cdn_video', url, stream=True, headers=CDN_VIDEO_HEADERS)
+                        meta = {h: resp.headers[h] for h in ('Content-Type', 'ETag', 'Last-Modified') if resp.headers.get(h)}
+                        filling = resp.status_code == 200 and stream_cache.fill(url, entry, resp, meta)
+                    except Exception:
+                        # Nobody will fill this entry; don't leave later requests waiting on it
+                        stream_cache.abandon(url, entry)
+                        stream_cache.release(entry)
+                        raise
+                    if filling:
+                        response = stream_cached(entry, name, None, count_saved=False)
+                    else:
+                        if resp.status_code != 200: stream_cache.abandon(url, entry)
+                        stream_cache.release(entry)
+                        response = stream_upstream(url, name, None, resp=resp)
+                elif stream_cache.wait_ready(entry):
+                    response = stream_cached(entry, name, None, count_saved=True)
+                else:
+                    stream_cache.release(entry)
+                    response = stream_upstream(url, name, None)
+
+        log_activity('file_download_proxy', {'url': url, 'name': name, 'range': response.headers.get('Content-Range')})
+        return response
+    except Exception as e:
+        return str(e), 500
+
+def extract_preview(url, platform):
+    """Runs the metadata-only yt-dlp extraction and builds the /preview payload."""
+    info = extraction_engine.extract(ExtractionRequest(url, platform, download=False), timeout=PREVIEW_TIMEOUT)
+    
+    # Extract formats
+    formats = info.get('formats', [])
+    hd_url = ""
+    sd_url = ""
+    
+    # Instagram usually has simple formats. We'll pick the best and a medium one.
+    # Filters for mp4 only for maximum compatibility
+    mp4_formats = [f for f in formats if f.get('ext') == 'mp4' and f.get('vcodec') != 'none']
+    
+    if mp4_formats:
+        # Sort by resolution/filesize
+        mp4_formats.sort(key=lambda x: x.get('height', 0), reverse=True)
+        hd_format = mp4_formats[0]
+        hd_url = hd_format.get('url', '')
         
-        def generate():
-            for chunk in resp.iter_content(chunk_size=1024*64): # Use larger chunks for faster streaming
-                if chunk:
-                    yield chunk
+        # Find an SD format (around 720p or lower)
+        sd_formats = [f for f in mp4_formats if f.get('height', 0) <= 720]
+        if sd_formats:
+            sd_url = sd_formats[0].get('url', '')
+        else:
+            sd_url = hd_url # Fallback if only one exists
+    
+    raw_thumb = info.get('thumbnail', '')
+    uploader = info.get('uploader') or info.get('uploader_id')
+    hashtags = info.get('tags') or re.findall(r'#(\w+)', info.get('description', ''))
+
+    return {
+        'title': info.get('title', 'Instagram Video'),
+        'uploader': uploader,
+        'hashtags': hashtags,
+        'thumbnail': raw_thumb,
+        'video_url': hd_url,
+        'qualities': {
+            '1080p': hd_url,
+            '720p': sd_url,
+            'thumb': raw_thumb
+        }
+    }
 
-        log_activity('file_download_proxy', {'url': url, 'name': name})
+def fetch_preview(key, url, platform):
+    """Extracts a fresh preview and stores it in the metadata cache."""
+    with tracer.span('preview_extract', platform=platform):
+        preview = extract_preview(url, platform)
+    preview_cache.put(key, preview)
+    return preview
 
-        return Response(stream_with_context(generate()), 
-                        status=resp.status_code,
-                        content_type=resp.headers.get('Content-Type', 'video/mp4'),
-                        headers={
-                            'Content-Disposition': f'attachment; filename="{name}"',
-                            'X-Content-Type-Options': 'nosniff',
-                            'Cache-Control': 'no-cache'
-                        })
+def refresh_preview(key, url, platform):
+    """Background stale-while-revalidate refresh of a cached preview."""
+    try:
+        preview_flights.do(key, fetch_preview, key, url, platform)
     except Exception as e:
-        return str(e), 500
+        print(f"PREVIEW REFRESH FAILED for {key}: {e}")
+    finally:
+        preview_cache.end_refresh(key)
 
 @app.route('/preview', methods=['POST'])
 def get_preview():
@@ -933,97 +1704,36 @@ def get_preview():
     gift = data.get('gift') or request.args.get('gift')
     device_id = data.get('device_id')
     
-    platform = get_platform(url)
     url = data.get('url')
     if not url: return jsonify({'success': False, 'message': 'No URL provided'}), 400
+    platform = get_platform(url)
     
     if platform == 'instagram':
         if '?' in url: url = url.split('?')[0]
     
-    # Platform-specific ydl_opts
-    if platform == 'youtube':
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'nocheckcertificate': True,
-            'geo_bypass': True,
-            'no_playlist': True,
-            'force_ipv4': True,
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['tv', 'mweb', 'android', 'ios'],
-                    'skip': ['web', 'web_creator']
-                }
-            }
-        }
-        if os.path.exists(COOKIES_FILE):
-            ydl_opts['cookiefile'] = str(COOKIES_FILE)
-            print("USING YOUTUBE COOKIES FOR PREVIEW")
-    else: # Instagram
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'nocheckcertificate': True,
-            'geo_bypass': True,
-            'no_playlist': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            }
-        }
-    
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Extract formats
-            formats = info.get('formats', [])
-            hd_url = ""
-            sd_url = ""
-            
-            # Instagram usually has simple formats. We'll pick the best and a medium one.
-            # Filters for mp4 only for maximum compatibility
-            mp4_formats = [f for f in formats if f.get('ext') == 'mp4' and f.get('vcodec') != 'none']
-            
-            if mp4_formats:
-                # Sort by resolution/filesize
-                mp4_formats.sort(key=lambda x: x.get('height', 0), reverse=True)
-                hd_format = mp4_formats[0]
-                hd_url = hd_format.get('url', '')
-                
-                # Find an SD format (around 720p or lower)
-                sd_formats = [f for f in mp4_formats if f.get('height', 0) <= 720]
-                if sd_formats:
-                    sd_url = sd_formats[0].get('url', '')
-                else:
-                    sd_url = hd_url # Fallback if only one exists
-            
-            raw_thumb = info.get('thumbnail', '')
-            uploader = info.get('uploader') or info.get('uploader_id')
-            hashtags = info.get('tags') or re.findall(r'#(\w+)', info.get('description', ''))
-            
-            log_activity('preview_success', {
-                'url': url, 
-                'title': info.get('title'),
-                'uploader': uploader,
-                'platform': platform,
-                'interests': hashtags[:10]
-            })
-
-            return jsonify({
-                'success': True,
-                'title': info.get('title', 'Instagram Video'),
-                'uploader': uploader,
-                'hashtags': hashtags,
-                'thumbnail': raw_thumb,
-                'video_url': hd_url,
-                'qualities': {
-                    '1080p': hd_url,
-                    '720p': sd_url,
-                    'thumb': raw_thumb
-                }
-            })
+        key = flight_key(url)
+        with tracer.span('preview'):
+            preview, cache_state = preview_cache.get(key)
+            shared = False
+            if preview is not None:
+                if cache_state == 'stale' and preview_cache.begin_refresh(key):
+                    threading.Thread(target=refresh_preview, args=(key, url, platform), daemon=True).start()
+            else:
+                # Concurrent previews of the same media share one extraction
+                preview, shared = preview_flights.do(key, fetch_preview, key, url, platform)
+        
+        log_activity('preview_success', {
+            'url': url, 
+            'title': preview.get('title'),
+            'uploader': preview.get('uploader'),
+            'platform': platform,
+            'interests': preview.get('hashtags', [])[:10],
+            'coalesced': shared,
+            'cache': cache_state or 'miss'
+        })
+
+        return jsonify({'success': True, **preview})
     except Exception as e:
         import traceback
         err_detail = traceback.format_exc()
@@ -1042,20 +1752,153 @@ def get_preview():
             'is_fallback': True
         }), 200
 
+# Statuses after which a job never changes again
+TERMINAL_STATUSES = ('ready', 'failed')
+SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 300))
+SSE_KEEPALIVE = 15
+LONG_POLL_TIMEOUT = 25
+
+def status_watch_id(job_id):
+    """Coalesced jobs change on the leader's record, so that's the one to watch."""
+    job = job_store.get(job_id)
+    return (job and job.get('alias_of')) or job_id
+
+def refresh_queue_position(job_id, status):
+    """Swaps the enqueue-time queue_position snapshot in status for the live one.
+
+    Only the scheduler that queued the job knows its live position; jobs
+    queued by another worker keep the snapshot saved when they were queued.
+    """
+    if status.get('status') != 'pending' or not download_scheduler.owns(job_id): return
+    queued = download_scheduler.position(job_id, get_platform(status.get('url', '')))
+    if queued:
+        status['queue_position'], status['estimated_start'] = queued
+    else:
+        status.pop('queue_position', None) # Already picked up by a worker
+
+def job_status_payload(job_id, admin=False):
+    """The /status body for job_id, with live queue position and change version; None if unknown.
+
+    The per-stage timeline is only included for admins.
+    """
+    status = get_job(job_id)
+    if not status: return None
+    if not admin: status.pop('timeline', None)
+    refresh_queue_position(job_id, status)
+    status['version'] = job_store.version(status_watch_id(job_id))
+    return status
+
 @app.route('/status/<job_id>')
 @limiter.exempt
 def check_status(job_id):
     """Blogger polls this to see if GitHub or Local is done."""
-    status = get_job(job_id)
+    owner = owning_peer(job_id, request.headers)
+    if owner: return forward_to_node(owner)
+    status = job_status_payload(job_id, admin=is_admin())
+    if not status:
+        return jsonify({'status': 'not_found'}), 404
+    return jsonify(status)
+
+@app.route('/status/batch')
+@limiter.exempt
+def check_status_batch():
+    """Every job in ?ids=a,b,c in one response, so clients poll once instead of once per job."""
+    ids = [i for i in request.args.get('ids', '').split(',') if i][:STATUS_BATCH_MAX]
+    if not ids:
+        return jsonify({'success': False, 'message': 'No job IDs provided'}), 400
+    admin = is_admin()
+    jobs = {}
+    # Jobs owned by other nodes: one sub-request per owner
+    remote = {}
+    for job_id in ids:
+        owner = owning_peer(job_id, request.headers)
+        if owner: remote.setdefault(owner, []).append(job_id)
+    for owner, owned in remote.items():
+        try:
+            resp = http.get('cluster', f"{cluster.url_of(owner)}/status/batch",
+                            params={'ids': ','.join(owned)},
+                            headers={CLUSTER_FORWARDED: cluster.forwarded_marker(),
+                                     **({'X-App-Secret': APP_SECRET} if admin else {})})
+            jobs.update(resp.json().get('jobs', {}))
+            cluster.count_forwarded()
+        except (requests.RequestException, ValueError) as e:
+            print(f"CLUSTER ERROR: Batch status from {owner} failed: {e}")
+            jobs.update({job_id: {'status': 'node_unavailable'} for job_id in owned})
+    ids = [job_id for job_id in ids if job_id not in jobs]
+    records = job_store.get_many(ids)
+    # Coalesced jobs report their leader's record
+    leaders = job_store.get_many({r['alias_of'] for r in records.values() if r.get('alias_of')})
+    for job_id in ids:
+        record = records.get(job_id)
+        if record is None:
+            jobs[job_id] = {'status': 'not_found'}
+            continue
+        watch_id = record.get('alias_of') or job_id
+        # Aliases of one leader share its record; each gets its own copy to adjust
+        status = dict(leaders.get(watch_id, record))
+        if not admin: status.pop('timeline', None)
+        refresh_queue_position(job_id, status)
+        status['version'] = job_store.version(watch_id)
+        jobs[job_id] = status
+    return jsonify({'jobs': jobs})
+
+@app.route('/status/<job_id>/wait')
+@limiter.exempt
+def status_long_poll(job_id):
+    """Long-poll: answers once the job's version differs from ?since= (or after ?timeout= seconds)."""
+    owner = owning_peer(job_id, request.headers)
+    if owner: return forward_to_node(owner)
+    since = request.args.get('since', type=int)
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    admin = is_admin()
+    status = job_status_payload(job_id, admin)
     if not status:
         return jsonify({'status': 'not_found'}), 404
+    if since is not None and status['version'] == since and status.get('status') not in TERMINAL_STATUSES:
+        job_store.wait_for_change(status_watch_id(job_id), since, timeout)
+        status = job_status_payload(job_id, admin) or {'status': 'not_found'}
     return jsonify(status)
 
+@app.route('/status/<job_id>/events')
+@limiter.exempt
+def status_events(job_id):
+    """Server-Sent Events: pushes every change of the job, ends once it is ready or failed."""
+    owner = owning_peer(job_id, request.headers)
+    if owner: return forward_to_node(owner)
+    admin = is_admin()
+    def generate():
+        last = None
+        deadline = time.time() + SSE_MAX_SECONDS
+        yield 'retry: 3000\n\n'
+        while True:
+            watch_id = status_watch_id(job_id)
+            version = job_store.version(watch_id)
+            status = job_status_payload(job_id, admin)
+            if status is None:
+                yield f"event: status\ndata: {json.dumps({'status': 'not_found'})}\n\n"
+                return
+            body = json.dumps(status)
+            if body != last:
+                yield f"id: {version}\nevent: status\ndata: {body}\n\n"
+                last = body
+            else:
+                yield ': keepalive\n\n'
+            # Past the deadline the browser reconnects on its own (see retry above)
+            if status.get('status') in TERMINAL_STATUSES or time.time() >= deadline: return
+            job_store.wait_for_change(watch_id, version, timeout=SSE_KEEPALIVE)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/github-callback', methods=['POST'])
 @limiter.exempt
 def github_callback():
     """GitHub Action POSTs the file here."""
     job_id = request.args.get('job_id')
+    owner = owning_peer(job_id, request.headers)
+    if owner: return forward_to_node(owner)
     job = get_job(job_id)
     
     # Debug Logging to activity.json
@@ -1080,8 +1923,9 @@ def github_callback():
     file = request.files.get('file')
     filename = None
     if file:
-        filename = f"gh_{int(time.time())}_{file.filename}"
+        filename = cluster.tag(f"gh_{int(time.time())}_{file.filename}")
         file.save(os.path.join(DOWNLOAD_FOLDER, filename))
+        storage.register(filename)
     
     direct_url = request.form.get('direct_url')
     
@@ -1093,8 +1937,27 @@ def github_callback():
     if job.get('title'): updated_data['title'] = job['title']
     if job.get('thumbnail'): updated_data['thumbnail'] = job['thumbnail']
     if job.get('uploader'): updated_data['uploader'] = job['uploader']
-    
-    save_job(job_id, updated_data)
+
+    if job.get('github_triggered_at'):
+        # Real time-to-success of the GitHub tier is trigger -> callback
+        waited = time.time() - job['github_triggered_at']
+        tier_router.record_latency(job.get('platform', 'instagram'), 'github', waited)
+        entry = tracer.record('github_callback_wait', waited, started=job['github_triggered_at'],
+                              origin=job.get('timestamp', job['github_triggered_at']))
+        updated_data['timeline'] = job.get('timeline', []) + [entry]
+
+    if filename and faststart.available and FASTSTART_ENABLED:
+        # Remux before the job turns ready, without holding the runner's upload open
+        save_job(job_id, {'status': 'processing'})
+        def finish():
+            with tracer.trace(origin=job.get('timestamp')) as trace:
+                elapsed_ms = faststart_file(os.path.join(DOWNLOAD_FOLDER, filename))
+            if elapsed_ms is not None: updated_data['faststart_ms'] = elapsed_ms
+            if 'timeline' in updated_data: updated_data['timeline'] += trace.timeline()
+            save_job(job_id, updated_data)
+        threading.Thread(target=finish, daemon=True).start()
+    else:
+        save_job(job_id, updated_data)
     print(f"Job {job_id} READY via GitHub Callback.")
     return "OK", 200
 
@@ -1105,14 +1968,21 @@ def clear_cache():
     if secret != os.environ.get('APP_SECRET', 'insta_pro_ai_secure_99'):
         return jsonify({'success': False, 'message': 'Forbidden'}), 403
     
-    user_credits.clear()
-    job_status.clear()
+    credit_store.clear()
+    job_store.clear()
+    result_cache.clear()
+    preview_cache.clear()
+    stream_cache.clear()
+    thumb_cache.clear()
     print("ADMIN: All in-memory data cleared successfully.")
     return jsonify({'success': True, 'message': 'All data cleared successfully.'})
 
 @app.route('/files/<path:filename>')
 def download_file(filename):
+    owner = owning_peer(filename, request.headers)
+    if owner: return forward_to_node(owner)
     log_activity('file_download_direct', {'filename': filename})
+    storage.touch(filename)
     # If dl=1 is present, force attachment. Otherwise allow inline (for preview).
     as_attachment = request.args.get('dl') == '1'
     response = send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=as_attachment)
@@ -1129,11 +1999,7 @@ def admin_activity():
     if key != APP_SECRET:
         return "Unauthorized", 401
         
-    logs = []
-    if os.path.exists(ACTIVITY_FILE):
-        with open(ACTIVITY_FILE, 'r') as f:
-            try: logs = json.load(f)
-            except: logs = []
+    logs = activity_log.recent(1000)
     
     response = make_response(render_template('admin_activity.html', logs=logs, hf_sync=(scheduler is not None)))
     response.headers['X-Frame-Options'] = 'ALLOWALL' 
@@ -1144,4 +2010,4 @@ if __name__ == '__main__':
     # Local fallback for GH_REPO
     if not os.environ.get('GH_REPO'):
         os.environ['GH_REPO'] = "Argha-7/insta-downloader-web"
-    app.run(host='0.0.0.0', port=7860)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 7860)))
@@ -0,0 +1,538 @@
+"""ASGI entry point: async streaming for the proxy endpoints, Flask for everything else.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 7860
+
+/dl-proxy and /proxy-img run on the event loop with httpx, so thousands
+of long CDN transfers cost a coroutine each instead of a worker thread;
+the SSE and long-poll status channels live here too for the same reason.
+Every other route goes to the unchanged Flask app through a bounded
+WSGI thread pool, which keeps /status polling responsive while large
+videos are streaming.
+"""
+import os
+import json
+import time
+import asyncio
+import contextlib
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse, JSONResponse
+from starlette.routing import Route, Mount
+from werkzeug.http import parse_range_header, is_resource_modified
+
+import app as flask_app
+from thumb_cache import normalize_url
+from thumb_derivatives import derivative_spec, derivative_key
+
+CHUNK_SIZE = 64 * 1024
+# Read-ahead per stream: at most this many chunks wait for a slow client before upstream reads pause
+STREAM_BUFFER_CHUNKS = int(os.environ.get('ASYNC_STREAM_BUFFER_CHUNKS', 8))
+MAX_STREAMS = int(os.environ.get('ASYNC_MAX_STREAMS', 2000))
+WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', 16))
+
+
+class AsyncProxyStats:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.streams = 0
+        self.rejected = 0
+        self.bytes_out = 0
+        self.backpressure_waits = 0
+
+    def as_dict(self):
+        return dict(vars(self), max_streams=MAX_STREAMS, buffer_chunks=STREAM_BUFFER_CHUNKS)
+
+
+stats = AsyncProxyStats()
+_clients = {}
+_background = set() # Strong references; the loop only keeps weak ones to running tasks
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+def _client(upstream):
+    """One pooled AsyncClient per upstream, using the same timeouts as the sync sessions."""
+    if upstream not in _clients:
+        config = flask_app.http.upstreams[upstream]
+        _clients[upstream] = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(max_connections=MAX_STREAMS, max_keepalive_connections=config.pool_size * 4),
+            follow_redirects=True
+        )
+    return _clients[upstream]
+
+
+async def _open_upstream(upstream, url, headers):
+    request = _client(upstream).build_request('GET', url, headers=headers)
+    return await _client(upstream).send(request, stream=True)
+
+
+# --- Streaming with bounded buffers ---
+
+async def _buffered(chunks, on_close=None):
+    """Relays an async chunk iterator through a bounded queue.
+
+    A reader task fills the queue while the response writer drains it, so a
+    slow client stalls the reader (and with it the upstream TCP window) once
+    STREAM_BUFFER_CHUNKS are waiting. Client disconnects cancel the reader.
+    """
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    done = object()
+
+    async def pump():
+        cancelled = False
+        try:
+            async for chunk in chunks:
+                if not chunk: continue
+                if queue.full(): stats.backpressure_waits += 1
+                await queue.put(chunk)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # After a disconnect nobody drains the queue, so the sentinel could block forever
+            if not cancelled: await queue.put(done)
+
+    reader = asyncio.create_task(pump())
+    stats.active += 1
+    stats.streams += 1
+    stats.peak = max(stats.peak, stats.active)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done: break
+            stats.bytes_out += len(chunk)
+            yield chunk
+        await reader # Surface upstream errors (ends the response early)
+    finally:
+        stats.active -= 1
+        if not reader.done(): reader.cancel()
+        if on_close: await on_close()
+
+
+async def _emulate_range(chunks, start, length):
+    async for chunk in chunks:
+        if start >= len(chunk):
+            start -= len(chunk)
+            continue
+        chunk = chunk[start:start + length]
+        start = 0
+        length -= len(chunk)
+        yield chunk
+        if length <= 0: break
+
+
+async def _wait_event(event, timeout):
+    try: await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError: pass
+
+
+@contextlib.contextmanager
+def _entry_changes(entry):
+    """asyncio.Event set (from whichever thread fills the entry) when it gets headers, bytes or finishes."""
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    notify = lambda: loop.call_soon_threadsafe(changed.set)
+    flask_app.stream_cache.watch(entry, notify)
+    try:
+        yield changed
+    finally:
+        flask_app.stream_cache.unwatch(entry, notify)
+
+
+async def _read_entry(entry, start, end, count_saved):
+    """Async twin of StreamCache.read(): waits for the filler's wake-ups instead of blocking a thread."""
+    cache = flask_app.stream_cache
+    pos = start
+    try:
+        with open(entry.path, 'rb') as f, _entry_changes(entry) as changed:
+            f.seek(start)
+            while end is None or pos < end:
+                # Cleared before reading `written`, so a chunk that lands in between still wakes us
+                changed.clear()
+                available = entry.written
+                if pos >= available:
+                    if entry.done or time.time() - entry.last_progress > cache.stall_timeout: break
+                    await _wait_event(changed, 5)
+                    continue
+                want = min(available - pos, CHUNK_SIZE)
+                if end is not None: want = min(want, end - pos)
+                chunk = f.read(want)
+                if not chunk: break
+                pos += len(chunk)
+                yield chunk
+    finally:
+        cache.count_served(pos - start, count_saved)
+
+
+async def _fill_entry(key, entry, response):
+    """Tees an httpx response into a stream cache entry (async twin of StreamCache._fill_loop)."""
+    cache = flask_app.stream_cache
+    ok = False
+    try:
+        with open(entry.path, 'ab') as f:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                if chunk: cache.append(entry, f, chunk)
+        ok = True
+    except Exception as e:
+        print(f"STREAM CACHE: Async fill failed for {entry.path}: {e}")
+    finally:
+        await response.aclose()
+    cache.finish_fill(key, entry, ok)
+
+
+def _streaming(chunks, status, headers, media_type, on_close=None):
+    return StreamingResponse(_buffered(chunks, on_close), status_code=status, headers=headers, media_type=media_type)
+
+
+# --- /dl-proxy ---
+
+async def _stream_upstream(url, name, byte_range, if_range, resp=None):
+    if resp is None:
+        headers = dict(flask_app.CDN_VIDEO_HEADERS)
+        if byte_range:
+            headers['Range'] = byte_range.to_header()
+            if if_range: headers['If-Range'] = if_range
+        resp = await _open_upstream('cdn_video', url, headers)
+
+    status, range_headers, span = flask_app.plan_upstream_range(resp.status_code, resp.headers, byte_range, if_range)
+    if status == 416:
+        await resp.aclose()
+        return Response(status_code=416, headers=range_headers)
+    headers = {**flask_app.dl_proxy_headers(name, resp.headers), **range_headers}
+    chunks = resp.aiter_bytes(CHUNK_SIZE)
+    if span: chunks = _emulate_range(chunks, *span)
+    return _streaming(chunks, status, headers, resp.headers.get('Content-Type', 'video/mp4'), on_close=resp.aclose)
+
+
+def _stream_cached(entry, name, byte_range, if_range, count_saved):
+    cache = flask_app.stream_cache
+    status, range_headers, start, end = flask_app.plan_cached_range(entry, byte_range, if_range)
+    if status == 416:
+        cache.release(entry)
+        return Response(status_code=416, headers=range_headers)
+    headers = {**flask_app.dl_proxy_headers(name, entry.headers), **range_headers}
+
+    async def release():
+        cache.release(entry)
+
+    return _streaming(_read_entry(entry, start, end, count_saved), status, headers,
+                      entry.headers.get('Content-Type', 'video/mp4'), on_close=release)
+
+
+async def _wait_ready(entry, timeout):
+    deadline = time.time() + timeout
+    with _entry_changes(entry) as changed:
+        while True:
+            changed.clear()
+            if entry.ready or entry.failed or time.time() >= deadline: break
+            await _wait_event(changed, deadline - time.time())
+    return entry.ready and not entry.failed
+
+
+async def dl_proxy(request):
+    """Async /dl-proxy: same Range and tee-cache behavior as the Flask route."""
+    url = request.query_params.get('url')
+    name = request.query_params.get('name', 'video.mp4')
+    if not url: return Response("No URL", status_code=400)
+    if stats.active >= MAX_STREAMS:
+        stats.rejected += 1
+        return Response("Too many concurrent downloads", status_code=503, headers={'Retry-After': '5'})
+
+    cache = flask_app.stream_cache
+    byte_range = parse_range_header(request.headers.get('Range'))
+    if byte_range and len(byte_range.ranges) != 1: byte_range = None
+    if_range = request.headers.get('If-Range')
+    # Time to the response headers; the body streams after the span closes
+    with flask_app.tracer.span('dl_proxy', ranged=bool(byte_range)):
+        try:
+            if byte_range:
+                entry = cache.peek(url)
+                if entry and entry.total is not None:
+                    response = _stream_cached(entry, name, byte_range, if_range, count_saved=True)
+                else:
+                    if entry: cache.release(entry)
+                    response = await _stream_upstream(url, name, byte_range, if_range)
+            else:
+                entry, filler = cache.acquire(url)
+                if filler:
+                    resp = None
+                    try:
+                        resp = await _open_upstream('cdn_video', url, flask_app.CDN_VIDEO_HEADERS)
+                        meta = {h: resp.headers[h] for h in ('Content-Type', 'ETag', 'Last-Modified') if resp.headers.get(h)}
+                        filling = resp.status_code == 200 and cache.begin_fill(url, entry, resp.headers.get('Content-Length'), meta)
+                    except Exception:
+                        # Nobody will fill this entry; don't leave later requests waiting on it
+                        cache.abandon(url, entry)
+                        cache.release(entry)
+                        if resp is not None: await resp.aclose()
+                        raise
+                    if filling:
+                        _spawn(_fill_entry(url, entry, resp))
+                        response = _stream_cached(entry, name, None, None, count_saved=False)
+                    else:
+                        if resp.status_code != 200: cache.abandon(url, entry)
+                        cache.release(entry)
+                        response = await _stream_upstream(url, name, None, None, resp=resp)
+                elif await _wait_ready(entry, cache.stall_timeout):
+                    response = _stream_cached(entry, name, None, None, count_saved=True)
+                else:
+                    cache.release(entry)
+                    response = await _stream_upstream(url, name, None, None)
+        except Exception as e:
+            return Response(str(e), status_code=500)
+
+    # flask_app.log_activity() needs a Flask request; build the event from the Starlette one
+    try:
+        flask_app.activity_log.log(flask_app.activity_event(
+            'file_download_proxy',
+            {'url': url, 'name': name, 'range': response.headers.get('Content-Range'), 'async': True},
+            request.headers, request.client.host if request.client else None
+        ))
+    except Exception as e:
+        print(f"LOGGING ERROR: {e}")
+    return response
+
+
+# --- /proxy-img ---
+
+def _not_modified(request, etag, last_modified):
+    environ = {'REQUEST_METHOD': 'GET'}
+    if request.headers.get('If-None-Match'): environ['HTTP_IF_NONE_MATCH'] = request.headers['If-None-Match']
+    if request.headers.get('If-Modified-Since'): environ['HTTP_IF_MODIFIED_SINCE'] = request.headers['If-Modified-Since']
+    if len(environ) == 1: return False
+    return not is_resource_modified(environ, etag=etag, last_modified=last_modified)
+
+
+def _thumb_headers(content_type, etag, last_modified, max_age):
+    headers = {'Content-Type': content_type, 'Cache-Control': f'public, max-age={max_age}'}
+    if etag: headers['ETag'] = etag
+    if last_modified: headers['Last-Modified'] = last_modified
+    return headers
+
+
+def _send_cached_thumbnail(request, meta, max_age=86400):
+    headers = _thumb_headers(meta['content_type'], meta['etag'], meta.get('last_modified'), max_age)
+    if _not_modified(request, meta['etag'], meta.get('last_modified')):
+        return Response(status_code=304, headers=headers)
+    try:
+        # Thumbnails are small and usually in the page cache; one read beats a thread hop
+        with open(meta['path'], 'rb') as f: body = f.read()
+    except OSError:
+        return None
+    return Response(body, headers=headers)
+
+
+async def _stream_thumbnail(request, key, resp, max_age, on_commit):
+    cache = flask_app.thumb_cache
+    writer = cache.write(key, resp.headers)
+    headers = _thumb_headers(resp.headers.get('Content-Type', 'image/jpeg'), resp.headers.get('ETag'),
+                             resp.headers.get('Last-Modified'), max_age)
+
+    if _not_modified(request, resp.headers.get('ETag'), resp.headers.get('Last-Modified')):
+        # Client already has this version: fill the cache, then answer 304
+        try:
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE): writer.write(chunk)
+            complete = True
+        except Exception:
+            complete = False
+        finally:
+            await resp.aclose()
+        await asyncio.to_thread(writer.close, complete)
+        if writer.committed and on_commit: on_commit(writer.meta)
+        return Response(status_code=304, headers=headers)
+
+    if resp.headers.get('Content-Length'): headers['Content-Length'] = resp.headers['Content-Length']
+    state = {'complete': False}
+
+    async def tee():
+        async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+            writer.write(chunk)
+            yield chunk
+        state['complete'] = True
+
+    async def close():
+        await asyncio.to_thread(writer.close, state['complete'])
+        await resp.aclose()
+        if writer.committed and on_commit: on_commit(writer.meta)
+
+    return _streaming(tee(), 200, headers, None, on_close=close)
+
+
+async def proxy_image(request):
+    """Async /proxy-img: same disk cache, derivatives and conditional handling as the Flask route."""
+    url = request.query_params.get('url')
+    if not url: return Response("No URL", status_code=400)
+    cache = flask_app.thumb_cache
+    key = normalize_url(url)
+
+    # Time to the response headers; the body streams after the span closes
+    with flask_app.tracer.span('proxy_img'):
+        spec = derivative_spec(request.query_params.get('w'), request.query_params.get('fmt'))
+        max_age, on_commit = 86400, None
+        if spec and flask_app.thumb_derivatives.available:
+            dkey = derivative_key(key, spec)
+            dmeta, _ = await asyncio.to_thread(cache.get, dkey)
+            if dmeta:
+                response = _send_cached_thumbnail(request, dmeta)
+                if response: return response
+            max_age = 60 # Let the browser come back for the small version
+            on_commit = lambda meta: flask_app.thumb_derivatives.request(meta, dkey, spec)
+
+        # The index is a SharedDB table in multi-worker mode; keep SQLite off the event loop
+        meta, stale = await asyncio.to_thread(cache.get, key)
+        try:
+            if meta and stale:
+                conditional = {}
+                if meta.get('etag'): conditional['If-None-Match'] = meta['etag']
+                if meta.get('last_modified'): conditional['If-Modified-Since'] = meta['last_modified']
+                resp = await _open_upstream('cdn_image', url, {**flask_app.CDN_IMAGE_HEADERS, **conditional})
+                if resp.status_code == 200:
+                    return await _stream_thumbnail(request, key, resp, max_age, on_commit)
+                await resp.aclose()
+                # 304 confirms our copy; on upstream errors keep serving it as well
+                if resp.status_code == 304: await asyncio.to_thread(cache.touch, key)
+            if meta:
+                if on_commit: on_commit(meta)
+                response = _send_cached_thumbnail(request, meta, max_age)
+                if response: return response
+
+            resp = await _open_upstream('cdn_image', url, flask_app.CDN_IMAGE_HEADERS)
+            if resp.status_code == 200:
+                return await _stream_thumbnail(request, key, resp, max_age, on_commit)
+            body = await resp.aread()
+            await resp.aclose()
+            return Response(body, status_code=resp.status_code,
+                            headers={'Content-Type': resp.headers.get('Content-Type', 'image/jpeg')})
+        except Exception as e:
+            if meta:
+                response = _send_cached_thumbnail(request, meta, max_age)
+                if response: return response
+            return Response(str(e), status_code=500)
+
+
+# --- Job status push (SSE / long-poll) ---
+
+async def _wait_for_change(job_id, since, timeout):
+    """Async twin of JobStore.wait_for_change(): the watcher hops back onto the loop.
+
+    SharedJobStore reads versions from SQLite, so those calls run in the
+    default thread pool instead of on the event loop.
+    """
+    store = flask_app.job_store
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    notify = lambda: loop.call_soon_threadsafe(changed.set)
+    await asyncio.to_thread(store.watch, job_id, notify)
+    try:
+        if await asyncio.to_thread(store.version, job_id) != since: return
+        await _wait_event(changed, timeout)
+    finally:
+        store.unwatch(job_id, notify)
+
+
+def _status_snapshot(job_id, admin):
+    """(watch_id, version, status payload) in one thread-pool hop; the job store may be SQLite."""
+    watch_id = flask_app.status_watch_id(job_id)
+    return watch_id, flask_app.job_store.version(watch_id), flask_app.job_status_payload(job_id, admin)
+
+
+def _is_admin(request):
+    """flask_app.is_admin() for Starlette requests (job timelines are admin-only)."""
+    return request.headers.get('x-app-secret') == flask_app.APP_SECRET
+
+
+async def _forward_to_node(request, node):
+    """Async twin of app.forward_to_node() for the job routes served natively here."""
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in flask_app.HOP_HEADERS}
+    headers[flask_app.CLUSTER_FORWARDED] = flask_app.cluster.forwarded_marker()
+    headers['X-Forwarded-For'] = request.headers.get('x-forwarded-for', request.client.host if request.client else '')
+    url = flask_app.cluster.url_of(node) + request.url.path + (f"?{request.url.query}" if request.url.query else '')
+    try:
+        resp = await _open_upstream('cluster', url, headers)
+    except httpx.HTTPError as e:
+        print(f"CLUSTER ERROR: Forward to {node} failed: {e}")
+        return JSONResponse({'success': False, 'status': 'node_unavailable', 'node': node,
+                             'message': 'The server holding this job is unreachable, retry shortly.'}, status_code=503)
+    flask_app.cluster.count_forwarded()
+    relayed = {k: v for k, v in resp.headers.items()
+               if k.lower() not in flask_app.HOP_HEADERS and not k.lower().startswith('access-control-')}
+    return _streaming(resp.aiter_raw(), resp.status_code, relayed, None, on_close=resp.aclose)
+
+
+async def status_long_poll(request):
+    """Async /status/<job_id>/wait: same contract as the Flask route, without holding a thread."""
+    job_id = request.path_params['job_id']
+    owner = flask_app.owning_peer(job_id, request.headers)
+    if owner: return await _forward_to_node(request, owner)
+    try:
+        since = int(request.query_params['since']) if 'since' in request.query_params else None
+        timeout = min(float(request.query_params.get('timeout', flask_app.LONG_POLL_TIMEOUT)), flask_app.LONG_POLL_TIMEOUT)
+    except ValueError:
+        since, timeout = None, flask_app.LONG_POLL_TIMEOUT
+    admin = _is_admin(request)
+    watch_id, _, status = await asyncio.to_thread(_status_snapshot, job_id, admin)
+    if not status:
+        return JSONResponse({'status': 'not_found'}, status_code=404)
+    if since is not None and status['version'] == since and status.get('status') not in flask_app.TERMINAL_STATUSES:
+        await _wait_for_change(watch_id, since, timeout)
+        status = await asyncio.to_thread(flask_app.job_status_payload, job_id, admin) or {'status': 'not_found'}
+    return JSONResponse(status)
+
+
+async def status_events(request):
+    """Async /status/<job_id>/events (Server-Sent Events)."""
+    job_id = request.path_params['job_id']
+    owner = flask_app.owning_peer(job_id, request.headers)
+    if owner: return await _forward_to_node(request, owner)
+    admin = _is_admin(request)
+
+    async def generate():
+        last = None
+        deadline = time.time() + flask_app.SSE_MAX_SECONDS
+        yield 'retry: 3000\n\n'
+        while True:
+            watch_id, version, status = await asyncio.to_thread(_status_snapshot, job_id, admin)
+            if status is None:
+                yield f"event: status\ndata: {json.dumps({'status': 'not_found'})}\n\n"
+                return
+            body = json.dumps(status)
+            if body != last:
+                yield f"id: {version}\nevent: status\ndata: {body}\n\n"
+                last = body
+            else:
+                yield ': keepalive\n\n'
+            if status.get('status') in flask_app.TERMINAL_STATUSES or time.time() >= deadline: return
+            await _wait_for_change(watch_id, version, flask_app.SSE_KEEPALIVE)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    yield
+    for client in _clients.values():
+        await client.aclose()
+
+
+flask_app.metrics_providers['async_proxy'] = stats.as_dict
+
+app = Starlette(
+    routes=[
+        Route('/dl-proxy', dl_proxy),
+        Route('/proxy-img', proxy_image),
+        Route('/status/{job_id}/wait', status_long_poll),
+        Route('/status/{job_id}/events', status_events),
+        Mount('/', app=WSGIMiddleware(flask_app.app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,45 @@
+import random
+import time
+from credit_store import CreditStore
+
+def populate(store, users):
+    for i in range(users):
+        store.get_or_create(f"did_{i}", 100)
+
+def bench_ops(store, users, ops=50000):
+    """Mixed traffic: returning users charging credits, plus new users arriving via referral links."""
+    rng = random.Random(7)
+    keys = [f"did_{rng.randrange(users)}" for _ in range(ops)]
+    referral_ids = [store.get(k).referral_id for k in keys[:1000]]
+    start = time.perf_counter()
+    for i, key in enumerate(keys):
+        record, _ = store.get_or_create(key, 100)
+        store.charge(record, 10)
+        store.refill(record, 10, 100)
+        if i % 10 == 0:
+            store.get_or_create(f"new_{users}_{i}", 100)
+            store.reward_referrer(referral_ids[i % len(referral_ids)], 2.0)
+    elapsed = time.perf_counter() - start
+    print(f"{users:>7,} users: {elapsed / ops * 1e6:.2f} us/request ({ops / elapsed:,.0f} requests/sec)")
+
+def bench_expiry(users):
+    """Everyone goes idle at once; the next request pays for the whole sweep, amortized per evicted user."""
+    store = CreditStore(ttl=3600)
+    populate(store, users)
+    for record in list(store._users.values()):
+        record.last_activity -= 7200
+    start = time.perf_counter()
+    store.get_or_create("wake_up", 100)
+    elapsed = time.perf_counter() - start
+    print(f"{users:>7,} users: expired {store.expired:,} in {elapsed * 1000:.1f} ms ({elapsed / max(store.expired, 1) * 1e6:.2f} us/user)")
+
+if __name__ == "__main__":
+    print("Lookup + charge + referral latency:")
+    for users in (1000, 10000, 100000):
+        store = CreditStore()
+        populate(store, users)
+        bench_ops(store, users)
+
+    print("Idle-user expiry:")
+    for users in (10000, 100000):
+        bench_expiry(users)
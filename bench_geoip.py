@@ -0,0 +1,41 @@
+import os
+import random
+import tempfile
+import time
+from geoip import GeoIPResolver
+
+def build_database(path, ranges=300000):
+    """Writes a synthetic range CSV covering most of the public IPv4 space."""
+    step = (2 ** 32) // ranges
+    countries = ['IN', 'US', 'DE', 'BR', 'JP', 'GB', 'FR', 'ID']
+    with open(path, 'w') as f:
+        f.write("ip_start,ip_end,country,region,city\n")
+        for i in range(ranges):
+            start = i * step
+            f.write(f"{start},{start + step - 1},{countries[i % len(countries)]},Region {i % 500},City {i % 5000}\n")
+
+def bench_lookups(resolver, ips, label):
+    start = time.perf_counter()
+    for ip in ips:
+        resolver.lookup(ip)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {len(ips) / elapsed:,.0f} lookups/sec ({elapsed / len(ips) * 1e6:.2f} us/lookup)")
+
+if __name__ == "__main__":
+    db_path = os.path.join(tempfile.mkdtemp(), 'geoip.csv')
+    build_database(db_path)
+
+    t = time.perf_counter()
+    resolver = GeoIPResolver(db_path, cache_size=0)
+    resolver.load()
+    print(f"Load time: {time.perf_counter() - t:.2f}s")
+
+    rng = random.Random(7)
+    ips = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}" for _ in range(200000)]
+    bench_lookups(resolver, ips, "Index only (no LRU)")
+
+    cached = GeoIPResolver(db_path, cache_size=10000)
+    cached.load()
+    hot = ips[:5000] * 40 # Popular IPs repeat, like real traffic
+    bench_lookups(cached, hot, "LRU warm (5k hot IPs)")
+    print(cached.stats())
@@ -0,0 +1,158 @@
+import hmac
+import time
+import hashlib
+import threading
+
+# Job IDs and filenames minted on a node look like "<node>~<rest>"
+SEPARATOR = '~'
+
+
+def parse_nodes(spec):
+    """'a=http://10.0.0.1:7860,b=http://10.0.0.2:7860' -> {'a': 'http://10.0.0.1:7860', ...}"""
+    nodes = {}
+    for item in (spec or '').split(','):
+        node_id, sep, url = item.strip().partition('=')
+        if not sep or not node_id.strip() or not url.strip(): continue
+        if SEPARATOR in node_id: raise ValueError(f"Node id {node_id!r} may not contain {SEPARATOR!r}")
+        nodes[node_id.strip()] = url.strip().rstrip('/')
+    return nodes
+
+
+class Cluster:
+    """Static membership of app replicas and the routing rules between them.
+
+    IDs and download filenames minted through tag() carry the owning node as
+    a "<node>~" prefix, so any replica can tell where a job's state and files
+    live and forward /status, /files and /github-callback there. A heartbeat
+    thread polls every peer's /cluster/health; peers that are down or
+    draining are skipped when new work is handed off. A draining node keeps
+    serving the jobs it owns but passes new downloads to a peer. Without
+    peers every method degrades to plain single-node behaviour.
+
+    Forwarded requests carry a marker signed with the shared `secret`
+    (forwarded_marker()); is_forwarded() only trusts a marker from a known
+    peer with a valid, recent signature, so a client can't set the header
+    itself to skip forwarding or hand-off.
+    """
+
+    def __init__(self, node_id, nodes, fetch_health=None, heartbeat=10, secret=None, max_skew=300):
+        self.node_id = node_id
+        self.nodes = dict(nodes)
+        self.fetch_health = fetch_health # fetch_health(base_url) -> (status_code, json body)
+        self.heartbeat = heartbeat
+        self.secret = secret.encode('utf-8') if secret else None
+        self.max_skew = max_skew
+        self.draining = False
+        self._peers = {
+            node: {'url': url, 'state': 'unknown', 'checked': None, 'error': None}
+            for node, url in self.nodes.items() if node != node_id
+        }
+        self._lock = threading.Lock()
+        self._next = 0
+        self._thread = None
+        self.forwarded = 0
+        self.handed_off = 0
+        self.rejected_markers = 0
+
+    @property
+    def enabled(self):
+        return bool(self._peers)
+
+    # --- Ownership ---
+
+    def tag(self, value):
+        """Marks a new job ID or filename as owned by this node."""
+        return f"{self.node_id}{SEPARATOR}{value}" if self.enabled else value
+
+    def owner(self, key):
+        """The peer owning a tagged job ID or filename; None if it's ours, untagged or unknown."""
+        node, sep, _ = (key or '').partition(SEPARATOR)
+        if not sep or node == self.node_id or node not in self._peers: return None
+        return node
+
+    def url_of(self, node):
+        return self.nodes.get(node)
+
+    # --- Forwarding ---
+
+    def forwarded_marker(self):
+        """Header value for a request this node relays: '<node>:<unix time>:<hmac>'."""
+        stamp = f"{self.node_id}:{int(time.time())}"
+        return f"{stamp}:{self._sign(stamp)}" if self.secret else stamp
+
+    def _sign(self, stamp):
+        return hmac.new(self.secret, stamp.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def is_forwarded(self, marker):
+        """True if `marker` was signed by a peer within max_skew seconds; anything else is ignored."""
+        if not marker: return False
+        node, _, rest = marker.partition(':')
+        stamp, _, signature = rest.partition(':')
+        valid = (self.secret is not None and node in self._peers and stamp.isdigit()
+                 and abs(time.time() - int(stamp)) <= self.max_skew
+                 and hmac.compare_digest(signature, self._sign(f"{node}:{stamp}")))
+        if not valid:
+            with self._lock:
+                self.rejected_markers += 1
+        return valid
+
+    def count_forwarded(self):
+        with self._lock:
+            self.forwarded += 1
+
+    def count_handed_off(self):
+        with self._lock:
+            self.handed_off += 1
+
+    # --- Membership ---
+
+    def pick_peer(self):
+        """Round-robin over peers that are up and not draining; None if there are none."""
+        with self._lock:
+            candidates = sorted(n for n, p in self._peers.items() if p['state'] == 'up')
+            if not candidates: return None
+            self._next += 1
+            return candidates[self._next % len(candidates)]
+
+    def set_draining(self, draining):
+        self.draining = bool(draining)
+        print(f"CLUSTER: Node {self.node_id} {'draining' if self.draining else 'accepting new work'}")
+
+    def check_peers(self):
+        for node, peer in list(self._peers.items()):
+            try:
+                status, body = self.fetch_health(peer['url'])
+                state = 'draining' if body.get('draining') else ('up' if status == 200 else 'down')
+                error = None
+            except Exception as e:
+                state, error = 'down', str(e)[:200]
+            with self._lock:
+                if peer['state'] != state:
+                    print(f"CLUSTER: Peer {node} is {state}")
+                peer.update({'state': state, 'checked': time.time(), 'error': error})
+
+    def start(self):
+        """Starts the heartbeat thread (no-op without peers)."""
+        if self._thread or not self.enabled or not self.fetch_health: return
+        self._thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            try:
+                self.check_peers()
+            except Exception as e:
+                print(f"CLUSTER ERROR: Heartbeat failed: {e}")
+            time.sleep(self.heartbeat)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'node': self.node_id,
+                'draining': self.draining,
+                'peers': {node: dict(peer) for node, peer in self._peers.items()},
+                'forwarded': self.forwarded,
+                'handed_off': self.handed_off,
+                'rejected_markers': self.rejected_markers,
+                'signed': self.secret is not None
+            }
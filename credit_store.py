@@ -0,0 +1,251 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class UserRecord:
+    """One user's credits and cash balance (slots keep 100k of these small)."""
+
+    __slots__ = ('key', 'credits', 'balance', 'referral_id', 'last_activity', 'is_auth')
+
+    def __init__(self, key, credits, referral_id, is_auth=False):
+        self.key = key
+        self.credits = credits
+        self.balance = 0.0
+        self.referral_id = referral_id
+        self.last_activity = time.time()
+        self.is_auth = is_auth
+
+
+class CreditStore:
+    """In-memory user credit table with O(1) lookups, referrals and expiry.
+
+    Records live in an OrderedDict kept in last-activity order, so users idle
+    for `ttl` seconds are popped off the front as new activity arrives
+    (amortized O(1), no full scans). A referral_id -> user_key index makes
+    referral rewards a dict lookup. The structure lock only guards those two
+    maps; credit and balance arithmetic happens under one of `stripes` locks
+    picked by user key, so users don't contend with each other.
+    `python bench_credit_store.py` measures latency from 1k to 100k users.
+    """
+
+    def __init__(self, ttl=86400, stripes=64):
+        self.ttl = ttl
+        self._users = OrderedDict() # user_key -> UserRecord, least recently active first
+        self._referrals = {} # referral_id -> user_key
+        self._lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        self.created = 0
+        self.expired = 0
+        self.referrals = 0
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    # --- Records ---
+
+    def get_or_create(self, key, credits, is_auth=False):
+        """Returns (record, created) and marks the user as just active."""
+        now = time.time()
+        with self._lock:
+            record = self._users.get(key)
+            created = record is None
+            if created:
+                referral_id = str(uuid.uuid4())[:8]
+                while referral_id in self._referrals:
+                    referral_id = str(uuid.uuid4())[:8]
+                record = UserRecord(key, credits, referral_id, is_auth)
+                self._users[key] = record
+                self._referrals[referral_id] = key
+                self.created += 1
+            else:
+                self._users.move_to_end(key)
+            record.last_activity = now
+            self._expire_locked(now)
+        return record, created
+
+    def get(self, key):
+        with self._lock:
+            return self._users.get(key)
+
+    def _expire_locked(self, now):
+        while self._users:
+            oldest = next(iter(self._users.values()))
+            if now - oldest.last_activity <= self.ttl: break
+            self._users.popitem(last=False)
+            self._referrals.pop(oldest.referral_id, None)
+            self.expired += 1
+
+    # --- Credits and balance ---
+
+    def charge(self, record, amount):
+        """Deducts amount if the user has it; False otherwise."""
+        with self._stripe(record.key):
+            if record.credits < amount: return False
+            record.credits -= amount
+            return True
+
+    def add(self, record, credits=0, balance=0.0):
+        with self._stripe(record.key):
+            record.credits += credits
+            record.balance += balance
+
+    def refill(self, record, below, to, force=False):
+        """Tops credits up to `to` when they fell under `below`; returns the old value if it did."""
+        with self._stripe(record.key):
+            if record.credits >= below and not force: return None
+            previous, record.credits = record.credits, to
+            return previous
+
+    def add_balance(self, key, amount):
+        """Adds cash to a user by key; False if the user has expired."""
+        record = self.get(key)
+        if record is None: return False
+        self.add(record, balance=amount)
+        return True
+
+    def reward_referrer(self, referral_id, amount, exclude=None):
+        """Credits the owner of referral_id; returns their user key, or None if unknown."""
+        with self._lock:
+            key = self._referrals.get(referral_id)
+            record = self._users.get(key) if key else None
+        if record is None or key == exclude: return None
+        self.add(record, balance=amount)
+        self.referrals += 1
+        return key
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._referrals.clear()
+
+    def __len__(self):
+        return len(self._users)
+
+    def stats(self):
+        return {
+            'users': len(self._users),
+            'ttl': self.ttl,
+            'created': self.created,
+            'expired': self.expired,
+            'referrals': self.referrals
+        }
+
+
+class SharedCreditStore:
+    """CreditStore with the same interface, kept in a SharedDB for multi-worker mode.
+
+    Every mutation is one UPDATE (or a short BEGIN IMMEDIATE transaction),
+    so a deduction in one worker can't race a deduction in another. Records
+    handed out are snapshots; each mutation refreshes the record it was given
+    from the row it just wrote. Idle users are deleted through the
+    last-activity index at most once per `expire_every` seconds per process.
+    """
+
+    def __init__(self, db, ttl=86400, expire_every=60):
+        self.db = db
+        self.ttl = ttl
+        self.expire_every = expire_every
+        self._last_expire = 0
+        self.created = 0
+        self.expired = 0
+        self.referrals = 0
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS users (key TEXT PRIMARY KEY, credits INTEGER, balance REAL, '
+            'referral_id TEXT UNIQUE, last_activity REAL, is_auth INTEGER)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS users_last_activity ON users (last_activity)')
+
+    def _record(self, row):
+        record = UserRecord(row[0], row[1], row[3], bool(row[5]))
+        record.balance = row[2]
+        record.last_activity = row[4]
+        return record
+
+    def _refresh(self, record, row):
+        if row: record.credits, record.balance = row
+
+    # --- Records ---
+
+    def get_or_create(self, key, credits, is_auth=False):
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                'UPDATE users SET last_activity = ? WHERE key = ? RETURNING key, credits, balance, referral_id, last_activity, is_auth',
+                (now, key)
+            ).fetchone()
+            created = row is None
+            if created:
+                referral_id = str(uuid.uuid4())[:8]
+                while conn.execute('SELECT 1 FROM users WHERE referral_id = ?', (referral_id,)).fetchone():
+                    referral_id = str(uuid.uuid4())[:8]
+                row = (key, credits, 0.0, referral_id, now, int(is_auth))
+                conn.execute('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)', row)
+                self.created += 1
+            if now - self._last_expire > self.expire_every:
+                self._last_expire = now
+                self.expired += conn.execute('DELETE FROM users WHERE last_activity < ?', (now - self.ttl,)).rowcount
+        return self._record(row), created
+
+    def get(self, key):
+        row = self.db.execute(
+            'SELECT key, credits, balance, referral_id, last_activity, is_auth FROM users WHERE key = ?', (key,)
+        ).fetchone()
+        return self._record(row) if row else None
+
+    # --- Credits and balance ---
+
+    def charge(self, record, amount):
+        row = self.db.execute(
+            'UPDATE users SET credits = credits - ? WHERE key = ? AND credits >= ? RETURNING credits, balance',
+            (amount, record.key, amount)
+        ).fetchone()
+        if row is None:
+            current = self.get(record.key)
+            if current: record.credits, record.balance = current.credits, current.balance
+            return False
+        self._refresh(record, row)
+        return True
+
+    def add(self, record, credits=0, balance=0.0):
+        self._refresh(record, self.db.execute(
+            'UPDATE users SET credits = credits + ?, balance = balance + ? WHERE key = ? RETURNING credits, balance',
+            (credits, balance, record.key)
+        ).fetchone())
+
+    def refill(self, record, below, to, force=False):
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT credits FROM users WHERE key = ?', (record.key,)).fetchone()
+            if row is None or (row[0] >= below and not force): return None
+            conn.execute('UPDATE users SET credits = ? WHERE key = ?', (to, record.key))
+        record.credits = to
+        return row[0]
+
+    def add_balance(self, key, amount):
+        return self.db.execute('UPDATE users SET balance = balance + ? WHERE key = ?', (amount, key)).rowcount > 0
+
+    def reward_referrer(self, referral_id, amount, exclude=None):
+        row = self.db.execute(
+            'UPDATE users SET balance = balance + ? WHERE referral_id = ? AND key != ? RETURNING key',
+            (amount, referral_id, exclude or '')
+        ).fetchone()
+        if row is None: return None
+        self.referrals += 1
+        return row[0]
+
+    def clear(self):
+        self.db.execute('DELETE FROM users')
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def stats(self):
+        return {
+            'users': len(self),
+            'ttl': self.ttl,
+            'backend': 'sqlite',
+            'created': self.created,
+            'expired': self.expired,
+            'referrals': self.referrals
+        }
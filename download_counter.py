@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import fcntl
+import threading
+
+
+class DownloadCounter:
+    """Process-wide download counter that is flushed to disk periodically.
+
+    increment() only touches memory; a background thread writes the value to
+    stats.json every flush_every seconds when it changed, and flush() should
+    be registered at exit so the last increments are not lost.
+
+    With shared=True several worker processes update the same file: each
+    flush adds only this process's increments since the last flush to the
+    value on disk under an flock, and picks up the other workers' counts.
+    """
+
+    def __init__(self, path, flush_every=30, sync_lock=None, shared=False):
+        self.path = str(path)
+        self.flush_every = flush_every
+        # Lock shared with the HF CommitScheduler so a sync never sees a half-written file
+        self.sync_lock = sync_lock
+        self._lock = threading.Lock()
+        self._value = 0
+        self._flushed = 0
+        self.shared = shared
+        self._thread = None
+
+    def load(self):
+        """Reads the persisted increment (missing or corrupt file counts as 0)."""
+        value = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    value = json.load(f).get("increment", 0)
+            except Exception: pass
+        with self._lock:
+            self._value = self._flushed = value
+        return value
+
+    @property
+    def value(self):
+        return self._value
+
+    def increment(self, n=1):
+        with self._lock:
+            self._value += n
+            return self._value
+
+    def start(self):
+        """Starts the background flush thread."""
+        if self._thread: return
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def flush(self):
+        """Writes the current value if it changed since the last flush."""
+        if self.shared: return self._flush_shared()
+        value = self._value
+        if value == self._flushed: return False
+        tmp_path = self.path + '.tmp'
+        if self.sync_lock:
+            with self.sync_lock:
+                self._write(tmp_path, value)
+        else:
+            self._write(tmp_path, value)
+        self._flushed = value
+        return True
+
+    def _flush_shared(self):
+        with self._lock:
+            pending = self._value - self._flushed
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'r') as f:
+                    on_disk = json.load(f).get("increment", 0)
+            except Exception:
+                on_disk = self._flushed
+            total = on_disk + pending
+            if pending:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                if self.sync_lock:
+                    with self.sync_lock:
+                        self._write(tmp_path, total)
+                else:
+                    self._write(tmp_path, total)
+        with self._lock:
+            # Increments that landed while we were writing stay pending
+            self._value = total + (self._value - self._flushed - pending)
+            self._flushed = total
+        return bool(pending)
+
+    def _write(self, tmp_path, value):
+        with open(tmp_path, 'w') as f:
+            json.dump({"increment": value}, f)
+        os.replace(tmp_path, self.path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_every)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"STATS ERROR: Failed to flush download counter: {e}")
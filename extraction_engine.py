@@ -0,0 +1,368 @@
+import os
+import sys
+import time
+import queue
+import threading
+import subprocess
+from collections import namedtuple
+from multiprocessing.connection import Connection
+
+# Picklable description of one yt-dlp run. `outtmpl` is only used for downloads.
+ExtractionRequest = namedtuple('ExtractionRequest', ['url', 'platform', 'download', 'outtmpl'])
+ExtractionRequest.__new__.__defaults__ = (False, None)
+
+# Format fields the app actually reads; the full info dict is huge and not always picklable
+FORMAT_FIELDS = ('ext', 'vcodec', 'acodec', 'height', 'width', 'url', 'filesize')
+INFO_FIELDS = ('id', 'title', 'thumbnail', 'uploader', 'uploader_id', 'tags', 'description', 'url', 'ext', 'duration')
+# How often a cancellable extract() checks its cancel event while it waits
+CANCEL_POLL_INTERVAL = 0.25
+
+
+class ExtractionError(Exception):
+    """Structured failure from an extraction worker (error_type is the original exception name)."""
+
+    def __init__(self, error_type, message):
+        super().__init__(message)
+        self.error_type = error_type
+        self.message = message
+
+
+def build_base_opts(platform, download):
+    """Static yt-dlp options per platform and mode (cookies/POT are added per task)."""
+    if download:
+        opts = {
+            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best' if platform == 'youtube' else 'b[ext=mp4]/b',
+            'quiet': True,
+            'no_playlist': True,
+            'nocheckcertificate': True,
+            'geo_bypass': True
+        }
+        if platform == 'youtube':
+            opts['extractor_args'] = {
+                'youtube': {
+                    'player_client': ['android', 'ios', 'mweb'],
+                    'skip': ['web', 'web_creator']
+                }
+            }
+            opts['user_agent'] = 'Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Mobile Safari/537.36'
+        return opts
+
+    # Metadata-only (preview)
+    if platform == 'youtube':
+        return {
+            'quiet': True,
+            'no_warnings': True,
+            'nocheckcertificate': True,
+            'geo_bypass': True,
+            'no_playlist': True,
+            'force_ipv4': True,
+            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+            'extractor_args': {
+                'youtube': {
+                    'player_client': ['tv', 'mweb', 'android', 'ios'],
+                    'skip': ['web', 'web_creator']
+                }
+            }
+        }
+    return { # Instagram
+        'quiet': True,
+        'no_warnings': True,
+        'nocheckcertificate': True,
+        'geo_bypass': True,
+        'no_playlist': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        }
+    }
+
+
+def _task_opts(base, req, config):
+    """Copies the prebuilt options and applies per-task settings."""
+    opts = dict(base)
+    if 'extractor_args' in opts:
+        opts['extractor_args'] = {k: dict(v) for k, v in opts['extractor_args'].items()}
+    if req.download and req.outtmpl:
+        opts['outtmpl'] = req.outtmpl
+    if req.platform == 'youtube':
+        cookies_file = config.get('cookies_file')
+        if cookies_file and os.path.exists(cookies_file):
+            opts['cookiefile'] = str(cookies_file)
+        pot_file = config.get('pot_file')
+        # Inject PO Token if available (download mode only, as before)
+        if req.download and pot_file and os.path.exists(pot_file):
+            with open(pot_file, 'r') as f: pot = f.read().strip()
+            if pot:
+                opts['extractor_args']['youtube']['po_token'] = [pot]
+                print("USING PO TOKEN FOR LOCAL DOWNLOAD")
+    return opts
+
+
+def _stage_spans(started, marks):
+    """(stage, started, seconds) for metadata extraction, the transfer and the ffmpeg merge."""
+    finished = time.time()
+    transfer_start = marks.get('transfer_start')
+    spans = [('extract_info', started, (transfer_start or marks.get('merge_started') or finished) - started)]
+    if transfer_start:
+        spans.append(('transfer', transfer_start, marks.get('transfer_end', finished) - transfer_start))
+    if marks.get('merge_started'):
+        spans.append(('merge', marks['merge_started'], marks.get('merge_finished', finished) - marks['merge_started']))
+    return spans
+
+
+def run_extraction(yt_dlp, base_opts, config, req):
+    """Runs one extraction and returns a trimmed, picklable info dict.
+
+    Downloads also report 'spans': when yt-dlp started transferring (first
+    progress hook) and merging (Merger postprocessor), so the caller can
+    split the run into its stages.
+    """
+    base = base_opts.get((req.platform if req.platform == 'youtube' else 'instagram', bool(req.download)))
+    opts = _task_opts(base, req, config)
+    started = time.time()
+    marks = {}
+    if req.download:
+        def on_progress(d):
+            marks.setdefault('transfer_start', time.time())
+            if d.get('status') == 'finished': marks['transfer_end'] = time.time()
+        def on_postprocess(d):
+            if d.get('postprocessor') == 'Merger' and d.get('status') in ('started', 'finished'):
+                marks.setdefault(f"merge_{d['status']}", time.time())
+        opts['progress_hooks'] = [on_progress]
+        opts['postprocessor_hooks'] = [on_postprocess]
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(req.url, download=req.download)
+        # Only copy keys yt-dlp actually set, so callers' .get(key, default) keeps working
+        result = {k: info[k] for k in INFO_FIELDS if k in info}
+        result['formats'] = [{k: f[k] for k in FORMAT_FIELDS if k in f} for f in info.get('formats') or []]
+        if req.download:
+            result['filename'] = ydl.prepare_filename(info)
+            result['spans'] = _stage_spans(started, marks)
+        return result
+
+
+def _wait_cancellable(wait, timeout, cancel):
+    """Calls wait(seconds) in short slices so a set `cancel` event is noticed; falsy once cancelled."""
+    if cancel is None: return wait(timeout)
+    deadline = time.time() + timeout
+    while not cancel.is_set():
+        result = wait(max(0, min(CANCEL_POLL_INTERVAL, deadline - time.time())))
+        if result or time.time() >= deadline: return result
+    return None
+
+
+def _all_base_opts():
+    return {(p, d): build_base_opts(p, d) for p in ('instagram', 'youtube') for d in (False, True)}
+
+
+def _worker_main(recv_fd, send_fd):
+    """Entry point of a pool process: import yt-dlp once, then serve tasks."""
+    import yt_dlp
+    conn_in = Connection(recv_fd, writable=False)
+    conn_out = Connection(send_fd, readable=False)
+    config = conn_in.recv()
+    base_opts = _all_base_opts()
+    while True:
+        try:
+            msg = conn_in.recv()
+        except EOFError:
+            break
+        if msg is None: break
+        try:
+            conn_out.send((True, run_extraction(yt_dlp, base_opts, config, msg)))
+        except Exception as e:
+            conn_out.send((False, (type(e).__name__, str(e))))
+
+
+class _Worker:
+    """One pool process, started as a fresh interpreter running this file.
+
+    A plain subprocess (rather than multiprocessing) keeps the child from
+    re-importing the web app's __main__ module and its background threads.
+    """
+
+    def __init__(self, config):
+        child_recv, parent_send = os.pipe()
+        parent_recv, child_send = os.pipe()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(child_recv), str(child_send)],
+            pass_fds=(child_recv, child_send)
+        )
+        os.close(child_recv)
+        os.close(child_send)
+        self.send_conn = Connection(parent_send, readable=False)
+        self.recv_conn = Connection(parent_recv, writable=False)
+        self.send_conn.send(config)
+        self.tasks = 0
+
+    def stop(self, kill=False):
+        try:
+            if kill: self.process.kill()
+            else: self.send_conn.send(None)
+        except Exception: pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.send_conn.close()
+        self.recv_conn.close()
+
+
+class ExtractionEngine:
+    """Pool of pre-started processes running yt-dlp outside the web worker.
+
+    Each process imports yt_dlp and builds the per-platform options once, then
+    serves ExtractionRequests over a pipe, so CPU-heavy extraction runs in
+    parallel across cores instead of behind the GIL. `preview_processes`
+    extra processes only take metadata-only requests (/preview), so a few
+    long downloads can't starve previews; previews also use a free download
+    process when their own lane is busy. The timeout covers the whole task,
+    waiting for a process included (ExtractionError 'Busy' if none frees up
+    in time); a task that runs past it, or whose `cancel` event is set (e.g. a
+    racing provider that lost), gets its process killed and replaced.
+    Processes are also recycled after `max_tasks` tasks. With processes=0
+    extractions run in the calling thread (useful for local debugging).
+    """
+
+    def __init__(self, config, processes=None, max_tasks=50, timeout=600, preview_processes=1):
+        self.config = config
+        self.processes = (os.cpu_count() or 1) if processes is None else processes
+        self.preview_processes = preview_processes if self.processes > 0 else 0
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._preview_idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._inline_opts = None
+        self.started = False
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.busy = 0
+        self.cancelled = 0
+
+    def start(self):
+        """Starts the pool (the app calls this at boot; extract() falls back to it)."""
+        with self._lock:
+            if self.started or self.processes <= 0: return
+            self.started = True
+            for _ in range(self.processes):
+                self._idle.put(_Worker(self.config))
+            for _ in range(self.preview_processes):
+                self._preview_idle.put(_Worker(self.config))
+        print(f"EXTRACTION ENGINE: {self.processes} worker processes started (+{self.preview_processes} for previews)")
+
+    def shutdown(self):
+        for lane in (self._idle, self._preview_idle):
+            while True:
+                try: lane.get_nowait().stop()
+                except queue.Empty: break
+
+    def _lanes(self, req):
+        """Idle queues req may take a process from, in order of preference."""
+        if req.download or not self.preview_processes: return (self._idle,)
+        return (self._preview_idle, self._idle)
+
+    def _acquire(self, req, timeout, cancel):
+        """(worker, lane it goes back to), or (None, None) on timeout or cancel."""
+        lanes = self._lanes(req)
+
+        def get_idle(seconds):
+            for lane in lanes:
+                try: return lane.get_nowait(), lane
+                except queue.Empty: pass
+            # Nothing free right now: block on the request's own lane
+            try: return lanes[0].get(timeout=seconds), lanes[0]
+            except queue.Empty: return None
+
+        return _wait_cancellable(get_idle, timeout, cancel) or (None, None)
+
+    def extract(self, req, timeout=None, cancel=None):
+        """Runs req in a pool process; returns the trimmed info dict or raises ExtractionError.
+
+        Setting the optional `cancel` event (a threading.Event) abandons the
+        task: ExtractionError 'Cancelled' is raised and a running process is
+        killed, so a lost race doesn't keep a process busy until it finishes.
+        """
+        if cancel is not None and cancel.is_set():
+            self.cancelled += 1
+            raise ExtractionError('Cancelled', 'Extraction cancelled before it started')
+        if self.processes <= 0:
+            return self._extract_inline(req)
+        if not self.started: self.start()
+
+        timeout = timeout or self.timeout
+        deadline = time.time() + timeout
+        # Downloads hold their process for the whole transfer; don't queue behind them forever
+        worker, lane = self._acquire(req, timeout, cancel)
+        if worker is None:
+            if cancel is not None and cancel.is_set():
+                self.cancelled += 1
+                raise ExtractionError('Cancelled', 'Extraction cancelled while waiting for a process')
+            self.busy += 1
+            raise ExtractionError('Busy', f"No extraction process free within {timeout}s")
+        try:
+            worker.send_conn.send(req)
+            # The time spent waiting for the process counts against the same timeout
+            if not _wait_cancellable(worker.recv_conn.poll, max(0, deadline - time.time()), cancel):
+                worker.stop(kill=True)
+                worker = _Worker(self.config)
+                if cancel is not None and cancel.is_set():
+                    self.cancelled += 1
+                    raise ExtractionError('Cancelled', 'Extraction cancelled')
+                self.timeouts += 1
+                raise ExtractionError('Timeout', f"Extraction exceeded {timeout}s")
+            ok, payload = worker.recv_conn.recv()
+        except (EOFError, OSError, BrokenPipeError) as e:
+            # The process died under us (OOM, segfault in a native lib...)
+            worker.stop(kill=True)
+            worker = _Worker(self.config)
+            self.failed += 1
+            raise ExtractionError('WorkerCrashed', str(e) or 'Extraction worker exited')
+        finally:
+            worker.tasks += 1
+            if worker.tasks >= self.max_tasks:
+                worker.stop()
+                worker = _Worker(self.config)
+                self.recycled += 1
+            lane.put(worker)
+
+        if not ok:
+            self.failed += 1
+            raise ExtractionError(*payload)
+        self.completed += 1
+        return payload
+
+    def _extract_inline(self, req):
+        import yt_dlp
+        with self._lock:
+            if self._inline_opts is None: self._inline_opts = _all_base_opts()
+        try:
+            result = run_extraction(yt_dlp, self._inline_opts, self.config, req)
+        except Exception as e:
+            self.failed += 1
+            raise ExtractionError(type(e).__name__, str(e))
+        self.completed += 1
+        return result
+
+    def stats(self):
+        return {
+            'processes': self.processes,
+            'idle': self._idle.qsize(),
+            'preview_processes': self.preview_processes,
+            'preview_idle': self._preview_idle.qsize(),
+            'max_tasks': self.max_tasks,
+            'timeout': self.timeout,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'recycled': self.recycled,
+            'busy': self.busy,
+            'cancelled': self.cancelled
+        }
+
+
+if __name__ == '__main__':
+    _worker_main(int(sys.argv[1]), int(sys.argv[2]))
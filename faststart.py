@@ -0,0 +1,130 @@
+import os
+import time
+import shutil
+import struct
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+MP4_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+
+
+def is_faststart(path):
+    """True if the moov atom precedes mdat, False if it trails it, None if not a parsable MP4."""
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            offset = 0
+            while offset + 8 <= size:
+                f.seek(offset)
+                atom_size, atom_type = struct.unpack('>I4s', f.read(8))
+                if atom_size == 1: # 64-bit size follows the type
+                    atom_size = struct.unpack('>Q', f.read(8))[0]
+                elif atom_size == 0: # Atom runs to the end of the file
+                    atom_size = size - offset
+                if atom_type == b'moov': return True
+                if atom_type == b'mdat': return False
+                if atom_size < 8: return None
+                offset += atom_size
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+class FastStartProcessor:
+    """Moves the moov atom of finished MP4 downloads to the front.
+
+    Files are remuxed with `ffmpeg -c copy -movflags +faststart` (no
+    re-encode) into a temp file that atomically replaces the original. Work
+    runs on a small bounded pool; submit() hands back a future, so callers
+    can finish the remux before they publish the file. Files that are already
+    fast-start are skipped after reading a few atom headers. Disabled when
+    ffmpeg isn't on PATH.
+    """
+
+    def __init__(self, workers=2, max_pending=32, timeout=300, ffmpeg=None):
+        self.ffmpeg = ffmpeg or shutil.which('ffmpeg')
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='faststart')
+        self._pending = {} # path -> Future
+        self._lock = threading.Lock()
+        self.remuxed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_ms = 0
+
+    @property
+    def available(self):
+        return bool(self.ffmpeg)
+
+    def submit(self, path, on_done=None):
+        """Queues path for remuxing and returns a Future of the elapsed ms (None if skipped or failed).
+
+        on_done(elapsed_ms) also runs once it's finished. Returns None when
+        the file isn't an MP4, ffmpeg is missing or the queue is full; a path
+        that is already queued gets the existing future.
+        """
+        if not self.available or not path.lower().endswith(MP4_EXTENSIONS): return None
+        with self._lock:
+            if path in self._pending: return self._pending[path]
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return None
+            future = self._pending[path] = self._pool.submit(self._run, path, on_done)
+        return future
+
+    def _run(self, path, on_done):
+        elapsed_ms = None
+        try:
+            elapsed_ms = self.process(path)
+        except Exception as e:
+            print(f"FASTSTART ERROR: {os.path.basename(path)}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+        if on_done:
+            try: on_done(elapsed_ms)
+            except Exception as e: print(f"FASTSTART ERROR: on_done failed for {os.path.basename(path)}: {e}")
+        return elapsed_ms
+
+    def process(self, path):
+        """Remuxes path in place. Returns the elapsed ms, or None if skipped/failed."""
+        if is_faststart(path) is not False:
+            self.skipped += 1
+            return None
+        started = time.perf_counter()
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.faststart{ext}"
+        try:
+            result = subprocess.run(
+                [self.ffmpeg, '-v', 'error', '-y', '-i', path, '-map', '0', '-c', 'copy',
+                 '-movflags', '+faststart', tmp_path],
+                capture_output=True, timeout=self.timeout
+            )
+            if result.returncode != 0 or not os.path.exists(tmp_path):
+                raise RuntimeError(result.stderr.decode('utf-8', 'replace')[-300:] or f"exit {result.returncode}")
+            os.replace(tmp_path, path)
+        except Exception:
+            self.failed += 1
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self.remuxed += 1
+            self.total_ms += elapsed_ms
+        print(f"FASTSTART: {os.path.basename(path)} remuxed in {elapsed_ms}ms")
+        return elapsed_ms
+
+    def stats(self):
+        return {
+            'available': self.available,
+            'pending': len(self._pending),
+            'remuxed': self.remuxed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_ms': round(self.total_ms / self.remuxed) if self.remuxed else 0
+        }
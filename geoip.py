@@ -0,0 +1,212 @@
+import os
+import csv
+import socket
+import struct
+import bisect
+import ipaddress
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+
+LOCAL_LOCATION = "Local/Internal"
+UNKNOWN_LOCATION = "Unknown Location"
+
+# Non-global IPv4 blocks (RFC 6890): private, loopback, link-local, CGNAT,
+# documentation, benchmarking, multicast and reserved space.
+_NON_GLOBAL_V4 = sorted(
+    (int(net.network_address), int(net.broadcast_address))
+    for net in map(ipaddress.IPv4Network, [
+        '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+        '172.16.0.0/12', '192.0.0.0/24', '192.0.2.0/24', '192.168.0.0/16', '198.18.0.0/15',
+        '198.51.100.0/24', '203.0.113.0/24', '224.0.0.0/4', '240.0.0.0/4'
+    ])
+)
+_NON_GLOBAL_V4_STARTS = [r[0] for r in _NON_GLOBAL_V4]
+
+
+def _parse_ip(value):
+    """Accepts dotted/colon notation or a plain integer; returns an ip_address."""
+    value = value.strip()
+    if value.isdigit():
+        n = int(value)
+        return ipaddress.IPv4Address(n) if n < 2 ** 32 else ipaddress.IPv6Address(n)
+    return ipaddress.ip_address(value)
+
+
+class GeoIPResolver:
+    """Offline IP -> location lookups from a local range database.
+
+    The database is a CSV of `start_ip,end_ip,country[,region,city]` rows
+    (DB-IP / IP2Location "lite" exports work once trimmed to these columns).
+    Ranges are loaded into sorted, array-backed start/end columns per address
+    family and resolved with a binary search. A bounded LRU sits in front of
+    the index, and an optional online lookup is only used when the caller
+    explicitly allows it (i.e. off the request path). Online lookups never
+    block the caller either: they run on `online_workers` background threads
+    (at most `max_pending` queued, the rest are skipped) and the answer lands
+    in the LRU for the next event from that IP.
+    """
+
+    def __init__(self, db_path=None, cache_size=10000, online_lookup=None, online_workers=2, max_pending=256):
+        self.db_path = str(db_path) if db_path else None
+        self.cache_size = cache_size
+        self.online_lookup = online_lookup
+        self.online_workers = online_workers
+        self.max_pending = max_pending
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        # (locations, v4 columns, v6 columns) swapped as one tuple so readers never mix versions.
+        # IPv4 fits in unsigned 32-bit arrays; IPv6 needs Python ints.
+        self._index = ([], (array('I'), array('I'), array('I')), ([], [], []))
+        self.ranges = 0
+        self.hits = 0
+        self.misses = 0
+        self.online_lookups = 0
+        self.online_skipped = 0
+
+    # --- Loading ---
+
+    def load(self, path=None):
+        """Parses the range CSV and swaps in the new index."""
+        path = str(path or self.db_path)
+        v4_rows, v6_rows = [], []
+        locations, location_ids = [], {}
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'): continue
+                try:
+                    start, end = _parse_ip(row[0]), _parse_ip(row[1])
+                except ValueError:
+                    continue # Header row or junk
+                if start.version != end.version: continue
+                country = row[2].strip()
+                region = row[3].strip() if len(row) > 3 else ''
+                city = row[4].strip() if len(row) > 4 else ''
+                location = ', '.join(p for p in (city, region, country) if p) or UNKNOWN_LOCATION
+                loc_id = location_ids.get(location)
+                if loc_id is None:
+                    loc_id = location_ids[location] = len(locations)
+                    locations.append(location)
+                rows = v4_rows if start.version == 4 else v6_rows
+                rows.append((int(start), int(end), loc_id))
+
+        v4_rows.sort()
+        v6_rows.sort()
+        v4 = (array('I', (r[0] for r in v4_rows)), array('I', (r[1] for r in v4_rows)), array('I', (r[2] for r in v4_rows)))
+        v6 = ([r[0] for r in v6_rows], [r[1] for r in v6_rows], [r[2] for r in v6_rows])
+
+        self._index = (locations, v4, v6)
+        self.ranges = len(v4_rows) + len(v6_rows)
+        with self._cache_lock:
+            self._cache.clear()
+        print(f"GEOIP: Loaded {self.ranges} ranges ({len(locations)} locations) from {path}")
+        return self.ranges
+
+    def load_async(self):
+        """Loads the database in a background thread if it exists."""
+        if not self.db_path or not os.path.exists(self.db_path):
+            print(f"GEOIP: No local database at {self.db_path}, offline lookups disabled.")
+            return
+        def _load():
+            try: self.load()
+            except Exception as e: print(f"GEO ERROR: Failed to load {self.db_path}: {e}")
+        threading.Thread(target=_load, daemon=True).start()
+
+    # --- Lookups ---
+
+    def lookup(self, ip, allow_online=False):
+        """Resolves an IP to 'City, Region, Country' using the local index."""
+        with self._cache_lock:
+            location = self._cache.get(ip)
+            if location is not None:
+                self._cache.move_to_end(ip)
+                self.hits += 1
+                return location
+            self.misses += 1
+
+        location = self._resolve(ip, allow_online)
+        # Don't pin "unknown" answers while an online lookup may still find the IP
+        if location != UNKNOWN_LOCATION or not self.online_lookup:
+            self._remember(ip, location)
+        return location
+
+    def _resolve(self, ip, allow_online):
+        locations, v4, v6 = self._index
+        # Fast path for dotted IPv4, which is nearly all of our traffic
+        if ip.count('.') == 3 and ':' not in ip:
+            try:
+                n = struct.unpack('!I', socket.inet_aton(ip))[0]
+            except (OSError, TypeError):
+                return UNKNOWN_LOCATION
+            i = bisect.bisect_right(_NON_GLOBAL_V4_STARTS, n) - 1
+            if i >= 0 and n <= _NON_GLOBAL_V4[i][1]:
+                return LOCAL_LOCATION
+            return self._search(locations, v4, n, ip, allow_online)
+
+        try:
+            addr = ipaddress.ip_address(ip.strip())
+        except (ValueError, AttributeError):
+            return UNKNOWN_LOCATION
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        # Covers RFC1918, loopback, link-local, CGNAT, ULA, documentation ranges...
+        if not addr.is_global:
+            return LOCAL_LOCATION
+
+        return self._search(locations, v4 if addr.version == 4 else v6, int(addr), ip, allow_online)
+
+    def _search(self, locations, columns, n, ip, allow_online):
+        starts, ends, loc_ids = columns
+        i = bisect.bisect_right(starts, n) - 1
+        if i >= 0 and n <= ends[i]:
+            return locations[loc_ids[i]]
+
+        if allow_online and self.online_lookup:
+            self._lookup_online_async(ip)
+        return UNKNOWN_LOCATION
+
+    def _lookup_online_async(self, ip):
+        with self._cache_lock:
+            if ip in self._pending: return
+            if len(self._pending) >= self.max_pending:
+                self.online_skipped += 1
+                return
+            self._pending.add(ip)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.online_workers, thread_name_prefix='geoip')
+        self._executor.submit(self._lookup_online, ip)
+
+    def _lookup_online(self, ip):
+        try:
+            location = self.online_lookup(ip)
+        except Exception as e:
+            print(f"GEO ERROR: Online lookup failed for {ip}: {e}")
+            location = None
+        # An IP the online service doesn't know is pinned as unknown so it isn't asked again
+        self._remember(ip, location or UNKNOWN_LOCATION)
+        with self._cache_lock:
+            self._pending.discard(ip)
+            self.online_lookups += 1
+
+    def _remember(self, ip, location):
+        if self.cache_size <= 0: return
+        with self._cache_lock:
+            self._cache[ip] = location
+            self._cache.move_to_end(ip)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        return {
+            'ranges': self.ranges,
+            'cached': len(self._cache),
+            'cache_size': self.cache_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'online_pending': len(self._pending),
+            'online_lookups': self.online_lookups,
+            'online_skipped': self.online_skipped
+        }
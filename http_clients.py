@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SizedBody:
+    """Wraps an incoming body stream so requests relays it with its Content-Length instead of chunked."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+class Upstream:
+    """Settings for one outbound dependency (timeouts are (connect, read) seconds)."""
+
+    def __init__(self, name, connect_timeout=3.05, read_timeout=10, pool_size=10, retries=1, backoff=0.3):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        # HTTP_TIMEOUT_<NAME> overrides the read timeout without a code change
+        self.read_timeout = float(os.environ.get(f'HTTP_TIMEOUT_{name.upper()}', read_timeout))
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+
+class _UpstreamStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=500) # Seconds to response headers
+
+    def quantile(self, q):
+        if not self.latencies: return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HttpClients:
+    """One pooled, keep-alive requests.Session per upstream.
+
+    Reusing sessions lets small JSON calls skip the TCP+TLS handshake. Each
+    session gets its own pool size, retry/backoff policy (idempotent methods
+    only) and default timeout, and every call records latency plus the pool's
+    new-connection vs. request counts so reuse is visible in stats().
+    """
+
+    def __init__(self, upstreams):
+        self.upstreams = {u.name: u for u in upstreams}
+        self._sessions = {}
+        self._stats = {name: _UpstreamStats() for name in self.upstreams}
+        self._lock = threading.Lock()
+        for upstream in upstreams:
+            self._sessions[upstream.name] = self._build_session(upstream)
+
+    def _build_session(self, upstream):
+        retry = Retry(
+            total=upstream.retries,
+            backoff_factor=upstream.backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=upstream.pool_size, pool_maxsize=upstream.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, upstream, method, url, **kwargs):
+        """Like requests.request, through the upstream's pooled session."""
+        config = self.upstreams[upstream]
+        kwargs.setdefault('timeout', config.timeout)
+        stats = self._stats[upstream]
+        started = time.perf_counter()
+        try:
+            response = self._sessions[upstream].request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                stats.requests += 1
+                stats.errors += 1
+            raise
+        with self._lock:
+            stats.requests += 1
+            stats.latencies.append(time.perf_counter() - started)
+        return response
+
+    def get(self, upstream, url, **kwargs):
+        return self.request(upstream, 'GET', url, **kwargs)
+
+    def post(self, upstream, url, **kwargs):
+        return self.request(upstream, 'POST', url, **kwargs)
+
+    def latency_quantile(self, upstream, q):
+        with self._lock:
+            return self._stats[upstream].quantile(q)
+
+    def _pool_counters(self, upstream):
+        """(connections opened, requests sent) across the session's live pools."""
+        opened = sent = 0
+        for adapter in set(self._sessions[upstream].adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None: continue
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return opened, sent
+
+    def stats(self):
+        out = {}
+        for name, stats in self._stats.items():
+            opened, sent = self._pool_counters(name)
+            with self._lock:
+                p50, p90 = stats.quantile(0.5), stats.quantile(0.9)
+                out[name] = {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'connections_opened': opened,
+                    'connections_reused': max(0, sent - opened),
+                    'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                    'p90_ms': round(p90 * 1000, 1) if p90 is not None else None,
+                    'timeout': list(self.upstreams[name].timeout)
+                }
+        return out
@@ -0,0 +1,148 @@
+import math
+import time
+import threading
+from collections import deque
+
+
+class QueueFull(Exception):
+    """Raised by DownloadScheduler.submit when a lane is at max depth."""
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"{lane} queue is full")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class _Lane:
+    def __init__(self, name, workers, default_duration):
+        self.name = name
+        self.workers = workers
+        self.queue = deque()
+        self.running = set() # job ids a worker is executing right now
+        self.cond = threading.Condition()
+        self.active = 0
+        self.avg_duration = default_duration # EWMA of task run time (seconds)
+        self.completed = 0
+        self.rejected = 0
+
+
+class DownloadScheduler:
+    """Fixed-size worker pools with one bounded FIFO queue per platform.
+
+    Each lane (e.g. 'instagram', 'youtube') owns `workers` threads so a burst
+    of one platform can't starve the other. submit() raises QueueFull once a
+    lane holds `max_depth` waiting tasks, and position() estimates when a
+    queued job will start from the lane's moving-average task duration.
+    """
+
+    def __init__(self, workers, max_depth=50, default_lane='instagram', default_duration=20):
+        self.max_depth = max_depth
+        self.default_lane = default_lane
+        self._lanes = {name: _Lane(name, count, default_duration) for name, count in workers.items()}
+        for lane in self._lanes.values():
+            for i in range(lane.workers):
+                threading.Thread(target=self._worker, args=(lane,), name=f"dl-{lane.name}-{i}", daemon=True).start()
+
+    def lane_for(self, platform):
+        return self._lanes.get(platform) or self._lanes[self.default_lane]
+
+    def submit(self, platform, job_id, fn, *args):
+        """Queues fn(*args); returns (position, estimated_start) at enqueue time."""
+        lane = self.lane_for(platform)
+        with lane.cond:
+            if len(lane.queue) >= self.max_depth:
+                lane.rejected += 1
+                raise QueueFull(lane.name, self._retry_after(lane))
+            lane.queue.append((job_id, fn, args))
+            position = len(lane.queue)
+            estimate = self._estimate_locked(lane, position)
+            lane.cond.notify()
+        return position, estimate
+
+    def submit_many(self, platform, tasks):
+        """Queues [(job_id, fn, args)] on one lane under a single lock hold.
+
+        Returns one (position, estimated_start) per task, or None for the
+        tasks that didn't fit once the lane reached max depth.
+        """
+        lane = self.lane_for(platform)
+        placed = []
+        with lane.cond:
+            for job_id, fn, args in tasks:
+                if len(lane.queue) >= self.max_depth:
+                    lane.rejected += 1
+                    placed.append(None)
+                    continue
+                lane.queue.append((job_id, fn, args))
+                position = len(lane.queue)
+                placed.append((position, self._estimate_locked(lane, position)))
+            lane.cond.notify_all()
+        return placed
+
+    def retry_after(self, platform):
+        lane = self.lane_for(platform)
+        with lane.cond:
+            return self._retry_after(lane)
+
+    def position(self, job_id, platform=None):
+        """(1-based queue position, estimated start epoch) or None if not waiting."""
+        lanes = [self.lane_for(platform)] if platform else self._lanes.values()
+        for lane in lanes:
+            with lane.cond:
+                for i, item in enumerate(lane.queue):
+                    if item[0] == job_id:
+                        return i + 1, self._estimate_locked(lane, i + 1)
+        return None
+
+    def owns(self, job_id):
+        """True while job_id waits in or runs on one of this scheduler's lanes."""
+        for lane in self._lanes.values():
+            with lane.cond:
+                if job_id in lane.running or any(item[0] == job_id for item in lane.queue):
+                    return True
+        return False
+
+    def stats(self):
+        out = {}
+        for lane in self._lanes.values():
+            out[lane.name] = {
+                'workers': lane.workers,
+                'active': lane.active,
+                'queued': len(lane.queue),
+                'max_depth': self.max_depth,
+                'avg_duration': round(lane.avg_duration, 2),
+                'completed': lane.completed,
+                'rejected': lane.rejected
+            }
+        return out
+
+    def _estimate_locked(self, lane, position):
+        # Jobs that must start (or finish) before this one gets a worker
+        ahead = lane.active + position - 1
+        if ahead < lane.workers: return time.time()
+        rounds = (ahead - lane.workers) // lane.workers + 1
+        return time.time() + rounds * lane.avg_duration
+
+    def _retry_after(self, lane):
+        return max(1, math.ceil(lane.avg_duration * len(lane.queue) / lane.workers))
+
+    def _worker(self, lane):
+        while True:
+            with lane.cond:
+                while not lane.queue:
+                    lane.cond.wait()
+                job_id, fn, args = lane.queue.popleft()
+                lane.active += 1
+                lane.running.add(job_id)
+            started = time.time()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"WORKER ERROR [{lane.name}] job {job_id}: {e}")
+            finally:
+                elapsed = time.time() - started
+                with lane.cond:
+                    lane.active -= 1
+                    lane.running.discard(job_id)
+                    lane.completed += 1
+                    lane.avg_duration = 0.8 * lane.avg_duration + 0.2 * elapsed
@@ -0,0 +1,480 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+# Journal moved aside while its snapshot is being written
+ROTATED_SUFFIX = '.compacting'
+
+
+def load_jobs(snapshot_path, journal_path):
+    """Reads the snapshot and replays the journal over it; returns (jobs, replayed lines).
+
+    A journal left mid-compaction (ROTATED_SUFFIX) is older than the live one
+    and is replayed first.
+    """
+    jobs = {}
+    if os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'r') as f:
+                jobs = json.load(f) or {}
+        except Exception as e:
+            print(f"JOB STORE: Snapshot unreadable, starting empty: {e}")
+            jobs = {}
+
+    replayed = 0
+    for path in ((journal_path + ROTATED_SUFFIX, journal_path) if journal_path else ()):
+        if not os.path.exists(path): continue
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash mid-append leaves at most one torn line at the tail
+                    continue
+                job_id = entry.get('id')
+                if not job_id: continue
+                if job_id in jobs: jobs[job_id].update(entry.get('data', {}))
+                else: jobs[job_id] = entry.get('data', {})
+                replayed += 1
+    return jobs, replayed
+
+
+class JobStore:
+    """In-memory job table backed by an append-only journal.
+
+    The dict in memory is the primary copy. Every status change appends one
+    JSON line to the journal; a background thread periodically compacts the
+    journal into a snapshot (the classic jobs.json format) so restarts and the
+    HF dataset sync still see a plain JSON file. Each put() bumps the job's
+    in-memory version and fires its watchers, which is what the push status
+    endpoints wait on.
+    """
+
+    def __init__(self, snapshot_path, journal_path, ttl=86400, compact_every=60,
+                 compact_lines=500, sync_lock=None):
+        self.snapshot_path = str(snapshot_path)
+        self.journal_path = str(journal_path)
+        self.ttl = ttl
+        self.compact_every = compact_every
+        self.compact_lines = compact_lines
+        # Lock shared with the HF CommitScheduler so a sync never sees a half-written file
+        self.sync_lock = sync_lock
+        self._jobs = {}
+        self._versions = {} # job_id -> change counter (in-memory only)
+        self._watchers = {} # job_id -> set of callbacks
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock() # One compaction at a time (boot and the thread)
+        self._journal = None
+        self._journal_lines = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    # --- Recovery ---
+
+    def recover(self):
+        """Loads the last snapshot and replays the journal on top of it."""
+        jobs, replayed = load_jobs(self.snapshot_path, self.journal_path)
+        with self._lock:
+            self._jobs = jobs
+            self._expire_locked(time.time())
+        print(f"JOB STORE: Recovered {len(self._jobs)} jobs ({replayed} journal entries replayed)")
+        # Fold the replayed journal into a fresh snapshot right away
+        self.compact()
+
+    # --- Public API ---
+
+    def put(self, job_id, data):
+        """Merges data into the job record and appends one journal line."""
+        with self._lock:
+            if job_id in self._jobs: self._jobs[job_id].update(data)
+            else:
+                # TTL is measured from creation, so every record needs a timestamp
+                data = {'timestamp': time.time(), **data}
+                self._jobs[job_id] = dict(data)
+            self._append_locked(json.dumps({'id': job_id, 'data': data}) + '\n')
+            self._versions[job_id] = self._versions.get(job_id, 0) + 1
+            watchers = list(self._watchers.get(job_id, ()))
+        if self._journal_lines >= self.compact_lines:
+            self._wake.set()
+        for callback in watchers:
+            try: callback()
+            except Exception as e: print(f"JOB STORE: Watcher failed for {job_id}: {e}")
+
+    def put_many(self, updates):
+        """put() for several jobs at once: one lock hold and one journal flush for the batch."""
+        if not updates: return
+        now = time.time()
+        lines = []
+        fired = []
+        with self._lock:
+            for job_id, data in updates.items():
+                if job_id in self._jobs: self._jobs[job_id].update(data)
+                else:
+                    data = {'timestamp': now, **data}
+                    self._jobs[job_id] = dict(data)
+                lines.append(json.dumps({'id': job_id, 'data': data}) + '\n')
+                self._versions[job_id] = self._versions.get(job_id, 0) + 1
+                fired.extend((job_id, cb) for cb in self._watchers.get(job_id, ()))
+            self._append_locked(''.join(lines))
+            self._journal_lines += len(lines) - 1
+        if self._journal_lines >= self.compact_lines:
+            self._wake.set()
+        for job_id, callback in fired:
+            try: callback()
+            except Exception as e: print(f"JOB STORE: Watcher failed for {job_id}: {e}")
+
+    def get_many(self, job_ids):
+        """{job_id: record} for the ids that exist, under a single lock hold."""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is None: continue
+                if self._is_expired(job, now):
+                    del self._jobs[job_id]
+                    self._versions.pop(job_id, None)
+                    continue
+                found[job_id] = dict(job)
+        return found
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None: return None
+            if self._is_expired(job, time.time()):
+                del self._jobs[job_id]
+                self._versions.pop(job_id, None)
+                return None
+            return dict(job)
+
+    def version(self, job_id):
+        return self._versions.get(job_id, 0)
+
+    # --- Change notifications ---
+
+    def watch(self, job_id, callback):
+        """Calls callback() (on the writer's thread) after every put() to job_id."""
+        with self._lock:
+            self._watchers.setdefault(job_id, set()).add(callback)
+
+    def unwatch(self, job_id, callback):
+        with self._lock:
+            watchers = self._watchers.get(job_id)
+            if watchers is None: return
+            watchers.discard(callback)
+            if not watchers: del self._watchers[job_id]
+
+    def wait_for_change(self, job_id, since, timeout):
+        """Blocks until job_id's version differs from `since`; returns the version."""
+        changed = threading.Event()
+        self.watch(job_id, changed.set)
+        try:
+            # Also covers a version that went backwards after a restart
+            if self.version(job_id) != since: return self.version(job_id)
+            changed.wait(timeout)
+            return self.version(job_id)
+        finally:
+            self.unwatch(job_id, changed.set)
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear()
+            self._versions.clear()
+        self.compact()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def stats(self):
+        return {
+            'jobs': len(self._jobs),
+            'journal_lines': self._journal_lines,
+            'watchers': sum(len(w) for w in list(self._watchers.values())),
+            'ttl': self.ttl
+        }
+
+    # --- Compaction ---
+
+    def start(self):
+        """Starts the background compaction thread."""
+        if self._thread: return
+        self._thread = threading.Thread(target=self._compact_loop, daemon=True)
+        self._thread.start()
+
+    def compact(self):
+        """Writes a snapshot of the live jobs and drops the journal it covers.
+
+        The store lock is only held to copy the table and move the journal
+        aside; serializing and fsyncing the snapshot happen outside it, so
+        get() and put() never wait on disk. Until the snapshot is in place the
+        moved journal stays on disk and recovery replays it.
+        """
+        with self._compact_lock:
+            with self._lock:
+                self._expire_locked(time.time())
+                jobs = {job_id: dict(job) for job_id, job in self._jobs.items()}
+                rotated = self._rotate_journal_locked()
+            snapshot = json.dumps(jobs, indent=4)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.sync_lock:
+                with self.sync_lock:
+                    self._install_snapshot(tmp_path, rotated)
+            else:
+                self._install_snapshot(tmp_path, rotated)
+
+    def _compact_loop(self):
+        while True:
+            self._wake.wait(self.compact_every)
+            self._wake.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"JOB STORE: Compaction failed: {e}")
+
+    # --- Internals (caller holds self._lock) ---
+
+    def _append_locked(self, line):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        if self.sync_lock:
+            with self.sync_lock:
+                self._journal.write(line)
+                self._journal.flush()
+        else:
+            self._journal.write(line)
+            self._journal.flush()
+        self._journal_lines += 1
+
+    def _rotate_journal_locked(self):
+        """Moves the journal aside for the snapshot being written; later puts start a fresh one."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        rotated = self.journal_path + ROTATED_SUFFIX
+        if os.path.exists(self.journal_path):
+            if os.path.exists(rotated):
+                # A previous compaction failed before its snapshot landed; keep both until one does
+                with open(self.journal_path, 'r') as src, open(rotated, 'a') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, rotated)
+        self._journal_lines = 0
+        return rotated
+
+    def _install_snapshot(self, tmp_path, rotated):
+        os.replace(tmp_path, self.snapshot_path)
+        # Everything in the moved journal is now covered by the snapshot
+        try: os.remove(rotated)
+        except FileNotFoundError: pass
+
+    def _is_expired(self, job, now):
+        return now - job.get('timestamp', now) > self.ttl
+
+    def _expire_locked(self, now):
+        expired = [k for k, v in self._jobs.items() if self._is_expired(v, now)]
+        for k in expired:
+            del self._jobs[k]
+            self._versions.pop(k, None)
+
+
+class SharedJobStore:
+    """JobStore with the same interface, kept in a SharedDB for multi-worker mode.
+
+    Each put() merges the record inside one BEGIN IMMEDIATE transaction and
+    bumps a version column, so any worker can answer /status for a job that
+    another worker started. Watchers in the writing process fire right away;
+    a background thread polls the versions of watched jobs every
+    `poll_interval` seconds to catch writes from other workers. Only the
+    process given a snapshot_path (the primary) writes jobs.json for the HF
+    dataset sync.
+    """
+
+    def __init__(self, db, ttl=86400, snapshot_path=None, journal_path=None, compact_every=60,
+                 sync_lock=None, poll_interval=0.5):
+        self.db = db
+        self.ttl = ttl
+        self.snapshot_path = str(snapshot_path) if snapshot_path else None
+        self.journal_path = str(journal_path) if journal_path else None
+        self.compact_every = compact_every
+        self.sync_lock = sync_lock
+        self.poll_interval = poll_interval
+        self._watchers = {} # job_id -> set of callbacks
+        self._seen = {} # job_id -> last version its watchers were told about
+        self._lock = threading.Lock()
+        self._thread = None
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT, version INTEGER, created REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created)')
+
+    # --- Recovery ---
+
+    def recover(self):
+        """Seeds an empty table from the snapshot and journal; the first worker to get here wins."""
+        if not self.snapshot_path: return
+        jobs, replayed = load_jobs(self.snapshot_path, self.journal_path or '')
+        now = time.time()
+        rows = [(job_id, json.dumps(job), job.get('timestamp', now)) for job_id, job in jobs.items()
+                if now - job.get('timestamp', now) <= self.ttl]
+        with self.db.transaction() as conn:
+            if conn.execute('SELECT 1 FROM jobs LIMIT 1').fetchone(): rows = None
+            else: conn.executemany('INSERT INTO jobs VALUES (?, ?, 1, ?)', rows)
+        if rows is not None:
+            print(f"JOB STORE: Recovered {len(rows)} jobs into shared state ({replayed} journal entries replayed)")
+
+    # --- Public API ---
+
+    def put(self, job_id, data):
+        self.put_many({job_id: data})
+
+    def put_many(self, updates):
+        if not updates: return
+        now = time.time()
+        versions = {}
+        with self.db.transaction() as conn:
+            for job_id, data in updates.items():
+                row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                if row:
+                    job = json.loads(row[0])
+                    job.update(data)
+                else:
+                    # TTL is measured from creation, so every record needs a timestamp
+                    job = {'timestamp': now, **data}
+                versions[job_id] = conn.execute(
+                    'INSERT INTO jobs (id, data, version, created) VALUES (?, ?, 1, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET data = excluded.data, version = version + 1 RETURNING version',
+                    (job_id, json.dumps(job), job.get('timestamp', now))
+                ).fetchone()[0]
+        self._notify(versions)
+
+    def get(self, job_id):
+        return self.get_many([job_id]).get(job_id)
+
+    def get_many(self, job_ids):
+        job_ids = list(job_ids)
+        if not job_ids: return {}
+        cutoff = time.time() - self.ttl
+        rows = self.db.execute(
+            f"SELECT id, data FROM jobs WHERE id IN ({','.join('?' * len(job_ids))}) AND created >= ?",
+            (*job_ids, cutoff)
+        ).fetchall()
+        return {job_id: json.loads(data) for job_id, data in rows}
+
+    def version(self, job_id):
+        row = self.db.execute('SELECT version FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    # --- Change notifications ---
+
+    def watch(self, job_id, callback):
+        version = self.version(job_id)
+        with self._lock:
+            self._watchers.setdefault(job_id, set()).add(callback)
+            self._seen.setdefault(job_id, version)
+
+    def unwatch(self, job_id, callback):
+        with self._lock:
+            watchers = self._watchers.get(job_id)
+            if watchers is None: return
+            watchers.discard(callback)
+            if not watchers:
+                del self._watchers[job_id]
+                self._seen.pop(job_id, None)
+
+    def wait_for_change(self, job_id, since, timeout):
+        changed = threading.Event()
+        self.watch(job_id, changed.set)
+        try:
+            if self.version(job_id) != since: return self.version(job_id)
+            changed.wait(timeout)
+            return self.version(job_id)
+        finally:
+            self.unwatch(job_id, changed.set)
+
+    def _notify(self, versions):
+        fired = []
+        with self._lock:
+            for job_id, version in versions.items():
+                if job_id not in self._watchers: continue
+                self._seen[job_id] = version
+                fired.extend((job_id, cb) for cb in self._watchers[job_id])
+        for job_id, callback in fired:
+            try: callback()
+            except Exception as e: print(f"JOB STORE: Watcher failed for {job_id}: {e}")
+
+    def _poll_watched(self):
+        with self._lock:
+            job_ids = list(self._watchers)
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows = dict(self.db.execute(
+                f"SELECT id, version FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+            with self._lock:
+                changed = {job_id: rows.get(job_id, 0) for job_id in chunk
+                           if job_id in self._seen and self._seen[job_id] != rows.get(job_id, 0)}
+            self._notify(changed)
+
+    def clear(self):
+        self.db.execute('DELETE FROM jobs')
+        self.compact()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def stats(self):
+        return {
+            'jobs': len(self),
+            'watchers': sum(len(w) for w in list(self._watchers.values())),
+            'ttl': self.ttl,
+            'backend': 'sqlite'
+        }
+
+    # --- Maintenance ---
+
+    def start(self):
+        """Starts the thread that polls watched jobs, expires old ones and writes the snapshot."""
+        if self._thread: return
+        self._thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+        self._thread.start()
+
+    def compact(self):
+        """Deletes expired jobs; the primary also writes jobs.json and empties the old journal."""
+        self.db.execute('DELETE FROM jobs WHERE created < ?', (time.time() - self.ttl,))
+        if not self.snapshot_path: return
+        jobs = {job_id: json.loads(data) for job_id, data in self.db.execute('SELECT id, data FROM jobs')}
+        snapshot = json.dumps(jobs, indent=4)
+        if self.sync_lock:
+            with self.sync_lock:
+                self._write_snapshot(snapshot)
+        else:
+            self._write_snapshot(snapshot)
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # A stale journal would be replayed over newer data by a later single-worker start
+        if self.journal_path and os.path.exists(self.journal_path):
+            open(self.journal_path, 'w').close()
+
+    def _maintenance_loop(self):
+        last_compact = time.time()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._poll_watched()
+                if time.time() - last_compact >= self.compact_every:
+                    last_compact = time.time()
+                    self.compact()
+            except Exception as e:
+                print(f"JOB STORE: Maintenance failed: {e}")
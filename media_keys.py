@@ -0,0 +1,40 @@
+import re
+import urllib.parse
+
+# Instagram: /p/<code>, /reel/<code>, /reels/<code>, /tv/<code> (optionally under /<user>/)
+INSTAGRAM_SHORTCODE_RE = re.compile(r'/(?:p|reels?|tv)/([A-Za-z0-9_-]+)')
+# YouTube IDs are always 11 characters from the URL-safe base64 alphabet
+YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+
+def canonical_media_id(url):
+    """Maps any URL form of a post/video to 'instagram:<shortcode>' or 'youtube:<id>'.
+
+    Returns None when the URL isn't a recognisable single media item, in which
+    case callers should simply skip caching/coalescing.
+    """
+    if not url: return None
+    try:
+        parsed = urllib.parse.urlparse(url.strip())
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.'): host = host[4:]
+    if host.startswith('m.'): host = host[2:]
+
+    if host in ('instagram.com', 'instagr.am'):
+        match = INSTAGRAM_SHORTCODE_RE.search(parsed.path)
+        return f"instagram:{match.group(1)}" if match else None
+
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parsed.path.strip('/').split('/')[0]
+    elif host in ('youtube.com', 'music.youtube.com', 'youtube-nocookie.com'):
+        parts = parsed.path.strip('/').split('/')
+        if parts[0] == 'watch':
+            video_id = urllib.parse.parse_qs(parsed.query).get('v', [None])[0]
+        elif parts[0] in ('shorts', 'embed', 'live', 'v') and len(parts) > 1:
+            video_id = parts[1]
+    if video_id and YOUTUBE_ID_RE.match(video_id):
+        return f"youtube:{video_id}"
+    return None
@@ -0,0 +1,116 @@
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+
+def signed_url_expiry(url):
+    """Epoch seconds at which a signed CDN URL stops working, or None.
+
+    cdninstagram/fbcdn URLs carry `oe=<hex epoch>`; googlevideo URLs carry
+    `expire=<decimal epoch>`.
+    """
+    if not url or not isinstance(url, str) or '?' not in url: return None
+    try:
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    except ValueError:
+        return None
+    try:
+        if 'oe' in query: return int(query['oe'][0], 16)
+        if 'expire' in query: return int(query['expire'][0])
+    except ValueError:
+        pass
+    return None
+
+
+def payload_expiry(payload):
+    """Earliest signed-URL expiry anywhere in a (nested) preview payload."""
+    expiries = []
+    def walk(value):
+        if isinstance(value, dict):
+            for v in value.values(): walk(v)
+        elif isinstance(value, (list, tuple)):
+            for v in value: walk(v)
+        else:
+            expiry = signed_url_expiry(value)
+            if expiry: expiries.append(expiry)
+    walk(payload)
+    return min(expiries) if expiries else None
+
+
+class PreviewCache:
+    """LRU of /preview payloads that expires with the CDN links inside them.
+
+    An entry is handed out until `safety_margin` seconds before its earliest
+    direct URL expires (or `default_ttl` if it has none). During the last
+    `stale_window` seconds of that life it is still served, but reported as
+    stale so the caller can refresh it in the background.
+    """
+
+    def __init__(self, max_entries=2000, default_ttl=3600, safety_margin=600, stale_window=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.safety_margin = safety_margin
+        self.stale_window = stale_window
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, key):
+        """Returns (payload, 'fresh' | 'stale') or (None, None)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry['expires']:
+                if entry is not None: del self._entries[key]
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            if now >= entry['fresh_until']:
+                self.stale_hits += 1
+                return entry['payload'], 'stale'
+            self.hits += 1
+            return entry['payload'], 'fresh'
+
+    def put(self, key, payload):
+        now = time.time()
+        url_expiry = payload_expiry(payload)
+        expires = url_expiry - self.safety_margin if url_expiry else now + self.default_ttl
+        expires = min(expires, now + self.default_ttl)
+        if expires <= now: return # Links are already too close to expiry to share
+        fresh_until = max(now, expires - self.stale_window)
+        with self._lock:
+            self._entries[key] = {'payload': payload, 'fresh_until': fresh_until, 'expires': expires}
+            self._entries.move_to_end(key)
+            self._refreshing.discard(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def begin_refresh(self, key):
+        """Claims the background refresh for a stale key; False if one is running."""
+        with self._lock:
+            if key in self._refreshing: return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes
+        }
@@ -0,0 +1,163 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class _ProviderStats:
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window) # Seconds, successful calls only
+        self.outcomes = deque(maxlen=window)  # True (answer) / False (raised) per finished call
+        self.wins = 0
+        self.started = 0
+        self.empty = 0                        # Calls that answered "nothing for this URL"
+        self.cancelled = 0                    # Losers stopped by the race's cancel event
+
+    def quantile(self, q, default):
+        if not self.latencies: return default
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def success_rate(self):
+        if not self.outcomes: return 1.0 # Optimistic until proven otherwise
+        return sum(self.outcomes) / len(self.outcomes)
+
+
+class ProviderRacer:
+    """Races registered extraction providers with adaptive hedging.
+
+    Providers are tried fastest-expected first (p50 latency divided by
+    success rate). If the current leader hasn't answered within its own
+    observed p90 latency, the next provider is started alongside it, and so
+    on. The first non-empty answer wins. A provider is a callable
+    fn(url, cancel) -> dict | None that returns None when it has nothing for
+    the URL (404, private post) and raises when it failed itself (transport
+    error, 5xx, timeout); only the latter counts against its success rate.
+    `cancel` is a threading.Event set once the race is decided: providers
+    still running should check it and close their in-flight response (or
+    pass it to ExtractionEngine.extract()) instead of finishing a lost call.
+    """
+
+    def __init__(self, max_workers=16, window=100, default_latency=2.0, min_hedge=0.25, max_hedge=8.0):
+        self.window = window
+        self.default_latency = default_latency
+        self.min_hedge = min_hedge
+        self.max_hedge = max_hedge
+        self._providers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pro-race')
+
+    def register(self, name, fn):
+        with self._lock:
+            self._providers[name] = fn
+            self._stats.setdefault(name, _ProviderStats(self.window))
+
+    def ranked(self):
+        """Provider names ordered by expected time to a successful answer."""
+        with self._lock:
+            def expected(name):
+                stats = self._stats[name]
+                return stats.quantile(0.5, self.default_latency) / max(stats.success_rate(), 0.05)
+            return sorted(self._providers, key=expected)
+
+    def hedge_delay(self, name):
+        with self._lock:
+            p90 = self._stats[name].quantile(0.9, self.default_latency)
+        return min(self.max_hedge, max(self.min_hedge, p90))
+
+    def race(self, url, timeout=15):
+        """Returns (provider_name, result) for the first valid answer, or (None, None).
+
+        (None, None) means a provider answered that it has nothing for the URL.
+        If every provider failed instead, the last error is re-raised, and a
+        race where nobody answered in time raises TimeoutError.
+        """
+        order = self.ranked()
+        deadline = time.time() + timeout
+        cancel = threading.Event()
+        try:
+            return self._race(url, order, deadline, timeout, cancel)
+        finally:
+            # Winner, failure or timeout: providers still running can stop now
+            cancel.set()
+
+    def _race(self, url, order, deadline, timeout, cancel):
+        running = {}
+        next_launch = 0
+        empty, error = False, None
+
+        while True:
+            now = time.time()
+            if order and (now >= next_launch or not running):
+                name = order.pop(0)
+                running[self._launch(name, url, cancel)] = name
+                next_launch = now + self.hedge_delay(name)
+            if not running: break
+            if now >= deadline:
+                if not empty and not error: error = TimeoutError(f"No provider answered within {timeout}s")
+                break
+
+            wake = deadline if not order else min(deadline, next_launch)
+            done, _ = wait(running, timeout=max(0, wake - time.time()), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception():
+                    error = future.exception()
+                    result = None
+                else:
+                    result = future.result()
+                    empty = empty or not result
+                if result:
+                    for loser in running: loser.cancel()
+                    with self._lock:
+                        self._stats[name].wins += 1
+                    return name, result
+                # A failed provider shouldn't hold up the next one until its hedge delay
+                next_launch = 0
+
+        for loser in running: loser.cancel()
+        if error and not empty: raise error
+        return None, None
+
+    def _launch(self, name, url, cancel):
+        fn = self._providers[name]
+        stats = self._stats[name]
+        started = time.perf_counter()
+        with self._lock:
+            stats.started += 1
+        future = self._executor.submit(fn, url, cancel)
+
+        def record(f):
+            if f.cancelled(): return
+            # A loser that stopped on cancel says nothing about the provider
+            if cancel.is_set() and (f.exception() is not None or not f.result()):
+                with self._lock:
+                    stats.cancelled += 1
+                return
+            with self._lock:
+                if f.exception() is not None:
+                    stats.outcomes.append(False)
+                elif f.result():
+                    stats.outcomes.append(True)
+                    stats.latencies.append(time.perf_counter() - started)
+                else:
+                    stats.empty += 1
+        future.add_done_callback(record)
+        return future
+
+    def stats(self):
+        out = {}
+        for name in self.ranked():
+            with self._lock:
+                stats = self._stats[name]
+                out[name] = {
+                    'started': stats.started,
+                    'wins': stats.wins,
+                    'empty': stats.empty,
+                    'cancelled': stats.cancelled,
+                    'success_rate': round(stats.success_rate(), 3),
+                    'p50_ms': round(stats.quantile(0.5, 0) * 1000, 1),
+                    'p90_ms': round(stats.quantile(0.9, 0) * 1000, 1)
+                }
+        return out
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Maps a canonical media ID to an already-downloaded file and its metadata.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    dropped once the cached files exceed `max_bytes`. A hit is only returned
+    while the file still exists on disk. Dropping an entry doesn't delete the
+    file itself (a client may still be fetching it); `on_evict(filename)` is
+    called so the owner of the download folder can decide.
+    """
+
+    def __init__(self, folder, ttl=900, max_bytes=1024 ** 3, on_evict=None):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, media_id):
+        """Returns the cached result dict (with 'filename') or None."""
+        evicted = None
+        with self._lock:
+            entry = self._entries.get(media_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expired = time.time() - entry['created'] > self.ttl
+            if expired or not os.path.exists(os.path.join(self.folder, entry['filename'])):
+                evicted = self._drop_locked(media_id)
+                self.misses += 1
+            else:
+                self._entries.move_to_end(media_id)
+                self.hits += 1
+                return dict(entry['result'])
+        self._notify([evicted])
+        return None
+
+    def put(self, media_id, result):
+        """Caches a successful local download result (must carry 'filename')."""
+        filename = result.get('filename')
+        if not media_id or not filename: return
+        try:
+            size = os.path.getsize(os.path.join(self.folder, filename))
+        except OSError:
+            return
+        if size > self.max_bytes: return
+
+        evicted = []
+        with self._lock:
+            if media_id in self._entries:
+                evicted.append(self._drop_locked(media_id))
+            self._entries[media_id] = {
+                'filename': filename,
+                'size': size,
+                'created': time.time(),
+                'result': dict(result)
+            }
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                evicted.append(self._drop_locked(oldest))
+        self._notify(evicted)
+
+    def discard_file(self, filename):
+        """Forgets any entry pointing at a file that was removed from disk."""
+        with self._lock:
+            for media_id, entry in list(self._entries.items()):
+                if entry['filename'] == filename:
+                    self._entries.pop(media_id)
+                    self.bytes -= entry['size']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _drop_locked(self, media_id):
+        entry = self._entries.pop(media_id)
+        self.bytes -= entry['size']
+        self.evictions += 1
+        return entry['filename']
+
+    def _notify(self, filenames):
+        if not self.on_evict: return
+        for filename in filenames:
+            if filename:
+                try: self.on_evict(filename)
+                except Exception as e: print(f"CACHE ERROR: on_evict failed for {filename}: {e}")
@@ -0,0 +1,128 @@
+import os
+import time
+import fcntl
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+
+from limits.storage import Storage
+
+_primary_lock = None
+
+
+class SharedDB:
+    """SQLite file (WAL mode) that several gunicorn workers share as their state backend.
+
+    Every thread gets its own connection in autocommit mode; transaction()
+    opens BEGIN IMMEDIATE so read-modify-write sequences (credit deductions,
+    job merges) are atomic across processes. WAL lets readers proceed while
+    one writer commits, and busy_timeout makes writers queue instead of
+    failing with "database is locked".
+    """
+
+    def __init__(self, path, timeout=10):
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory: os.makedirs(directory, exist_ok=True)
+
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        conn = self.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def claim_primary(lock_path):
+    """True in exactly one process per lock file (held until that process exits).
+
+    Singleton chores such as the HF dataset sync and the job snapshot run
+    only in the primary worker; if it dies, the next worker to start claims it.
+    """
+    global _primary_lock
+    if _primary_lock is not None: return True
+    handle = open(lock_path, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _primary_lock = handle
+    return True
+
+
+class SQLiteRateLimitStorage(Storage):
+    """Fixed-window counters for flask-limiter in a SharedDB, so limits hold across workers.
+
+    Registered under the sqlite:// scheme: storage_uri="sqlite:///path/to/db".
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.db = SharedDB(urllib.parse.urlparse(uri).path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, value INTEGER, expiry REAL)')
+        self._pruned = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1, **_):
+        now = time.time()
+        with self.db.transaction() as conn:
+            # A window that ran out starts over instead of accumulating
+            row = conn.execute(
+                'INSERT INTO rate_limits (key, value, expiry) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET '
+                'value = CASE WHEN expiry <= ? THEN excluded.value ELSE value + excluded.value END, '
+                'expiry = CASE WHEN expiry <= ? THEN excluded.expiry ELSE expiry END '
+                'RETURNING value',
+                (key, amount, now + expiry, now, now)
+            ).fetchone()
+            if now - self._pruned > 60:
+                conn.execute('DELETE FROM rate_limits WHERE expiry <= ?', (now,))
+                self._pruned = now
+        return row[0]
+
+    def get(self, key):
+        row = self.db.execute('SELECT value FROM rate_limits WHERE key = ? AND expiry > ?', (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self.db.execute('SELECT expiry FROM rate_limits WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            self.db.execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.db.execute('DELETE FROM rate_limits').rowcount
+
+    def clear(self, key):
+        self.db.execute('DELETE FROM rate_limits WHERE key = ?', (key,))
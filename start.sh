@@ -0,0 +1,17 @@
+#!/bin/sh
+# Container entrypoint (see Dockerfile).
+
+# ASYNC_PROXY=1 serves through uvicorn instead: /dl-proxy and /proxy-img stream on the
+# event loop and every other route runs in the Flask app behind it (see asgi.py).
+if [ "$ASYNC_PROXY" = "1" ]; then
+    exec uvicorn asgi:app --host 0.0.0.0 --port "${PORT:-7860}"
+fi
+
+# One gunicorn worker per core. Threads keep long-lived SSE/long-poll status
+# connections from blocking a worker.
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc)}"
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    # Workers share credits, jobs and rate limits through one SQLite (WAL) file
+    export SHARED_STATE_DB="${SHARED_STATE_DB:-/tmp/insta-state/shared.db}"
+fi
+exec gunicorn --bind "0.0.0.0:${PORT:-7860}" -w "$WEB_CONCURRENCY" --threads "${GUNICORN_THREADS:-64}" app:app
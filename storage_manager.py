@@ -0,0 +1,335 @@
+import os
+import re
+import time
+import shutil
+import threading
+from collections import OrderedDict
+
+# Partial files from yt-dlp and our own remux/tee temp files are never indexed
+TEMP_MARKERS = ('.part', '.ytdl', '.temp', '.tmp', '.faststart.')
+# yt-dlp's per-format intermediates before merging, e.g. name.f137.mp4 / name.f140.m4a
+FORMAT_PART = re.compile(r'\.f\d+\.')
+
+
+class StorageManager:
+    """Indexes the download folder in memory and enforces its byte quota and max age.
+
+    Files are registered as downloads finish, touched when served, and kept
+    in an OrderedDict by last access. register() evicts least recently used
+    files the moment the folder goes over `max_bytes`; a sweeper thread
+    removes files not accessed for `max_age` seconds, waking at the next
+    expiry instead of polling. Pinned files (e.g. mid-remux) and the
+    `protected` names (cookie/POT files) are never removed. Subdirectories
+    and temp files are ignored. A periodic reconcile picks up files written
+    behind our back and forgets files that vanished.
+    """
+
+    def __init__(self, folder, max_bytes=5 * 1024 ** 3, max_age=1200, protected=(),
+                 on_remove=None, reconcile_every=600):
+        self.folder = str(folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.protected = set(protected)
+        self.on_remove = on_remove
+        self.reconcile_every = reconcile_every
+        self._files = OrderedDict() # name -> {'size', 'created', 'accessed'}, LRU first
+        self._pins = {} # name -> pin expiry
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_reconcile = 0
+        self.bytes = 0
+        self.evicted_quota = 0
+        self.evicted_age = 0
+        self.bytes_evicted = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    # --- Index maintenance ---
+
+    def _indexable(self, name):
+        return (name not in self.protected and not name.startswith('.') and not any(m in name for m in TEMP_MARKERS)
+                and not FORMAT_PART.search(name))
+
+    def register(self, path):
+        """Adds (or re-sizes) a finished file and enforces the quota right away."""
+        name = os.path.basename(path)
+        if not self._indexable(name): return
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._files.pop(name, None)
+            if old: self.bytes -= old['size']
+            self._files[name] = {'size': st.st_size, 'created': old['created'] if old else now, 'accessed': now}
+            self.bytes += st.st_size
+        self._enforce_quota()
+
+    def touch(self, name):
+        """Marks a file as just served (moves it to the back of the LRU)."""
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is None: return
+            entry['accessed'] = time.time()
+            self._files.move_to_end(name)
+
+    def demote(self, name):
+        """Makes a file the next eviction candidate (no cache references it any more)."""
+        with self._lock:
+            if name in self._files: self._files.move_to_end(name, last=False)
+
+    def pin(self, name, ttl=None):
+        """Protects a file from eviction until unpin() or for `ttl` seconds."""
+        with self._lock:
+            self._pins[name] = time.time() + ttl if ttl else float('inf')
+
+    def unpin(self, name):
+        with self._lock:
+            self._pins.pop(name, None)
+
+    def reconcile(self):
+        """Re-syncs the index with the directory listing."""
+        seen = {}
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_file(follow_symlinks=False) and self._indexable(entry.name):
+                    seen[entry.name] = entry.stat()
+            except OSError:
+                continue # Removed between listing and stat
+        with self._lock:
+            for name in [n for n in self._files if n not in seen]:
+                self.bytes -= self._files.pop(name)['size']
+            for name, st in seen.items():
+                if name not in self._files:
+                    self._files[name] = {'size': st.st_size, 'created': st.st_mtime, 'accessed': st.st_mtime}
+                    self._files.move_to_end(name, last=False)
+                    self.bytes += st.st_size
+        self._last_reconcile = time.time()
+        self._enforce_quota()
+
+    # --- Eviction ---
+
+    def _pinned_locked(self, name, now):
+        expiry = self._pins.get(name)
+        if expiry is None: return False
+        if expiry < now:
+            del self._pins[name]
+            return False
+        return True
+
+    def _enforce_quota(self):
+        victims = []
+        with self._lock:
+            if self.bytes <= self.max_bytes: return
+            now = time.time()
+            for name in list(self._files):
+                if self.bytes <= self.max_bytes: break
+                if self._pinned_locked(name, now): continue
+                victims.append((name, self._files.pop(name)['size']))
+                self.bytes -= victims[-1][1]
+                self.evicted_quota += 1
+        self._remove(victims, 'quota')
+
+    def _expire(self):
+        """Removes files idle past max_age; returns seconds until the next one expires."""
+        victims = []
+        next_expiry = self.max_age
+        with self._lock:
+            now = time.time()
+            for name, entry in list(self._files.items()):
+                idle = now - entry['accessed']
+                if idle < self.max_age:
+                    next_expiry = min(next_expiry, self.max_age - idle)
+                    continue
+                if self._pinned_locked(name, now): continue
+                del self._files[name]
+                self.bytes -= entry['size']
+                self.evicted_age += 1
+                victims.append((name, entry['size']))
+        self._remove(victims, 'age')
+        return next_expiry
+
+    def _remove(self, victims, reason):
+        for name, size in victims:
+            try:
+                os.remove(os.path.join(self.folder, name))
+                self.bytes_evicted += size
+                print(f"STORAGE: Deleted {name} ({reason})")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"STORAGE ERROR: Could not delete {name}: {e}")
+            if self.on_remove:
+                try: self.on_remove(name)
+                except Exception as e: print(f"STORAGE ERROR: on_remove failed for {name}: {e}")
+
+    # --- Sweeper ---
+
+    def start(self):
+        """Indexes the folder and starts the age sweeper thread."""
+        if self._thread: return
+        self.reconcile()
+        self._thread = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                if time.time() - self._last_reconcile > self.reconcile_every:
+                    self.reconcile()
+                wait = self._expire()
+            except Exception as e:
+                print(f"STORAGE ERROR: Sweep failed: {e}")
+                wait = 60
+            time.sleep(max(1, min(wait, self.reconcile_every)))
+
+    def _disk_usage(self):
+        try:
+            disk = shutil.disk_usage(self.folder)
+            return {'total': disk.total, 'used': disk.used, 'free': disk.free}
+        except OSError:
+            return None
+
+    def stats(self):
+        disk = self._disk_usage()
+        with self._lock:
+            now = time.time()
+            pinned = sum(1 for n in list(self._pins) if self._pinned_locked(n, now))
+            return {
+                'files': len(self._files),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'pinned': pinned,
+                'evicted_quota': self.evicted_quota,
+                'evicted_age': self.evicted_age,
+                'bytes_evicted': self.bytes_evicted,
+                'disk': disk
+            }
+
+
+class SharedStorageManager(StorageManager):
+    """StorageManager whose index and pins live in a SharedDB, for multi-worker mode.
+
+    All workers register, touch and pin files in the same tables, so the
+    quota covers the whole folder once and a file that one worker just
+    served or is remuxing is never evicted by another. Quota eviction runs in
+    whichever worker pushes the folder over budget, inside BEGIN IMMEDIATE so
+    two workers never pick the same victims. The age sweep and reconcile only
+    run in the worker created with sweep=True (the primary).
+    """
+
+    def __init__(self, folder, db, sweep=True, **kwargs):
+        super().__init__(folder, **kwargs)
+        self.db = db
+        self.sweep = sweep
+        # lru orders quota eviction (demote() zeroes it); accessed drives the age limit
+        self.db.execute('CREATE TABLE IF NOT EXISTS storage_files (name TEXT PRIMARY KEY, size INTEGER, '
+                        'created REAL, accessed REAL, lru REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS storage_files_lru ON storage_files (lru)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS storage_pins (name TEXT PRIMARY KEY, expiry REAL)')
+
+    # --- Index maintenance ---
+
+    def register(self, path):
+        name = os.path.basename(path)
+        if not self._indexable(name): return
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return
+        now = time.time()
+        self.db.execute(
+            'INSERT INTO storage_files VALUES (?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET '
+            'size = excluded.size, accessed = excluded.accessed, lru = excluded.lru',
+            (name, st.st_size, now, now, now)
+        )
+        self._enforce_quota()
+
+    def touch(self, name):
+        now = time.time()
+        self.db.execute('UPDATE storage_files SET accessed = ?, lru = ? WHERE name = ?', (now, now, name))
+
+    def demote(self, name):
+        self.db.execute('UPDATE storage_files SET lru = 0 WHERE name = ?', (name,))
+
+    def pin(self, name, ttl=None):
+        # Far future instead of infinity for "until unpin()"
+        self.db.execute('INSERT OR REPLACE INTO storage_pins VALUES (?, ?)', (name, time.time() + (ttl or 10 ** 10)))
+
+    def unpin(self, name):
+        self.db.execute('DELETE FROM storage_pins WHERE name = ?', (name,))
+
+    def reconcile(self):
+        seen = {}
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_file(follow_symlinks=False) and self._indexable(entry.name):
+                    seen[entry.name] = entry.stat()
+            except OSError:
+                continue # Removed between listing and stat
+        with self.db.transaction() as conn:
+            gone = [(name,) for (name,) in conn.execute('SELECT name FROM storage_files') if name not in seen]
+            conn.executemany('DELETE FROM storage_files WHERE name = ?', gone)
+            # Files we didn't write ourselves count as least recently used
+            conn.executemany('INSERT OR IGNORE INTO storage_files VALUES (?, ?, ?, ?, 0)',
+                             [(name, st.st_size, st.st_mtime, st.st_mtime) for name, st in seen.items()])
+            conn.execute('DELETE FROM storage_pins WHERE expiry < ?', (time.time(),))
+        self._last_reconcile = time.time()
+        self._enforce_quota()
+
+    # --- Eviction ---
+
+    def _enforce_quota(self):
+        victims = []
+        with self.db.transaction() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM storage_files').fetchone()[0]
+            if total > self.max_bytes:
+                candidates = conn.execute(
+                    'SELECT name, size FROM storage_files WHERE name NOT IN '
+                    '(SELECT name FROM storage_pins WHERE expiry >= ?) ORDER BY lru', (time.time(),)
+                ).fetchall()
+                for name, size in candidates:
+                    if total <= self.max_bytes: break
+                    victims.append((name, size))
+                    total -= size
+                conn.executemany('DELETE FROM storage_files WHERE name = ?', [(name,) for name, _ in victims])
+        self.evicted_quota += len(victims)
+        self._remove(victims, 'quota')
+
+    def _expire(self):
+        now = time.time()
+        with self.db.transaction() as conn:
+            victims = conn.execute(
+                'SELECT name, size FROM storage_files WHERE accessed <= ? AND name NOT IN '
+                '(SELECT name FROM storage_pins WHERE expiry >= ?)', (now - self.max_age, now)
+            ).fetchall()
+            conn.executemany('DELETE FROM storage_files WHERE name = ?', [(name,) for name, _ in victims])
+            oldest = conn.execute('SELECT MIN(accessed) FROM storage_files WHERE accessed > ?',
+                                  (now - self.max_age,)).fetchone()[0]
+        self.evicted_age += len(victims)
+        self._remove(victims, 'age')
+        return self.max_age - (now - oldest) if oldest is not None else self.max_age
+
+    # --- Sweeper ---
+
+    def start(self):
+        """Indexes the folder and starts the sweeper, in the sweeping worker only."""
+        if self.sweep: super().start()
+
+    def stats(self):
+        files, total = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM storage_files').fetchone()
+        pinned = self.db.execute('SELECT COUNT(*) FROM storage_pins WHERE expiry >= ?', (time.time(),)).fetchone()[0]
+        return {
+            'files': files,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'pinned': pinned,
+            'backend': 'sqlite',
+            'sweeper': self.sweep,
+            'evicted_quota': self.evicted_quota,
+            'evicted_age': self.evicted_age,
+            'bytes_evicted': self.bytes_evicted,
+            'disk': self._disk_usage()
+        }
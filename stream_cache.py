@@ -0,0 +1,261 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class _Entry:
+    """One cached upstream body, possibly still being written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition()
+        self.ready = False      # Headers known, file open for reading
+        self.failed = False
+        self.complete = False
+        self.written = 0
+        self.total = None       # Content-Length, if upstream sent one
+        self.headers = {}
+        self.readers = 0
+        self.watchers = set()   # Callbacks for readers that can't block on cond (the async proxy)
+        self.last_progress = time.time()
+
+    @property
+    def done(self):
+        return self.complete or self.failed
+
+
+class StreamCache:
+    """Read-while-write cache for proxied CDN streams.
+
+    The first request for a URL becomes the filler: a background thread tees
+    the upstream body into a local file while every reader (the filler's
+    client included) streams from that file, blocking only on bytes that
+    haven't arrived yet. Later requests for the same URL read the growing or
+    finished file instead of opening another upstream stream. Finished files
+    are kept in a byte-budget LRU; entries still being filled or read are
+    never evicted.
+    """
+
+    def __init__(self, folder, max_bytes=2 * 1024 ** 3, chunk_size=64 * 1024, stall_timeout=60):
+        self.folder = str(folder)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.stall_timeout = stall_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.upstream_bytes = 0
+        self.served_bytes = 0
+        self.bytes_saved = 0
+        os.makedirs(self.folder, exist_ok=True)
+        # Files from a previous run have no headers to go with them
+        for name in os.listdir(self.folder):
+            try: os.remove(os.path.join(self.folder, name))
+            except OSError: pass
+
+    # --- Lookup ---
+
+    def acquire(self, key):
+        """Returns (entry, is_filler). The filler must call fill() or abandon()."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.failed:
+                self._entries.move_to_end(key)
+                entry.readers += 1
+                self.hits += 1
+                return entry, False
+            name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+            entry = self._entries[key] = _Entry(os.path.join(self.folder, name))
+            entry.readers += 1
+            self.misses += 1
+            return entry, True
+
+    def peek(self, key):
+        """Returns a usable entry for key without creating one (for Range requests)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.failed or not entry.ready: return None
+            self._entries.move_to_end(key)
+            entry.readers += 1
+            self.hits += 1
+            return entry
+
+    def release(self, entry):
+        with entry.cond:
+            entry.readers -= 1
+        self._evict()
+
+    def wait_ready(self, entry, timeout=None):
+        """Blocks until the filler has headers (True) or gave up (False)."""
+        with entry.cond:
+            entry.cond.wait_for(lambda: entry.ready or entry.failed, timeout or self.stall_timeout)
+            return entry.ready and not entry.failed
+
+    def watch(self, entry, callback):
+        """Calls callback() (on the writer's thread) whenever the entry gets headers, bytes or finishes."""
+        with entry.cond:
+            entry.watchers.add(callback)
+
+    def unwatch(self, entry, callback):
+        with entry.cond:
+            entry.watchers.discard(callback)
+
+    def _wake_locked(self, entry):
+        entry.cond.notify_all()
+        for callback in list(entry.watchers):
+            try: callback()
+            except Exception as e: print(f"STREAM CACHE: Watcher failed for {entry.path}: {e}")
+
+    # --- Filling ---
+
+    def abandon(self, key, entry):
+        """Filler couldn't (or shouldn't) cache this response; waiting readers fall back."""
+        with entry.cond:
+            entry.failed = True
+            self._wake_locked(entry)
+        self._drop(key, entry)
+
+    def fill(self, key, entry, response, headers):
+        """Starts teeing a streaming `requests` response into the entry's file."""
+        if not self.begin_fill(key, entry, response.headers.get('Content-Length'), headers):
+            return False # Caller streams this one straight through
+        threading.Thread(target=self._fill_loop, args=(key, entry, response), daemon=True).start()
+        return True
+
+    def begin_fill(self, key, entry, content_length, headers):
+        """Makes the entry readable. Returns False (and abandons it) if the body can't be cached.
+
+        fill() drives the rest on a thread; async callers follow up with
+        append() per chunk and finish_fill() themselves.
+        """
+        entry.total = int(content_length) if content_length and str(content_length).isdigit() else None
+        if entry.total is not None and entry.total > self.max_bytes:
+            self.abandon(key, entry)
+            return False
+        with open(entry.path, 'wb'): pass
+        with entry.cond:
+            entry.headers = headers
+            entry.ready = True
+            self._wake_locked(entry)
+        return True
+
+    def append(self, entry, f, chunk):
+        """Writes one upstream chunk to the open entry file and wakes readers."""
+        f.write(chunk)
+        f.flush()
+        with entry.cond:
+            entry.written += len(chunk)
+            entry.last_progress = time.time()
+            self._wake_locked(entry)
+        with self._lock:
+            self.upstream_bytes += len(chunk)
+
+    def finish_fill(self, key, entry, ok):
+        """Marks the fill complete, or failed if it errored or came up short."""
+        truncated = not ok or (entry.total is not None and entry.written != entry.total)
+        with entry.cond:
+            if truncated: entry.failed = True
+            else:
+                entry.complete = True
+                entry.total = entry.written
+            self._wake_locked(entry)
+        if truncated: self._drop(key, entry)
+        else: self._evict()
+
+    def _fill_loop(self, key, entry, response):
+        ok = False
+        try:
+            with open(entry.path, 'ab') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if chunk: self.append(entry, f, chunk)
+            ok = True
+        except Exception as e:
+            print(f"STREAM CACHE: Upstream fill failed for {entry.path}: {e}")
+        finally:
+            response.close()
+        self.finish_fill(key, entry, ok)
+
+    # --- Reading ---
+
+    def read(self, entry, start=0, end=None, count_saved=False):
+        """Yields bytes [start, end) of the entry, waiting on the filler as needed."""
+        pos = start
+        try:
+            with open(entry.path, 'rb') as f:
+                f.seek(start)
+                while end is None or pos < end:
+                    with entry.cond:
+                        while pos >= entry.written and not entry.done:
+                            entry.cond.wait(5)
+                            if time.time() - entry.last_progress > self.stall_timeout:
+                                return
+                        available = entry.written
+                        if pos >= available:
+                            return # Finished (or failed) with nothing more to give
+                    want = available - pos
+                    if end is not None: want = min(want, end - pos)
+                    chunk = f.read(min(want, self.chunk_size))
+                    if not chunk: return
+                    pos += len(chunk)
+                    yield chunk
+        finally:
+            self.count_served(pos - start, count_saved)
+
+    def count_served(self, n, saved):
+        with self._lock:
+            self.served_bytes += n
+            if saved: self.bytes_saved += n
+
+    # --- Eviction ---
+
+    def _drop(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        if entry.readers <= 0 or entry.failed:
+            # Unlinking is safe on POSIX even while a reader still has the file open
+            try: os.remove(entry.path)
+            except OSError: pass
+
+    def _evict(self):
+        victims = []
+        with self._lock:
+            used = sum(e.written for e in self._entries.values())
+            for key, entry in list(self._entries.items()):
+                if used <= self.max_bytes: break
+                if not entry.complete or entry.readers > 0: continue
+                del self._entries[key]
+                used -= entry.written
+                self.evictions += 1
+                victims.append(entry)
+        for entry in victims:
+            try: os.remove(entry.path)
+            except OSError: pass
+
+    def clear(self):
+        with self._lock:
+            idle = [(k, e) for k, e in self._entries.items() if e.complete and e.readers <= 0]
+            for key, _ in idle:
+                del self._entries[key]
+        for _, entry in idle:
+            try: os.remove(entry.path)
+            except OSError: pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'filling': sum(1 for e in self._entries.values() if not e.done),
+                'bytes': sum(e.written for e in self._entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'upstream_bytes': self.upstream_bytes,
+                'served_bytes': self.served_bytes,
+                'bytes_saved': self.bytes_saved
+            }
@@ -0,0 +1,51 @@
+import os
+import sys
+import importlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    """The app module, imported once with its data folders inside a temp directory."""
+    workdir = tmp_path_factory.mktemp('app')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    os.environ.setdefault('EXTRACT_PROCESSES', '0')
+    os.environ.setdefault('GEOIP_ONLINE', '0')
+    try:
+        module = importlib.import_module('app')
+        yield module
+    finally:
+        os.chdir(previous)
+
+
+class _VideoHandler(BaseHTTPRequestHandler):
+    body = b'0123456789' * 1000
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def video_server():
+    """Local HTTP server standing in for a CDN; yields (base_url, body)."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _VideoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", _VideoHandler.body
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,53 @@
+import os
+import multiprocessing
+
+from activity_log import ActivityLog
+
+WORKERS = 8
+EVENTS = 100
+
+
+def _worker(segment_dir, index, barrier, results):
+    log = ActivityLog(segment_dir, segment_max_events=10, keep_segments=5)
+    for n in range(0, EVENTS, 10):
+        log._write_batch_raw([{'worker': index, 'n': n + i} for i in range(10)])
+        barrier.wait() # Everyone rotates in lockstep, like busy gunicorn workers
+    results.put((index, os.getpid(), os.path.exists(log._segment.name)))
+    barrier.wait() # Stay alive until every worker has checked its file
+
+
+def test_workers_never_delete_each_others_segments(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(str(tmp_path), i, barrier, results)) for i in range(WORKERS)]
+    for p in procs: p.start()
+    outcomes = [results.get(timeout=30) for _ in procs]
+    for p in procs: p.join(timeout=30)
+
+    assert all(current_exists for _, _, current_exists in outcomes)
+    events = ActivityLog(str(tmp_path)).recent(limit=WORKERS * EVENTS)
+    for index in range(WORKERS):
+        seen = {e['n'] for e in events if e['worker'] == index}
+        # Each worker keeps (at least) its newest 5 segments of 10 events; two
+        # rotations within the same millisecond share a file, so one may hold 20
+        assert set(range(EVENTS - 50, EVENTS)) <= seen
+    assert len(ActivityLog(str(tmp_path)).segments()) <= WORKERS * 5
+
+
+def test_exited_workers_segments_are_trimmed(tmp_path):
+    ctx = multiprocessing.get_context('fork')
+    for _ in range(3):
+        p = ctx.Process(target=lambda: ActivityLog(str(tmp_path), keep_segments=2)._write_batch_raw([{'x': 1}]))
+        p.start()
+        p.join()
+    # Pre-pid segment name from older versions
+    (tmp_path / 'activity-1000.jsonl').write_text('{"x": 0}\n')
+
+    log = ActivityLog(str(tmp_path), keep_segments=2)
+    log._write_batch_raw([{'x': 2}])
+    names = [os.path.basename(p) for p in log.segments()]
+    own = [n for n in names if n.endswith(f"-{os.getpid()}.jsonl")]
+    assert len(own) == 1
+    assert len(names) == 3 # Own segment plus the two newest orphans
+    assert 'activity-1000.jsonl' not in names
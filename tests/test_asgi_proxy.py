@@ -0,0 +1,111 @@
+import time
+
+from starlette.testclient import TestClient
+
+
+def test_async_dl_proxy_logs_activity(flask_app, video_server):
+    import asgi
+    base, body = video_server
+    flask_app.activity_log.flush()
+    written = flask_app.activity_log.written
+
+    with TestClient(asgi.app) as client:
+        resp = client.get('/dl-proxy', params={'url': f"{base}/clip.mp4", 'name': 'clip.mp4'},
+                          headers={'X-Forwarded-For': '203.0.113.9, 10.0.0.1', 'User-Agent': 'pytest-agent'})
+    assert resp.status_code == 200
+    assert resp.content == body
+
+    # The background flusher may already hold the event; give it one flush interval
+    deadline = time.time() + flask_app.activity_log.flush_interval + 5
+    while flask_app.activity_log.written == written and time.time() < deadline:
+        flask_app.activity_log.flush()
+        time.sleep(0.1)
+    assert flask_app.activity_log.written == written + 1
+    event = flask_app.activity_log.recent(1)[-1]
+    assert event['type'] == 'file_download_proxy'
+    assert event['ip'] == '203.0.113.9'
+    assert event['user_agent'] == 'pytest-agent'
+    assert event['details']['async'] is True
+
+
+def test_async_reader_follows_a_growing_entry(flask_app, tmp_path):
+    import asyncio
+    import threading
+    import asgi
+    from stream_cache import StreamCache
+
+    cache = StreamCache(tmp_path / 'streams')
+    previous, flask_app.stream_cache = flask_app.stream_cache, cache
+    try:
+        entry, filler = cache.acquire('https://cdn/clip.mp4')
+        assert filler
+
+        def fill():
+            cache.begin_fill('https://cdn/clip.mp4', entry, '30', {'Content-Type': 'video/mp4'})
+            with open(entry.path, 'ab') as f:
+                for part in (b'a' * 10, b'b' * 10, b'c' * 10):
+                    time.sleep(0.2)
+                    cache.append(entry, f, part)
+            cache.finish_fill('https://cdn/clip.mp4', entry, True)
+
+        async def read():
+            assert await asgi._wait_ready(entry, 5)
+            return b''.join([chunk async for chunk in asgi._read_entry(entry, 5, None, False)])
+
+        threading.Thread(target=fill, daemon=True).start()
+        assert asyncio.run(read()) == b'a' * 5 + b'b' * 10 + b'c' * 10
+        assert not entry.watchers
+    finally:
+        flask_app.stream_cache = previous
+
+
+def test_async_long_poll_returns_on_job_update(flask_app):
+    import threading
+    import asgi
+
+    flask_app.save_job('asgi-poll', {'status': 'processing'})
+    version = flask_app.job_store.version('asgi-poll')
+    threading.Timer(0.3, flask_app.save_job, args=('asgi-poll', {'status': 'ready'})).start()
+
+    started = time.time()
+    with TestClient(asgi.app) as client:
+        resp = client.get('/status/asgi-poll/wait', params={'since': version, 'timeout': 10})
+    assert resp.status_code == 200
+    assert resp.json()['status'] == 'ready'
+    assert time.time() - started < 5
+
+
+def test_failed_upstream_open_does_not_stall_the_next_request(flask_app):
+    import socket
+    import asgi
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        url = f"http://127.0.0.1:{s.getsockname()[1]}/gone.mp4"
+
+    with TestClient(asgi.app) as client:
+        assert client.get('/dl-proxy', params={'url': url}).status_code == 500
+        started = time.time()
+        assert client.get('/dl-proxy', params={'url': url}).status_code == 500
+    assert time.time() - started < 10
+    assert flask_app.stream_cache.peek(url) is None
+
+
+def test_disconnect_does_not_leave_the_pump_behind(flask_app):
+    import asyncio
+    import asgi
+
+    async def scenario():
+        async def endless():
+            while True:
+                yield b'x' * 10
+                await asyncio.sleep(0)
+
+        body = asgi._buffered(endless())
+        await body.__anext__()
+        await asyncio.sleep(0.05) # The pump fills the queue and waits on it
+        await body.aclose() # Client went away
+        await asyncio.sleep(0.05)
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(scenario()) == []
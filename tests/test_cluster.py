@@ -0,0 +1,39 @@
+import time
+import threading
+
+from cluster import Cluster
+
+NODES = {'a': 'http://10.0.0.1:7860', 'b': 'http://10.0.0.2:7860'}
+
+
+def test_only_signed_markers_from_peers_are_trusted():
+    a = Cluster('a', NODES, secret='s3cret')
+    b = Cluster('b', NODES, secret='s3cret')
+    assert b.is_forwarded(a.forwarded_marker())
+
+    assert not b.is_forwarded('a') # What a client (or an old node) would send
+    assert not b.is_forwarded(Cluster('a', NODES, secret='guess').forwarded_marker())
+    assert not b.is_forwarded(Cluster('c', {**NODES, 'c': 'http://x'}, secret='s3cret').forwarded_marker())
+    stale = f"a:{int(time.time()) - 3600}"
+    assert not b.is_forwarded(f"{stale}:{a._sign(stale)}")
+    assert b.stats()['rejected_markers'] == 4
+
+
+def test_markers_are_never_trusted_without_a_secret():
+    a = Cluster('a', NODES)
+    b = Cluster('b', NODES)
+    assert not b.is_forwarded(a.forwarded_marker())
+
+
+def test_counters_are_exact_under_concurrency():
+    cluster = Cluster('a', NODES)
+
+    def bump():
+        for _ in range(2000):
+            cluster.count_forwarded()
+            cluster.count_handed_off()
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert cluster.stats()['forwarded'] == cluster.stats()['handed_off'] == 16000
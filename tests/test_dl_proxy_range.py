@@ -0,0 +1,58 @@
+def test_ranges_are_served_from_the_stream_cache(flask_app, video_server):
+    base, body = video_server
+    client = flask_app.app.test_client()
+    url = f"{base}/range.mp4"
+
+    full = client.get('/dl-proxy', query_string={'url': url})
+    assert full.status_code == 200 and full.data == body
+    saved = flask_app.stream_cache.stats()['bytes_saved']
+
+    resp = client.get('/dl-proxy', query_string={'url': url}, headers={'Range': 'bytes=10-19'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 10-19/{len(body)}'
+    assert resp.headers['Content-Length'] == '10'
+    assert resp.data == body[10:20]
+    assert flask_app.stream_cache.stats()['bytes_saved'] == saved + 10 # No upstream request
+
+    resp = client.get('/dl-proxy', query_string={'url': url}, headers={'Range': 'bytes=-5', 'If-Range': '"v1"'})
+    assert resp.status_code == 206 and resp.data == body[-5:]
+
+    # The client's copy is another version: it gets the whole current body
+    resp = client.get('/dl-proxy', query_string={'url': url}, headers={'Range': 'bytes=10-19', 'If-Range': '"v0"'})
+    assert resp.status_code == 200 and resp.data == body
+
+    resp = client.get('/dl-proxy', query_string={'url': url}, headers={'Range': f'bytes={len(body)}-'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == f'bytes */{len(body)}'
+
+
+def test_ranges_are_emulated_when_upstream_ignores_them(flask_app, video_server):
+    base, body = video_server
+    client = flask_app.app.test_client()
+
+    # Not cached yet, and the test CDN always answers 200 with the full body
+    resp = client.get('/dl-proxy', query_string={'url': f"{base}/uncached.mp4"}, headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 100-199/{len(body)}'
+    assert resp.data == body[100:200]
+
+
+def _dead_url():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/gone.mp4"
+
+
+def test_failed_upstream_open_does_not_stall_the_next_request(flask_app):
+    import time
+    client = flask_app.app.test_client()
+    url = _dead_url()
+
+    assert client.get('/dl-proxy', query_string={'url': url}).status_code == 500
+    started = time.time()
+    # Without the abandon, this one waits stall_timeout (60 s) on an entry nobody fills
+    assert client.get('/dl-proxy', query_string={'url': url}).status_code == 500
+    assert time.time() - started < 10
+    assert flask_app.stream_cache.peek(url) is None
@@ -0,0 +1,25 @@
+from download_counter import DownloadCounter
+
+
+def test_flush_writes_only_when_changed(tmp_path):
+    counter = DownloadCounter(tmp_path / 'stats.json')
+    assert counter.load() == 0
+    counter.increment()
+    counter.increment(2)
+    assert counter.flush() and not counter.flush()
+    assert DownloadCounter(tmp_path / 'stats.json').load() == 3
+
+
+def test_shared_counters_add_up_each_others_increments(tmp_path):
+    first = DownloadCounter(tmp_path / 'stats.json', shared=True)
+    second = DownloadCounter(tmp_path / 'stats.json', shared=True)
+    first.load()
+    second.load()
+
+    first.increment(2)
+    second.increment(5)
+    first.flush()
+    second.flush()
+    first.flush() # Picks up the other worker's count
+    assert first.value == second.value == 7
+    assert DownloadCounter(tmp_path / 'stats.json').load() == 7
@@ -0,0 +1,121 @@
+import time
+import threading
+
+import pytest
+
+import extraction_engine
+from extraction_engine import ExtractionEngine, ExtractionError, ExtractionRequest
+
+
+class _FakeWorker:
+    created = 0
+    lock = threading.Lock()
+
+    def __init__(self, config):
+        with _FakeWorker.lock:
+            _FakeWorker.created += 1
+        time.sleep(0.01) # Widen the race window of concurrent start() calls
+        self.tasks = 0
+
+    def stop(self, kill=False):
+        pass
+
+
+def test_concurrent_first_requests_start_one_pool(monkeypatch):
+    monkeypatch.setattr(extraction_engine, '_Worker', _FakeWorker)
+    _FakeWorker.created = 0
+    engine = ExtractionEngine({}, processes=3)
+    threads = [threading.Thread(target=engine.start) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert _FakeWorker.created == 4 # 3 general + 1 preview
+    assert engine._idle.qsize() == 3 and engine._preview_idle.qsize() == 1
+
+
+def test_extract_gives_up_when_every_process_is_busy(monkeypatch):
+    monkeypatch.setattr(extraction_engine, '_Worker', _FakeWorker)
+    engine = ExtractionEngine({}, processes=1)
+    engine.start()
+    held = engine._idle.get() # A long download holds the only process
+
+    started = time.time()
+    with pytest.raises(ExtractionError) as excinfo:
+        engine.extract(ExtractionRequest('https://www.instagram.com/reel/x/', 'instagram', download=True), timeout=0.3)
+    assert excinfo.value.error_type == 'Busy'
+    assert time.time() - started < 2
+    assert engine.stats()['busy'] == 1
+    engine._idle.put(held)
+
+
+class _Conn:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def poll(self, timeout):
+        time.sleep(timeout) # The task never finishes on its own
+        return False
+
+
+class _HangingWorker(_FakeWorker):
+    killed = 0
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.send_conn = self.recv_conn = _Conn()
+
+    def stop(self, kill=False):
+        if kill: _HangingWorker.killed += 1
+
+
+def test_cancel_kills_the_running_process(monkeypatch):
+    monkeypatch.setattr(extraction_engine, '_Worker', _HangingWorker)
+    _HangingWorker.killed = 0
+    engine = ExtractionEngine({}, processes=1)
+    engine.start()
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+
+    started = time.time()
+    with pytest.raises(ExtractionError) as excinfo:
+        engine.extract(ExtractionRequest('https://www.youtube.com/watch?v=x', 'youtube'), timeout=30, cancel=cancel)
+    assert excinfo.value.error_type == 'Cancelled'
+    assert time.time() - started < 2
+    assert _HangingWorker.killed == 1
+    assert engine.stats()['cancelled'] == 1
+    assert engine._idle.qsize() == 1 # A fresh process took the killed one's slot
+
+
+def test_previews_get_a_process_while_downloads_hold_the_pool(monkeypatch):
+    monkeypatch.setattr(extraction_engine, '_Worker', _HangingWorker)
+    engine = ExtractionEngine({}, processes=1, preview_processes=1)
+    engine.start()
+    held = engine._idle.get() # A long download holds the only general process
+
+    # The preview runs (and times out) on its own lane instead of waiting as 'Busy'
+    with pytest.raises(ExtractionError) as excinfo:
+        engine.extract(ExtractionRequest('https://www.instagram.com/reel/x/', 'instagram'), timeout=0.3)
+    assert excinfo.value.error_type == 'Timeout'
+    assert engine._preview_idle.qsize() == 1 and engine._idle.qsize() == 0
+
+    # Downloads never borrow the preview lane
+    with pytest.raises(ExtractionError) as excinfo:
+        engine.extract(ExtractionRequest('https://www.instagram.com/reel/x/', 'instagram', download=True), timeout=0.3)
+    assert excinfo.value.error_type == 'Busy'
+    engine._idle.put(held)
+
+
+def test_waiting_for_a_process_counts_against_the_timeout(monkeypatch):
+    monkeypatch.setattr(extraction_engine, '_Worker', _HangingWorker)
+    engine = ExtractionEngine({}, processes=1, preview_processes=0)
+    engine.start()
+    held = engine._idle.get()
+    threading.Timer(0.6, engine._idle.put, (held,)).start()
+
+    started = time.time()
+    with pytest.raises(ExtractionError) as excinfo:
+        engine.extract(ExtractionRequest('https://www.youtube.com/watch?v=x', 'youtube', download=True), timeout=1)
+    assert excinfo.value.error_type == 'Timeout'
+    assert time.time() - started < 1.5 # Not 0.6s of waiting plus a fresh 1s to run
@@ -0,0 +1,74 @@
+import os
+import sys
+import stat
+import time
+import struct
+
+import pytest
+
+from faststart import FastStartProcessor, is_faststart
+
+# Stand-in for ffmpeg: rewrites '-i src ... dst' with the moov atom first, slowly
+FAKE_FFMPEG = '''#!{python}
+import sys, time, struct
+args = sys.argv[1:]
+src, dst = args[args.index('-i') + 1], args[-1]
+data = open(src, 'rb').read()
+atoms, offset = {{}}, 0
+while offset < len(data):
+    size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+    atoms[kind] = data[offset:offset + size]
+    offset += size
+time.sleep(0.3)
+open(dst, 'wb').write(atoms[b'ftyp'] + atoms[b'moov'] + atoms[b'mdat'])
+'''
+
+
+def atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def write_trailing_moov(path):
+    with open(path, 'wb') as f:
+        f.write(atom(b'ftyp', b'isom') + atom(b'mdat', b'\0' * 4096) + atom(b'moov', b'meta'))
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    path = tmp_path / 'ffmpeg'
+    path.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_submit_returns_future_of_the_remux(tmp_path, fake_ffmpeg):
+    video = tmp_path / 'clip.mp4'
+    write_trailing_moov(video)
+    processor = FastStartProcessor(workers=1, ffmpeg=fake_ffmpeg)
+    future = processor.submit(str(video))
+    assert processor.submit(str(video)) is future # Already queued
+    assert future.result(timeout=10) is not None
+    assert is_faststart(str(video)) is True
+    assert processor.submit(str(tmp_path / 'notes.txt')) is None
+
+
+def test_github_callback_turns_ready_only_after_remux(flask_app, tmp_path, fake_ffmpeg, monkeypatch):
+    monkeypatch.setattr(flask_app.faststart, 'ffmpeg', fake_ffmpeg)
+    monkeypatch.setattr(flask_app, 'FASTSTART_ENABLED', True)
+    video = tmp_path / 'upload.mp4'
+    write_trailing_moov(video)
+    flask_app.save_job('gh-faststart', {'status': 'pending', 'url': 'https://www.instagram.com/reel/fs/'})
+
+    client = flask_app.app.test_client()
+    with open(video, 'rb') as f:
+        resp = client.post('/github-callback?job_id=gh-faststart', data={'file': (f, 'upload.mp4')})
+    assert resp.status_code == 200
+    assert flask_app.get_job('gh-faststart')['status'] == 'processing'
+
+    deadline = time.time() + 10
+    while flask_app.get_job('gh-faststart')['status'] != 'ready' and time.time() < deadline:
+        time.sleep(0.05)
+    job = flask_app.get_job('gh-faststart')
+    assert job['status'] == 'ready'
+    assert job['faststart_ms'] is not None
+    assert is_faststart(os.path.join(flask_app.DOWNLOAD_FOLDER, job['filename'])) is True
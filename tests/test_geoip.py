@@ -0,0 +1,28 @@
+import time
+import threading
+
+from geoip import GeoIPResolver, UNKNOWN_LOCATION
+
+
+def test_online_lookups_never_block_the_caller():
+    release = threading.Event()
+    asked = []
+
+    def slow_lookup(ip):
+        asked.append(ip)
+        release.wait(5)
+        return 'Paris, Ile-de-France, France' if ip == '8.8.8.8' else None
+
+    resolver = GeoIPResolver(online_lookup=slow_lookup, online_workers=2, max_pending=2)
+    started = time.time()
+    for ip in ('8.8.8.8', '8.8.8.8', '1.1.1.1', '9.9.9.9'):
+        assert resolver.lookup(ip, allow_online=True) == UNKNOWN_LOCATION
+    assert time.time() - started < 1
+    assert resolver.stats()['online_skipped'] == 1 # Third distinct IP is over max_pending
+
+    release.set()
+    deadline = time.time() + 5
+    while resolver.stats()['online_pending'] and time.time() < deadline: time.sleep(0.01)
+    assert resolver.lookup('8.8.8.8', allow_online=True) == 'Paris, Ile-de-France, France'
+    assert resolver.lookup('1.1.1.1', allow_online=True) == UNKNOWN_LOCATION
+    assert sorted(asked) == ['1.1.1.1', '8.8.8.8']
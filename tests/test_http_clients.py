@@ -0,0 +1,29 @@
+import socket
+
+import pytest
+import requests
+
+from http_clients import HttpClients, Upstream
+
+
+def test_calls_are_counted_per_upstream(video_server):
+    base, body = video_server
+    http = HttpClients([Upstream('cdn_video'), Upstream('github')])
+    assert http.get('cdn_video', f"{base}/a.mp4").content == body
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        dead = f"http://127.0.0.1:{s.getsockname()[1]}/"
+    with pytest.raises(requests.ConnectionError):
+        http.get('cdn_video', dead)
+
+    stats = http.stats()
+    assert stats['cdn_video']['requests'] == 2 and stats['cdn_video']['errors'] == 1
+    assert stats['cdn_video']['p50_ms'] is not None
+    assert stats['github']['requests'] == 0
+
+
+def test_read_timeout_can_be_overridden_per_upstream(monkeypatch):
+    monkeypatch.setenv('HTTP_TIMEOUT_COBALT', '42')
+    assert Upstream('cobalt', read_timeout=10).timeout == (3.05, 42.0)
+    assert Upstream('geo', read_timeout=10).timeout == (3.05, 10)
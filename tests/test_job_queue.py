@@ -0,0 +1,72 @@
+import time
+import threading
+
+import pytest
+
+from job_queue import DownloadScheduler, QueueFull
+
+
+def test_owns_covers_queued_and_running_jobs():
+    scheduler = DownloadScheduler({'instagram': 1})
+    release = threading.Event()
+    started = threading.Event()
+    done = threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit('instagram', 'running', blocked)
+    assert started.wait(5)
+    scheduler.submit('instagram', 'waiting', done.set)
+    assert scheduler.owns('running') and scheduler.owns('waiting')
+    assert scheduler.position('waiting') is not None and scheduler.position('running') is None
+    assert not scheduler.owns('unknown')
+
+    release.set()
+    assert done.wait(5)
+    deadline = time.time() + 5
+    while scheduler.owns('waiting') and time.time() < deadline: # Released just after fn returns
+        time.sleep(0.01)
+    assert not scheduler.owns('waiting')
+
+
+def _occupy(scheduler, platform):
+    """Keeps the lane's only worker busy; returns the event that frees it."""
+    started, release = threading.Event(), threading.Event()
+    scheduler.submit(platform, 'running', lambda: started.set() or release.wait(5))
+    assert started.wait(5)
+    return release
+
+
+def test_full_lane_rejects_with_retry_after_without_blocking_others():
+    scheduler = DownloadScheduler({'instagram': 1, 'youtube': 1}, max_depth=2, default_duration=10)
+    release = _occupy(scheduler, 'instagram')
+    for job_id in ('a', 'b'): scheduler.submit('instagram', job_id, lambda: None)
+
+    with pytest.raises(QueueFull) as excinfo:
+        scheduler.submit('instagram', 'c', lambda: None)
+    assert excinfo.value.lane == 'instagram'
+    assert excinfo.value.retry_after == 20 # Two queued jobs of ~10s on one worker
+    assert scheduler.submit_many('instagram', [('d', lambda: None, ())]) == [None]
+    assert scheduler.stats()['instagram']['rejected'] == 2
+
+    # A YouTube burst has its own queue
+    assert scheduler.submit('youtube', 'e', lambda: None)[0] == 1
+    release.set()
+
+
+def test_download_answers_429_with_retry_after_when_the_queue_is_full(flask_app, monkeypatch):
+    scheduler = DownloadScheduler({'instagram': 1, 'youtube': 1}, max_depth=1, default_duration=10)
+    release = _occupy(scheduler, 'instagram')
+    scheduler.submit('instagram', 'waiting', lambda: None)
+    monkeypatch.setattr(flask_app, 'download_scheduler', scheduler)
+
+    client = flask_app.app.test_client()
+    resp = client.post('/download', json={'url': 'https://www.instagram.com/reel/queue-full/', 'device_id': 'queue-test'},
+                       headers={'X-App-Secret': flask_app.APP_SECRET})
+    release.set()
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '10' and resp.get_json()['retry_after'] == 10
+    user = flask_app.credit_store.get('did_queue-test')
+    assert user.credits == flask_app.DEFAULT_CREDITS # Refunded
@@ -0,0 +1,50 @@
+import time
+import threading
+
+
+def test_status_keeps_the_stored_position_of_jobs_queued_elsewhere(flask_app):
+    # Queued by another worker: this process's scheduler has never seen it
+    flask_app.save_job('queued-elsewhere', {'status': 'pending', 'url': 'https://www.instagram.com/reel/x/',
+                                            'queue_position': 3, 'estimated_start': 1234})
+    client = flask_app.app.test_client()
+
+    status = client.get('/status/queued-elsewhere').get_json()
+    assert status['queue_position'] == 3 and status['estimated_start'] == 1234
+
+    jobs = client.get('/status/batch', query_string={'ids': 'queued-elsewhere'}).get_json()['jobs']
+    assert jobs['queued-elsewhere']['queue_position'] == 3
+
+
+def test_batch_aliases_of_one_leader_get_their_own_status(flask_app, monkeypatch):
+    flask_app.save_job('leader', {'status': 'pending', 'url': 'https://www.instagram.com/reel/y/'})
+    flask_app.save_job('alias-a', {'status': 'pending', 'alias_of': 'leader'})
+    flask_app.save_job('alias-b', {'status': 'pending', 'alias_of': 'leader'})
+    # Positions are looked up by the id the client asked about
+    monkeypatch.setattr(flask_app.download_scheduler, 'owns', lambda job_id: True)
+    monkeypatch.setattr(flask_app.download_scheduler, 'position',
+                        lambda job_id, platform=None: (1, 1234) if job_id == 'alias-a' else None)
+
+    client = flask_app.app.test_client()
+    jobs = client.get('/status/batch', query_string={'ids': 'alias-a,alias-b'}).get_json()['jobs']
+    assert jobs['alias-a']['queue_position'] == 1
+    assert 'queue_position' not in jobs['alias-b']
+
+
+def test_long_poll_returns_when_the_job_changes(flask_app):
+    flask_app.save_job('poll-leader', {'status': 'processing'})
+    flask_app.save_job('poll-alias', {'status': 'pending', 'alias_of': 'poll-leader'})
+    client = flask_app.app.test_client()
+    version = client.get('/status/poll-alias').get_json()['version']
+
+    # An outdated ?since= answers right away
+    started = time.time()
+    assert client.get('/status/poll-alias/wait', query_string={'since': version - 1}).status_code == 200
+    assert time.time() - started < 1
+
+    # The alias wakes up when its leader's record changes
+    threading.Timer(0.3, flask_app.save_job, args=('poll-leader', {'status': 'ready'})).start()
+    started = time.time()
+    resp = client.get('/status/poll-alias/wait', query_string={'since': version, 'timeout': 10})
+    assert resp.status_code == 200
+    assert resp.get_json()['status'] == 'ready' and resp.get_json()['version'] != version
+    assert time.time() - started < 5
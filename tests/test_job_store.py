@@ -0,0 +1,51 @@
+import os
+import time
+import threading
+
+import job_store
+from job_store import JobStore, ROTATED_SUFFIX
+
+
+def _store(tmp_path):
+    return JobStore(tmp_path / 'jobs.json', tmp_path / 'jobs.journal.jsonl')
+
+
+def test_reads_and_writes_do_not_wait_for_the_snapshot_fsync(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    for i in range(200): store.put(f"job-{i}", {'status': 'ready'})
+    fsync_started = threading.Event()
+
+    def slow_fsync(fd):
+        fsync_started.set()
+        time.sleep(1)
+
+    monkeypatch.setattr(job_store.os, 'fsync', slow_fsync)
+    compaction = threading.Thread(target=store.compact)
+    compaction.start()
+    assert fsync_started.wait(5)
+
+    started = time.time()
+    store.put('job-new', {'status': 'pending'})
+    assert store.get('job-0')['status'] == 'ready'
+    assert time.time() - started < 0.5
+    compaction.join()
+
+    # The put made during compaction is in the fresh journal, not lost with the old one
+    recovered = _store(tmp_path)
+    recovered.recover()
+    assert recovered.get('job-new')['status'] == 'pending'
+    assert not os.path.exists(str(tmp_path / 'jobs.journal.jsonl') + ROTATED_SUFFIX)
+
+
+def test_recovery_replays_a_journal_left_mid_compaction(tmp_path):
+    store = _store(tmp_path)
+    store.put('job-1', {'status': 'pending'})
+    store.compact()
+    store.put('job-1', {'status': 'processing'})
+    with store._lock:
+        store._rotate_journal_locked() # Crash after moving the journal, before the snapshot landed
+    store.put('job-1', {'status': 'ready'})
+
+    recovered = _store(tmp_path)
+    recovered.recover()
+    assert recovered.get('job-1')['status'] == 'ready'
@@ -0,0 +1,47 @@
+import time
+
+from preview_cache import PreviewCache, signed_url_expiry
+
+
+def test_signed_url_expiry_reads_oe_and_expire():
+    assert signed_url_expiry('https://scontent.cdninstagram.com/v/t.mp4?oe=66A1B2C3&_nc_ht=x') == 0x66A1B2C3
+    assert signed_url_expiry('https://rr1.googlevideo.com/videoplayback?expire=1700000000&id=o') == 1700000000
+    assert signed_url_expiry('https://example.com/clip.mp4') is None
+    assert signed_url_expiry('https://example.com/clip.mp4?oe=nothex') is None
+
+
+def test_entries_expire_with_their_earliest_signed_link(monkeypatch):
+    cache = PreviewCache(default_ttl=3600, safety_margin=600, stale_window=300)
+    now = time.time()
+    # Two links; the thumbnail's runs out first
+    cache.put('reel', {'video': f"https://scontent.cdninstagram.com/v.mp4?oe={int(now + 3000):X}",
+                       'thumbnails': [f"https://scontent.cdninstagram.com/t.jpg?oe={int(now + 1000):X}"]})
+    cache.put('short', {'formats': [{'url': f"https://rr1.googlevideo.com/videoplayback?expire={int(now + 2000)}"}]})
+    cache.put('plain', {'title': 'no signed links'})
+    assert cache.get('reel')[1] == cache.get('short')[1] == cache.get('plain')[1] == 'fresh'
+
+    # The reel's thumbnail is within the safety margin of expiring; the others are not
+    monkeypatch.setattr(time, 'time', lambda: now + 450)
+    assert cache.get('reel') == (None, None)
+    assert cache.get('short')[1] == 'fresh' and cache.get('plain')[1] == 'fresh'
+
+    monkeypatch.setattr(time, 'time', lambda: now + 3601) # default_ttl bounds links without an expiry
+    assert cache.get('plain') == (None, None)
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    cache = PreviewCache(default_ttl=3600, safety_margin=600, stale_window=300)
+    now = time.time()
+    cache.put('reel', {'video': f"https://scontent.cdninstagram.com/v.mp4?oe={int(now + 1000):X}"})
+
+    monkeypatch.setattr(time, 'time', lambda: now + 200) # Inside the stale window
+    assert cache.get('reel')[1] == 'stale'
+    monkeypatch.setattr(time, 'time', lambda: now + 401) # Within the margin of the link expiring
+    assert cache.get('reel') == (None, None)
+    assert cache.stats()['entries'] == 0
+
+
+def test_links_already_near_expiry_are_not_cached():
+    cache = PreviewCache(safety_margin=600)
+    cache.put('reel', {'video': f"https://rr1.googlevideo.com/videoplayback?expire={int(time.time() + 60)}"})
+    assert cache.get('reel') == (None, None)
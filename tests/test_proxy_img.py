@@ -0,0 +1,23 @@
+import os
+
+
+def test_thumbnail_evicted_after_lookup_is_fetched_again(flask_app, video_server, monkeypatch):
+    base, body = video_server
+    client = flask_app.app.test_client()
+    url = f"{base}/thumb.jpg"
+    assert client.get('/proxy-img', query_string={'url': url}).data == body
+
+    cache = flask_app.thumb_cache
+    lookup = cache.get
+
+    def evicted_after_lookup(key):
+        meta, stale = lookup(key)
+        if meta: os.remove(meta['path']) # Another worker evicts it before we open the file
+        return meta, stale
+    monkeypatch.setattr(cache, 'get', evicted_after_lookup)
+
+    resp = client.get('/proxy-img', query_string={'url': url})
+    assert resp.status_code == 200 and resp.data == body
+    monkeypatch.undo()
+    meta, _ = cache.get(flask_app.normalize_url(url)) # Re-filled from upstream
+    assert meta and os.path.getsize(meta['path']) == len(body)
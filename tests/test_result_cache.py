@@ -0,0 +1,40 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def _file(folder, name, size):
+    with open(os.path.join(folder, name), 'wb') as f: f.write(b'x' * size)
+
+
+def test_hits_until_the_file_or_ttl_goes(tmp_path, monkeypatch):
+    evicted = []
+    cache = ResultCache(str(tmp_path), ttl=900, on_evict=evicted.append)
+    _file(tmp_path, 'a.mp4', 10)
+    _file(tmp_path, 'b.mp4', 10)
+    cache.put('instagram:a', {'filename': 'a.mp4', 'title': 'A'})
+    cache.put('instagram:b', {'filename': 'b.mp4', 'title': 'B'})
+    assert cache.get('instagram:a')['title'] == 'A'
+
+    os.remove(tmp_path / 'a.mp4')
+    assert cache.get('instagram:a') is None
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 901)
+    assert cache.get('instagram:b') is None
+    assert evicted == ['a.mp4', 'b.mp4'] and cache.stats()['bytes'] == 0
+
+
+def test_least_recently_used_entries_go_over_budget(tmp_path):
+    evicted = []
+    cache = ResultCache(str(tmp_path), max_bytes=25, on_evict=evicted.append)
+    for name in ('a', 'b', 'c'):
+        _file(tmp_path, f"{name}.mp4", 10)
+    cache.put('a', {'filename': 'a.mp4'})
+    cache.put('b', {'filename': 'b.mp4'})
+    cache.get('a')
+    cache.put('c', {'filename': 'c.mp4'})
+
+    assert evicted == ['b.mp4']
+    assert cache.get('a') and cache.get('c') and cache.get('b') is None
@@ -0,0 +1,47 @@
+import time
+import multiprocessing
+
+from credit_store import SharedCreditStore
+from shared_state import SharedDB, SQLiteRateLimitStorage
+
+WORKERS = 8
+ATTEMPTS = 30
+CREDITS = 100
+
+
+def _charge(db_path, barrier, results):
+    store = SharedCreditStore(SharedDB(db_path))
+    record, _ = store.get_or_create('user-1', CREDITS)
+    barrier.wait() # Every worker charges at the same time
+    results.put(sum(store.charge(record, 1) for _ in range(ATTEMPTS)))
+
+
+def test_credit_charges_are_atomic_across_processes(tmp_path):
+    db_path = str(tmp_path / 'shared.db')
+    SharedCreditStore(SharedDB(db_path)).get_or_create('user-1', CREDITS)
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_charge, args=(db_path, barrier, results)) for _ in range(WORKERS)]
+    for p in procs: p.start()
+    charged = sum(results.get(timeout=60) for _ in procs)
+    for p in procs: p.join(timeout=30)
+
+    # 240 attempts against 100 credits: exactly 100 succeed and the balance never goes negative
+    assert charged == CREDITS
+    assert SharedCreditStore(SharedDB(db_path)).get('user-1').credits == 0
+
+
+def test_rate_limit_window_resets(tmp_path):
+    uri = f"sqlite://{tmp_path / 'limits.db'}"
+    first, second = SQLiteRateLimitStorage(uri), SQLiteRateLimitStorage(uri)
+    assert first.incr('LIMITER/1.2.3.4/download', 1) == 1
+    assert second.incr('LIMITER/1.2.3.4/download', 1) == 2 # Workers share one counter
+    assert first.get('LIMITER/1.2.3.4/download') == 2
+    expiry = first.get_expiry('LIMITER/1.2.3.4/download')
+
+    time.sleep(1.1)
+    assert first.get('LIMITER/1.2.3.4/download') == 0
+    # A new window starts from the new hit instead of counting on from the old one
+    assert second.incr('LIMITER/1.2.3.4/download', 1) == 1
+    assert first.get_expiry('LIMITER/1.2.3.4/download') > expiry
@@ -0,0 +1,60 @@
+import os
+
+from shared_state import SharedDB
+from storage_manager import SharedStorageManager
+from thumb_cache import SharedThumbnailCache
+
+
+def _write(folder, name, size):
+    with open(os.path.join(folder, name), 'wb') as f: f.write(b'x' * size)
+    return os.path.join(folder, name)
+
+
+def test_workers_share_one_download_quota(tmp_path):
+    folder = str(tmp_path / 'downloads')
+    primary = SharedStorageManager(folder, SharedDB(tmp_path / 'shared.db'), sweep=True, max_bytes=250)
+    worker = SharedStorageManager(folder, SharedDB(tmp_path / 'shared.db'), sweep=False, max_bytes=250)
+    primary.start()
+    worker.start()
+    assert primary._thread is not None and worker._thread is None
+
+    primary.register(_write(folder, 'a.mp4', 100))
+    worker.pin('a.mp4') # e.g. another worker is remuxing it
+    worker.register(_write(folder, 'b.mp4', 100))
+    primary.touch('b.mp4')
+    worker.register(_write(folder, 'c.mp4', 100))
+
+    # Over budget: the pinned file survives and the least recently used unpinned one goes
+    assert sorted(os.listdir(folder)) == ['a.mp4', 'c.mp4']
+    assert primary.stats()['bytes'] == worker.stats()['bytes'] == 200
+
+    worker.unpin('a.mp4')
+    primary.register(_write(folder, 'd.mp4', 100))
+    assert sorted(os.listdir(folder)) == ['c.mp4', 'd.mp4']
+
+
+def test_workers_share_one_thumbnail_budget(tmp_path):
+    folder = str(tmp_path / 'thumbs')
+    first = SharedThumbnailCache(folder, SharedDB(tmp_path / 'shared.db'), max_bytes=250)
+    second = SharedThumbnailCache(folder, SharedDB(tmp_path / 'shared.db'), max_bytes=250)
+
+    for cache, key in ((first, 'https://a/1.jpg'), (second, 'https://a/2.jpg'), (first, 'https://a/3.jpg')):
+        writer = cache.write(key, {'Content-Type': 'image/jpeg'})
+        writer.write(b'x' * 100)
+        writer.close(True)
+
+    # Entries written by either worker count against one budget and are visible to both
+    assert second.stats()['bytes'] == 200
+    assert first.get('https://a/1.jpg') == (None, False)
+    meta, _ = first.get('https://a/2.jpg')
+    assert meta['content_type'] == 'image/jpeg' and os.path.getsize(meta['path']) == 100
+
+
+def test_format_intermediates_are_not_indexed(tmp_path):
+    folder = str(tmp_path / 'downloads')
+    storage = SharedStorageManager(folder, SharedDB(tmp_path / 'shared.db'), sweep=False, max_bytes=10 ** 6)
+    for name in ('clip.f137.mp4', 'clip.f140.m4a', 'clip.mp4.part', 'clip.mp4'):
+        storage.register(_write(folder, name, 100))
+
+    # Only the merged file counts; yt-dlp removes the per-format parts itself
+    assert storage.stats()['bytes'] == 100
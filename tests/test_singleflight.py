@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, fn, count):
+    """Starts count callers of flight.do(key, fn); returns their (result, shared) or exception."""
+    results = [None] * count
+    def call(i):
+        try: results[i] = flight.do(key, fn)
+        except Exception as e: results[i] = e
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for t in threads: t.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test')
+    release = threading.Event()
+    runs = []
+
+    def extract():
+        runs.append(1)
+        release.wait(5)
+        return {'title': 'clip'}
+
+    threads, results = _run_concurrently(flight, 'reel/x', extract, 5)
+    while flight.stats()['coalesced'] < 4: release.wait(0.01) # Everyone joined the call
+    release.set()
+    for t in threads: t.join()
+
+    assert len(runs) == 1
+    assert all(result == {'title': 'clip'} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert flight.stats() == {'calls': 5, 'executions': 1, 'coalesced': 4, 'in_flight': 0}
+
+    # Nothing is cached: the next call runs again
+    assert flight.do('reel/x', lambda: 'again') == ('again', False)
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight('test')
+    release = threading.Event()
+
+    def extract():
+        release.wait(5)
+        raise ValueError('private post')
+
+    threads, results = _run_concurrently(flight, 'reel/y', extract, 3)
+    while flight.stats()['coalesced'] < 2: release.wait(0.01)
+    release.set()
+    for t in threads: t.join()
+
+    assert all(isinstance(e, ValueError) and str(e) == 'private post' for e in results)
+    with pytest.raises(KeyError): # The failed call isn't remembered either
+        flight.do('reel/y', {}.__getitem__, 'missing')
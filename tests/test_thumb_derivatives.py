@@ -0,0 +1,39 @@
+import io
+import time
+
+import pytest
+
+from thumb_cache import ThumbnailCache
+from thumb_derivatives import DerivativeMaker, derivative_key, derivative_spec
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_spec_snaps_to_the_rendered_widths():
+    assert derivative_spec(None, None) is None
+    assert derivative_spec('abc', None) is None
+    assert derivative_spec('200', 'jpg') == (320, 'jpeg')
+    assert derivative_spec('5000', 'png')[0] == 960
+
+
+def test_render_stores_a_smaller_copy_in_the_cache(tmp_path):
+    cache = ThumbnailCache(tmp_path)
+    source = io.BytesIO()
+    Image.new('RGB', (1080, 1350), (200, 30, 30)).save(source, 'JPEG', quality=95)
+    writer = cache.write('https://cdn/a.jpg', {'Content-Type': 'image/jpeg'})
+    writer.write(source.getvalue())
+    writer.close(True)
+    meta, _ = cache.get('https://cdn/a.jpg')
+
+    maker = DerivativeMaker(cache)
+    spec = (320, 'jpeg')
+    dkey = derivative_key('https://cdn/a.jpg', spec)
+    assert maker.request(meta, dkey, spec)
+    deadline = time.time() + 5
+    while maker.stats()['pending'] and time.time() < deadline: time.sleep(0.01)
+
+    dmeta, _ = cache.get(dkey)
+    assert dmeta['content_type'] == 'image/jpeg'
+    with Image.open(dmeta['path']) as img:
+        assert img.size == (320, 400)
+    assert maker.stats()['bytes_out'] < maker.stats()['bytes_in']
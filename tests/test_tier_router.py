@@ -0,0 +1,76 @@
+import time
+import threading
+
+import pytest
+
+from extraction_engine import ExtractionError
+from provider_race import ProviderRacer
+from tier_router import TierRouter, TierUnavailable, is_tier_failure, OPEN, CLOSED
+
+
+def test_only_tier_failures_count():
+    assert is_tier_failure(ExtractionError('Timeout', 'Extraction exceeded 600s'))
+    assert is_tier_failure(ExtractionError('DownloadError', 'ERROR: HTTP Error 503: Service Unavailable'))
+    assert is_tier_failure(ExtractionError('DownloadError', '<urlopen error [Errno 111] Connection refused>'))
+    assert is_tier_failure(TierUnavailable('GitHub workflow could not be triggered'))
+    assert not is_tier_failure(ExtractionError('DownloadError', 'ERROR: HTTP Error 404: Not Found'))
+    assert not is_tier_failure(ExtractionError('DownloadError', 'ERROR: [Instagram] abc: This content is private'))
+    assert not is_tier_failure(ExtractionError('DownloadError', 'ERROR: Video unavailable. This video has been removed'))
+
+
+def test_content_errors_leave_the_breaker_closed():
+    router = TierRouter({'local': 1}, min_samples=3, failure_threshold=0.5)
+    for _ in range(10): router.record('instagram', 'local', None)
+    assert router.table()['instagram']['local']['state'] == CLOSED
+    assert router.table()['instagram']['local']['content_errors'] == 10
+
+    for _ in range(3): router.record('instagram', 'local', False)
+    assert router.table()['instagram']['local']['state'] == OPEN
+
+
+def test_race_separates_empty_answers_from_failures():
+    racer = ProviderRacer(min_hedge=0.01)
+
+    def down(url, cancel): raise ConnectionError('connection refused')
+    def nothing(url, cancel): return None
+
+    racer.register('down', down)
+    with pytest.raises(ConnectionError):
+        racer.race('https://example.com/p/1', timeout=2)
+
+    racer.register('nothing', nothing)
+    assert racer.race('https://example.com/p/1', timeout=2) == (None, None)
+    time.sleep(0.05) # Done callbacks run on the pool threads
+    stats = racer.stats()
+    assert stats['nothing']['empty'] >= 1 and stats['nothing']['success_rate'] == 1.0
+    assert stats['down']['success_rate'] == 0.0
+
+
+def test_race_times_out_when_nobody_answers():
+    racer = ProviderRacer(min_hedge=0.01)
+    racer.register('slow', lambda url, cancel: time.sleep(1))
+    with pytest.raises(TimeoutError):
+        racer.race('https://example.com/p/1', timeout=0.2)
+
+
+def test_losers_are_told_to_stop():
+    racer = ProviderRacer(min_hedge=0.01)
+    stopped = threading.Event()
+
+    def fast(url, cancel):
+        time.sleep(0.1)
+        return {'hd_url': 'https://cdn/v.mp4'}
+
+    def stuck(url, cancel):
+        # Stands in for a provider blocked on its response body
+        if cancel.wait(5): stopped.set()
+        return None
+
+    racer.register('stuck', stuck)
+    racer.register('fast', fast)
+    racer._stats['stuck'].latencies.append(0.001) # Ranked first, so it is the one left running
+    assert racer.race('https://example.com/p/1', timeout=2)[0] == 'fast'
+    assert stopped.wait(1)
+    time.sleep(0.05)
+    stats = racer.stats()['stuck']
+    assert stats['cancelled'] == 1 and stats['empty'] == 0
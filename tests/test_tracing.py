@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+from tracing import LatencyHistogram, Tracer
+
+
+def test_spans_build_a_nested_timeline_and_feed_histograms():
+    tracer = Tracer()
+    with tracer.trace() as trace:
+        with tracer.span('extract', tier='local'):
+            with tracer.span('probe') as attrs:
+                time.sleep(0.01)
+                attrs['ok'] = False # Soft failure: recorded, not raised
+        with pytest.raises(ValueError):
+            with tracer.span('upload'):
+                raise ValueError('boom')
+    with tracer.span('outside'): pass # No trace: histogram only
+
+    stages = [(s['stage'], s.get('ok', True)) for s in trace.timeline()]
+    assert stages == [('extract', True), ('probe', False), ('upload', False)]
+    assert trace.timeline()[0]['tier'] == 'local'
+    stats = tracer.stats()
+    assert stats['probe']['errors'] == 1 and stats['extract']['errors'] == 0
+    assert stats['outside']['count'] == 1 and len(trace.spans) == 3
+
+
+def test_record_with_an_origin_returns_an_entry_outside_a_trace():
+    tracer = Tracer()
+    assert tracer.record('github_run', 2.0) is None
+    entry = tracer.record('github_run', 2.0, started=105.0, origin=100.0, runner='gh')
+    assert entry == {'stage': 'github_run', 'at_ms': 5000, 'ms': 2000, 'runner': 'gh'}
+
+
+def test_histogram_quantiles_come_from_the_buckets():
+    histogram = LatencyHistogram()
+    for seconds in (0.003, 0.02, 0.02, 0.02, 7):
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.025
+    assert histogram.quantile(0.99) == 7 # Capped at the largest sample
+    assert histogram.snapshot()['count'] == 5
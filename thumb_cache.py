@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+# Query parameters that only sign or route a CDN URL; the same image comes back without them
+VOLATILE_PARAMS = {
+    'oh', 'oe', 'ccb', 'efg', 'edm', 'rs', 'sqp', 'ig_cache_key',
+    '_nc_ohc', '_nc_oc', '_nc_gid', '_nc_ht', '_nc_cat', '_nc_sid', '_nc_zt', '_nc_ss'
+}
+
+
+def normalize_url(url):
+    """Cache key for an image URL: lowercase host, no fragment, no signature params, sorted query."""
+    parts = urllib.parse.urlsplit(url.strip())
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in VOLATILE_PARAMS)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                                    urllib.parse.urlencode(query), ''))
+
+
+class ThumbnailCache:
+    """Size-bounded, disk-backed LRU of proxied thumbnails.
+
+    Each entry is a body file plus a small JSON sidecar holding the upstream
+    Content-Type, ETag and Last-Modified, so the index survives restarts.
+    Bodies are written while they stream to the first client (write()
+    returns a writer that commits on close), and entries older than
+    `revalidate_after` are revalidated upstream with conditional headers
+    instead of being re-downloaded.
+    """
+
+    def __init__(self, folder, max_bytes=256 * 1024 ** 2, max_entry_bytes=5 * 1024 ** 2,
+                 revalidate_after=86400):
+        self.folder = str(folder)
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.revalidate_after = revalidate_after
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.part') or name.endswith('.tmp'):
+                # Interrupted writes from a previous run
+                try: os.remove(os.path.join(self.folder, name))
+                except OSError: pass
+            if not name.endswith('.json'): continue
+            meta_path = os.path.join(self.folder, name)
+            try:
+                with open(meta_path, 'r') as f: meta = json.load(f)
+                meta['path'] = meta_path[:-5]
+                meta['size'] = os.path.getsize(meta['path'])
+                found.append((os.path.getmtime(meta_path), meta['key'], meta))
+            except (OSError, ValueError, KeyError):
+                try: os.remove(meta_path)
+                except OSError: pass
+        for _, key, meta in sorted(found, key=lambda f: f[0]):
+            self._entries[key] = meta
+            self.bytes += meta['size']
+        self._evict()
+
+    def path_for(self, key):
+        return os.path.join(self.folder, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+    # --- Lookup ---
+
+    def get(self, key):
+        """Returns (meta, needs_revalidation) or (None, False). meta['path'] is the body file."""
+        with self._lock:
+            meta = self._entries.get(key)
+            if meta is None:
+                self.misses += 1
+                return None, False
+            if not os.path.exists(meta['path']):
+                self._drop_locked(key)
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(meta), time.time() - meta['checked'] > self.revalidate_after
+
+    def touch(self, key):
+        """Upstream answered 304: the cached body is still current."""
+        with self._lock:
+            meta = self._entries.get(key)
+            if meta is None: return
+            meta['checked'] = time.time()
+            self.revalidated += 1
+            self._write_meta(meta)
+
+    def forget(self, key):
+        """Drops key if its body file is gone, e.g. evicted by another worker after get()."""
+        with self._lock:
+            meta = self._entries.get(key)
+            if meta is not None and not os.path.exists(meta['path']): self._drop_locked(key)
+
+    # --- Filling ---
+
+    def write(self, key, headers):
+        """Returns a writer for a new body. Call .write(chunk) then .close(complete)."""
+        return _Writer(self, {
+            'key': key,
+            'path': self.path_for(key),
+            'content_type': headers.get('Content-Type', 'image/jpeg'),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        })
+
+    def _commit(self, meta, tmp_path, size):
+        if size > self.max_entry_bytes:
+            os.remove(tmp_path)
+            return False
+        meta['size'] = size
+        meta['checked'] = time.time()
+        os.replace(tmp_path, meta['path'])
+        self._write_meta(meta)
+        with self._lock:
+            if meta['key'] in self._entries:
+                self.bytes -= self._entries[meta['key']]['size']
+            self._entries[meta['key']] = meta
+            self._entries.move_to_end(meta['key'])
+            self.bytes += size
+        self._evict()
+        return True
+
+    def _write_meta(self, meta):
+        tmp = f"{meta['path']}.json.{os.getpid()}.tmp" # Workers may rewrite the same sidecar
+        with open(tmp, 'w') as f: json.dump(meta, f)
+        os.replace(tmp, meta['path'] + '.json')
+
+    # --- Eviction ---
+
+    def _drop_locked(self, key):
+        meta = self._entries.pop(key)
+        self.bytes -= meta['size']
+        for path in (meta['path'], meta['path'] + '.json'):
+            try: os.remove(path)
+            except OSError: pass
+
+    def _evict(self):
+        with self._lock:
+            while self.bytes > self.max_bytes and self._entries:
+                self._drop_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop_locked(key)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'evictions': self.evictions
+        }
+
+
+class _Writer:
+    """Streams one body into a temp file; only a complete body is committed."""
+
+    def __init__(self, cache, meta):
+        self.cache = cache
+        self.meta = meta
+        self.tmp_path = f"{meta['path']}.{os.getpid()}-{threading.get_ident()}.part"
+        self.size = 0
+        self.committed = False
+        self._digest = hashlib.md5()
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, chunk):
+        if self._file is None: return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_bytes:
+            self.close(False) # Too big to cache; keep streaming to the client only
+            return
+        self._file.write(chunk)
+        self._digest.update(chunk)
+
+    def close(self, complete=True):
+        if self._file is None: return
+        self._file.close()
+        self._file = None
+        # Upstreams without validators still get a content-based ETag for client 304s
+        if not self.meta['etag']: self.meta['etag'] = f'"{self._digest.hexdigest()}"'
+        try:
+            if complete: self.committed = self.cache._commit(self.meta, self.tmp_path, self.size)
+            else: os.remove(self.tmp_path)
+        except OSError as e:
+            print(f"THUMB CACHE: Could not store {self.meta['key']}: {e}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass # Exists but belongs to someone else
+    return True
+
+
+class SharedThumbnailCache(ThumbnailCache):
+    """ThumbnailCache whose index lives in a SharedDB, so workers share one LRU and byte budget.
+
+    Bodies and JSON sidecars stay on disk as before and seed the table when a
+    worker starts, so the cache still survives a fresh database. Eviction
+    runs inside BEGIN IMMEDIATE, and a hit bumps its access time at most once
+    a minute to keep thumbnail traffic from turning into writes.
+    """
+
+    def __init__(self, folder, db, touch_every=60, **kwargs):
+        self.db = db
+        self.touch_every = touch_every
+        self.db.execute('CREATE TABLE IF NOT EXISTS thumbs (key TEXT PRIMARY KEY, meta TEXT, size INTEGER, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS thumbs_accessed ON thumbs (accessed)')
+        super().__init__(folder, **kwargs)
+
+    def _load_index(self):
+        rows = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.part'):
+                # Interrupted writes of dead workers ('<body>.<pid>-<thread>.part'); live ones are still streaming
+                pid = name.rsplit('.', 2)[-2].split('-')[0]
+                if not pid.isdigit() or not _pid_alive(int(pid)):
+                    try: os.remove(os.path.join(self.folder, name))
+                    except OSError: pass
+            if not name.endswith('.json'): continue
+            meta_path = os.path.join(self.folder, name)
+            try:
+                with open(meta_path, 'r') as f: meta = json.load(f)
+                meta['path'] = meta_path[:-5]
+                meta['size'] = os.path.getsize(meta['path'])
+                rows.append((meta['key'], json.dumps(meta), meta['size'], os.path.getmtime(meta_path)))
+            except (OSError, ValueError, KeyError):
+                continue # Possibly mid-write by another worker; never delete here
+        with self.db.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO thumbs VALUES (?, ?, ?, ?)', rows)
+        self._evict()
+
+    # --- Lookup ---
+
+    def get(self, key):
+        row = self.db.execute('SELECT meta, accessed FROM thumbs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None, False
+        meta = json.loads(row[0])
+        if not os.path.exists(meta['path']):
+            self._drop(key, meta)
+            self.misses += 1
+            return None, False
+        now = time.time()
+        if now - row[1] > self.touch_every:
+            self.db.execute('UPDATE thumbs SET accessed = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return meta, now - meta['checked'] > self.revalidate_after
+
+    def touch(self, key):
+        row = self.db.execute('SELECT meta FROM thumbs WHERE key = ?', (key,)).fetchone()
+        if row is None: return
+        meta = json.loads(row[0])
+        meta['checked'] = time.time()
+        self.db.execute('UPDATE thumbs SET meta = ? WHERE key = ?', (json.dumps(meta), key))
+        self.revalidated += 1
+        self._write_meta(meta)
+
+    def forget(self, key):
+        row = self.db.execute('SELECT meta FROM thumbs WHERE key = ?', (key,)).fetchone()
+        if row is None: return
+        meta = json.loads(row[0])
+        if not os.path.exists(meta['path']): self._drop(key, meta)
+
+    # --- Filling ---
+
+    def _commit(self, meta, tmp_path, size):
+        if size > self.max_entry_bytes:
+            os.remove(tmp_path)
+            return False
+        meta['size'] = size
+        meta['checked'] = time.time()
+        os.replace(tmp_path, meta['path'])
+        self._write_meta(meta)
+        self.db.execute(
+            'INSERT INTO thumbs VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+            'meta = excluded.meta, size = excluded.size, accessed = excluded.accessed',
+            (meta['key'], json.dumps(meta), size, time.time())
+        )
+        self._evict()
+        return True
+
+    # --- Eviction ---
+
+    def _drop(self, key, meta):
+        self.db.execute('DELETE FROM thumbs WHERE key = ?', (key,))
+        for path in (meta['path'], meta['path'] + '.json'):
+            try: os.remove(path)
+            except OSError: pass
+
+    def _evict(self):
+        victims = []
+        with self.db.transaction() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM thumbs').fetchone()[0]
+            if total > self.max_bytes:
+                for key, meta, size in conn.execute('SELECT key, meta, size FROM thumbs ORDER BY accessed').fetchall():
+                    if total <= self.max_bytes: break
+                    victims.append((key, json.loads(meta)))
+                    total -= size
+                conn.executemany('DELETE FROM thumbs WHERE key = ?', [(key,) for key, _ in victims])
+        for key, meta in victims:
+            self._drop(key, meta)
+        self.evictions += len(victims)
+
+    def clear(self):
+        for key, meta in self.db.execute('SELECT key, meta FROM thumbs').fetchall():
+            self._drop(key, json.loads(meta))
+
+    def stats(self):
+        entries, total = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM thumbs').fetchone()
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'backend': 'sqlite',
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidated': self.revalidated,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,108 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, features
+except ImportError: # Optional: without Pillow /proxy-img just serves originals
+    Image = None
+
+# Widths we render; requests snap up to the next one so variants stay bounded
+WIDTHS = (160, 320, 480, 640, 960)
+FORMATS = {'webp': ('WEBP', 'image/webp'), 'jpeg': ('JPEG', 'image/jpeg')}
+
+
+def derivative_spec(width, fmt):
+    """Validates ?w=&fmt= into (width, fmt), or None if no derivative was asked for."""
+    if not width and not fmt: return None
+    try:
+        width = int(width or 320)
+    except ValueError:
+        return None
+    width = next((w for w in WIDTHS if w >= width), WIDTHS[-1])
+    fmt = (fmt or 'webp').lower().replace('jpg', 'jpeg')
+    if fmt not in FORMATS: fmt = 'webp'
+    if fmt == 'webp' and Image is not None and not features.check('webp'): fmt = 'jpeg'
+    return width, fmt
+
+
+def derivative_key(key, spec):
+    return f"{key}#w={spec[0]}&fmt={spec[1]}"
+
+
+class DerivativeMaker:
+    """Renders downscaled, re-encoded thumbnails on a small bounded pool.
+
+    Derivatives are stored in the same ThumbnailCache as the originals (under
+    a key suffixed with the width and format), so they share its LRU budget.
+    request() never blocks: it queues a render unless one is already pending
+    for that key or `max_pending` renders are queued, and the caller keeps
+    serving the original until the derivative shows up in the cache.
+    """
+
+    def __init__(self, cache, workers=2, max_pending=64, quality=72):
+        self.cache = cache
+        self.max_pending = max_pending
+        self.quality = quality
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def request(self, source_meta, dkey, spec):
+        """Queues a render of source_meta's file; returns False if it was not queued."""
+        if not self.available: return False
+        with self._lock:
+            if dkey in self._pending: return True
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending.add(dkey)
+        self._pool.submit(self._render, source_meta, dkey, spec)
+        return True
+
+    def _render(self, source_meta, dkey, spec):
+        width, fmt = spec
+        pil_format, content_type = FORMATS[fmt]
+        try:
+            with Image.open(source_meta['path']) as img:
+                # JPEG can decode straight at a reduced scale, which is most of the win
+                img.draft('RGB', (width, width * 4))
+                img.thumbnail((width, width * 4))
+                if pil_format == 'JPEG' and img.mode != 'RGB': img = img.convert('RGB')
+                elif img.mode not in ('RGB', 'RGBA'): img = img.convert('RGBA')
+                out = io.BytesIO()
+                img.save(out, pil_format, quality=self.quality, **({'method': 4} if fmt == 'webp' else {'optimize': True}))
+            body = out.getvalue()
+            writer = self.cache.write(dkey, {'Content-Type': content_type})
+            writer.write(body)
+            writer.close(True)
+            with self._lock:
+                self.rendered += 1
+                self.bytes_in += source_meta.get('size', 0)
+                self.bytes_out += len(body)
+        except Exception as e:
+            self.failed += 1
+            print(f"THUMB ERROR: Could not render {dkey}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(dkey)
+
+    def stats(self):
+        return {
+            'available': self.available,
+            'pending': len(self._pending),
+            'rendered': self.rendered,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out
+        }
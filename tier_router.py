@@ -0,0 +1,171 @@
+import time
+import random
+import threading
+from collections import deque
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# Failures that say the tier itself is unhealthy. Anything else (404, private or
+# deleted posts, unsupported URLs, bad input) is about the post and never trips a breaker.
+TRANSPORT_ERROR_TYPES = {
+    'Timeout', 'Busy', 'WorkerCrashed', 'TimeoutError', 'ConnectionError', 'ConnectTimeout',
+    'ReadTimeout', 'SSLError', 'ProxyError', 'ChunkedEncodingError', 'TierUnavailable'
+}
+TRANSPORT_MARKERS = (
+    'timed out', 'timeout', 'connection reset', 'connection refused', 'connection aborted',
+    'remote end closed', 'name resolution', 'network is unreachable', 'http error 5',
+    'bad gateway', 'service unavailable', 'internal server error'
+)
+
+
+class TierUnavailable(Exception):
+    """Raised by a tier whose backend failed (transport error, 5xx or timeout)."""
+
+
+def is_tier_failure(error):
+    """True if an exception should count toward the tier's breaker.
+
+    ExtractionErrors are judged by their error_type; yt-dlp wraps network and
+    content failures alike in DownloadError, so the message decides for those.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)): return True
+    if getattr(error, 'error_type', type(error).__name__) in TRANSPORT_ERROR_TYPES: return True
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSPORT_MARKERS)
+
+
+class _TierState:
+    def __init__(self, window, prior_latency):
+        self.outcomes = deque(maxlen=window)   # True/False per attempt
+        self.latencies = deque(maxlen=window)  # Seconds to success
+        self.prior_latency = prior_latency
+        self.state = CLOSED
+        self.opened_at = 0
+        self.open_seconds = 0
+        self.attempts = 0
+        self.skipped = 0
+        self.content_errors = 0
+
+    def success_rate(self):
+        # Two virtual successes keep one early failure from burying a tier
+        return (sum(self.outcomes) + 2) / (len(self.outcomes) + 2)
+
+    def failure_rate(self):
+        if not self.outcomes: return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def mean_latency(self):
+        if not self.latencies: return self.prior_latency
+        return sum(self.latencies) / len(self.latencies)
+
+    def expected_time(self):
+        """Rough expected time to a success: latency inflated by the failure rate."""
+        return self.mean_latency() / max(self.success_rate(), 0.05)
+
+
+class TierRouter:
+    """Orders download tiers per platform and trips circuit breakers on failing ones.
+
+    Every attempt is recorded per (platform, tier). When a tier's rolling
+    failure rate crosses `failure_threshold` (after `min_samples` attempts)
+    its breaker opens and plan() skips it. After the open period the breaker
+    goes half-open and only `probe_ratio` of requests try it; a probe success
+    closes the breaker, a failure re-opens it for twice as long (capped at
+    `max_open_seconds`). Remaining tiers are ordered by expected time to
+    success, so the fixed chain only applies until we have data; the same
+    `probe_ratio` of requests keeps the fixed order so slower-ranked tiers
+    still get fresh samples. Only tier failures (see is_tier_failure()) count;
+    an attempt that failed because of the post itself is recorded with
+    ok=None and leaves the breaker alone.
+    """
+
+    def __init__(self, prior_latency, window=50, failure_threshold=0.6, min_samples=5,
+                 open_seconds=60, max_open_seconds=900, probe_ratio=0.1):
+        self.prior_latency = prior_latency
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.min_samples = min_samples
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_ratio = probe_ratio
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, platform, tier):
+        key = (platform, tier)
+        if key not in self._states:
+            self._states[key] = _TierState(self.window, self.prior_latency.get(tier, 10))
+        return self._states[key]
+
+    def plan(self, platform, tiers):
+        """Tiers to try, in order. Falls back to the full chain if every breaker is open."""
+        now = time.time()
+        allowed = []
+        with self._lock:
+            for tier in tiers:
+                state = self._state(platform, tier)
+                if state.state == OPEN and now - state.opened_at >= state.open_seconds:
+                    state.state = HALF_OPEN
+                if state.state == CLOSED or (state.state == HALF_OPEN and random.random() < self.probe_ratio):
+                    allowed.append(tier)
+                else:
+                    state.skipped += 1
+            if not allowed:
+                return list(tiers)
+            if random.random() < self.probe_ratio:
+                return allowed
+            # Stable sort keeps the configured chain order for ties/no data
+            return sorted(allowed, key=lambda t: self._state(platform, t).expected_time())
+
+    def record(self, platform, tier, ok, latency=None):
+        """Records one attempt and updates the breaker (ok=None: content/user error, breaker untouched)."""
+        with self._lock:
+            state = self._state(platform, tier)
+            state.attempts += 1
+            if ok is None:
+                state.content_errors += 1
+                return
+            state.outcomes.append(ok)
+            if ok and latency is not None:
+                state.latencies.append(latency)
+
+            if state.state == HALF_OPEN:
+                if ok:
+                    state.state = CLOSED
+                    state.outcomes.clear()
+                    state.outcomes.append(True)
+                else:
+                    self._open_locked(platform, tier, state, min(self.max_open_seconds, state.open_seconds * 2))
+            elif state.state == CLOSED and len(state.outcomes) >= self.min_samples:
+                if state.failure_rate() >= self.failure_threshold:
+                    self._open_locked(platform, tier, state, self.base_open_seconds)
+
+    def record_latency(self, platform, tier, latency):
+        """Adds a late latency sample (e.g. GitHub callback arriving minutes later)."""
+        with self._lock:
+            self._state(platform, tier).latencies.append(latency)
+
+    def _open_locked(self, platform, tier, state, seconds):
+        state.state = OPEN
+        state.opened_at = time.time()
+        state.open_seconds = seconds
+        print(f"ROUTER: {platform}/{tier} circuit opened for {seconds}s (failure rate {state.failure_rate():.0%})")
+
+    def table(self):
+        """Current routing table: per platform, tiers with breaker state and stats."""
+        out = {}
+        with self._lock:
+            for (platform, tier), state in self._states.items():
+                out.setdefault(platform, {})[tier] = {
+                    'state': state.state,
+                    'success_rate': round(state.success_rate(), 3),
+                    'mean_latency': round(state.mean_latency(), 2),
+                    'expected_time': round(state.expected_time(), 2),
+                    'attempts': state.attempts,
+                    'skipped': state.skipped,
+                    'content_errors': state.content_errors,
+                    'reopens_in': max(0, round(state.opened_at + state.open_seconds - time.time(), 1)) if state.state == OPEN else 0
+                }
+        for platform, tiers in out.items():
+            out[platform] = dict(sorted(tiers.items(), key=lambda kv: kv[1]['expected_time']))
+        return out
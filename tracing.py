@@ -0,0 +1,136 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds (5 ms up to the 10 minute extraction timeout)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 600)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; quantiles are read off the buckets, no samples are kept."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot catches everything above the top bucket
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, ok=True):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if not ok: self.errors += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (capped at the largest sample)."""
+        if not self.count: return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        ms = lambda s: round(s * 1000, 1) if s is not None else None
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': ms(self.total / self.count) if self.count else None,
+            'p50_ms': ms(self.quantile(0.5)),
+            'p90_ms': ms(self.quantile(0.9)),
+            'p99_ms': ms(self.quantile(0.99)),
+            'max_ms': ms(self.max),
+            'buckets': {
+                **{f"{int(b * 1000)}ms": n for b, n in zip(self.buckets, self.counts)},
+                'inf': self.counts[-1]
+            }
+        }
+
+
+class Trace:
+    """Spans collected for one job, as offsets from the job's creation time."""
+
+    def __init__(self, origin, max_spans):
+        self.origin = origin
+        self.max_spans = max_spans
+        self.spans = []
+
+    def add(self, entry):
+        # A job retried through many tiers keeps its first max_spans spans
+        if len(self.spans) < self.max_spans: self.spans.append(entry)
+
+    def timeline(self):
+        """Spans by start time; an enclosing span sorts before the ones it contains."""
+        # Spans are added as they finish, so on a tie the later one is the enclosing span
+        order = sorted(range(len(self.spans)), key=lambda i: (self.spans[i]['at_ms'], -self.spans[i]['ms'], -i))
+        return [self.spans[i] for i in order]
+
+
+class Tracer:
+    """Per-stage latency spans: process-wide histograms plus per-job timelines.
+
+    span(stage) times a block and feeds the stage's histogram. While the
+    calling thread is inside trace(origin) the span is also appended to that
+    trace, which the caller stores on the job record. Durations measured
+    somewhere else (the extraction process, a GitHub runner) are fed in with
+    record(). Timeline entries are {'stage', 'at_ms', 'ms'} plus any extra
+    attributes; 'ok': False marks a stage that failed. Histograms are per
+    process, like every other counter in /api/admin/metrics.
+    """
+
+    def __init__(self, max_spans=64):
+        self.max_spans = max_spans
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def trace(self, origin=None):
+        """Collects every span of the calling thread until the block exits."""
+        trace = Trace(origin or time.time(), self.max_spans)
+        previous = getattr(self._local, 'trace', None)
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = previous
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """Times the block. Yields the attribute dict; setting attrs['ok'] = False marks a soft failure."""
+        started = time.time()
+        ok = True
+        try:
+            yield attrs
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            extra = {k: v for k, v in attrs.items() if k != 'ok'}
+            self.record(stage, time.time() - started, started=started, ok=attrs.get('ok', ok), **extra)
+
+    def record(self, stage, seconds, started=None, ok=True, origin=None, **attrs):
+        """Adds one measured span; returns its timeline entry (None outside a trace and without origin)."""
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None: histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.observe(seconds, ok)
+        # An explicit origin builds an entry for a record outside this thread's trace
+        trace = getattr(self._local, 'trace', None) if origin is None else None
+        if trace is not None: origin = trace.origin
+        elif origin is None: return None
+        started = time.time() - seconds if started is None else started
+        entry = {'stage': stage, 'at_ms': round((started - origin) * 1000), 'ms': round(seconds * 1000), **attrs}
+        if not ok: entry['ok'] = False
+        if trace is not None: trace.add(entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {stage: self._histograms[stage].snapshot() for stage in sorted(self._histograms)}